@@ -0,0 +1,417 @@
+"""
+Database-backed background jobs for LLM work that is too slow for a request
+(summarizing and indexing documents, titling chats, summarizing chat history).
+
+Views enqueue a Job and return immediately; `python manage.py run_jobs`
+claims jobs in priority order and runs the handler registered for job.kind.
+No broker is needed: the Job table is the queue.
+"""
+
+import logging
+import re
+import traceback
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from chat.models import Chat, Document, Job, Message, UserSettings
+from chat.llm_utils.history import fold_history
+from chat.llm_utils.indexing import index_document
+from chat.llm_utils.ingestion import BatchFile, ingest_stored
+from chat.llm_utils.summarization import summarizer
+from chat.llm_utils.vertex import get_gcp_embeddings, get_text_llm
+
+log = logging.getLogger(__name__)
+
+# Maps Job.kind to a function taking the Job
+HANDLERS = {}
+
+# Seconds to wait before retry n is 2**n * RETRY_BACKOFF
+RETRY_BACKOFF = 15
+
+# Chats titled by one LLM prompt
+TITLE_BATCH_SIZE = 10
+# A chat that a title_chats job took on, but that is still untitled (e.g. the
+# job failed), is only queued again after this long
+TITLE_RETRY_AFTER = timedelta(hours=1)
+# Characters of each chat (from its first messages) shown to the LLM
+TITLE_CONTEXT_CHARS = 500
+TITLE_PROMPT = """Write a concise title (1-4 words) for the following chat. You must respond with at least one word:
+{text}
+TITLE: """
+TITLES_PROMPT = """Write a concise title (1-4 words) for each of the following {count} chats. Respond with one line per chat, in the same order, formatted as "<chat number>. <title>".
+
+{chats}
+
+TITLES:
+1."""
+# "3. Some title" (or "3) ...", "Chat 3: ...") in a TITLES_PROMPT response
+NUMBERED_TITLE = re.compile(r"^\s*(?:chat\s*)?(\d+)\s*[.):-]\s*(.+)$", re.IGNORECASE)
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+def enqueue(kind, document=None, user=None, priority=Job.INTERACTIVE, **args):
+    """
+    Create a Job, or return the existing pending/running one for the same
+    kind and document so repeated clicks don't queue duplicate work
+    """
+    existing = (
+        Job.objects.filter(
+            kind=kind,
+            document=document,
+            status__in=[Job.PENDING, Job.RUNNING],
+        )
+        .order_by("-created_at")
+        .first()
+    )
+    if existing is not None and document is not None:
+        # An interactive request can bump queued batch work up the queue
+        if priority < existing.priority:
+            Job.objects.filter(id=existing.id).update(priority=priority)
+            existing.priority = priority
+        return existing
+    return Job.objects.create(
+        kind=kind,
+        document=document,
+        user=user or (document.user if document else None),
+        priority=priority,
+        args=args,
+    )
+
+
+def enqueue_many(kind, documents, priority=Job.BATCH):
+    """
+    enqueue() for many documents in two queries. Returns a dict of
+    document id -> the pending/running job of kind for that document.
+    """
+    jobs = {
+        job.document_id: job
+        for job in Job.objects.filter(
+            kind=kind,
+            document__in=documents,
+            status__in=[Job.PENDING, Job.RUNNING],
+        )
+    }
+    new_jobs = Job.objects.bulk_create(
+        [
+            Job(kind=kind, document=doc, user=doc.user, priority=priority)
+            for doc in documents
+            if doc.id not in jobs
+        ]
+    )
+    jobs.update((job.document_id, job) for job in new_jobs)
+    return jobs
+
+
+def claim_next(worker_name, max_priority=None):
+    """
+    Atomically mark the highest priority runnable job as running and return it
+    """
+    with transaction.atomic():
+        jobs = Job.objects.filter(status=Job.PENDING, run_after__lte=timezone.now())
+        if max_priority is not None:
+            jobs = jobs.filter(priority__lte=max_priority)
+        jobs = jobs.order_by("priority", "run_after", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        job = jobs.first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.worker = worker_name
+        job.attempts += 1
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(
+            update_fields=["status", "worker", "attempts", "started_at", "heartbeat_at"]
+        )
+    return job
+
+
+def requeue_stale(older_than):
+    """
+    Return jobs stuck in "running" (e.g. their worker was killed), with no
+    heartbeat for older_than, to the queue. Those that have used up their
+    attempts fail instead. Returns the number of jobs requeued and failed.
+    """
+    cutoff = timezone.now() - older_than
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED,
+        error="The worker running the job stopped responding",
+        finished_at=timezone.now(),
+    )
+    requeued = stale.update(status=Job.PENDING, worker="")
+    return requeued, failed
+
+
+def set_progress(job, progress, message=""):
+    # Also the job's heartbeat, so a long job isn't taken for a dead one
+    job.progress = progress
+    job.progress_message = message
+    job.heartbeat_at = timezone.now()
+    Job.objects.filter(id=job.id).update(
+        progress=progress, progress_message=message, heartbeat_at=job.heartbeat_at
+    )
+
+
+def run_job(job):
+    try:
+        HANDLERS[job.kind](job)
+    except Exception:
+        error = traceback.format_exc()
+        log.exception(f"{job} failed (attempt {job.attempts}/{job.max_attempts})")
+        job.error = error
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(
+                seconds=2**job.attempts * RETRY_BACKOFF
+            )
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+        job.save(update_fields=["status", "error", "run_after", "finished_at"])
+        return
+    job.status = Job.DONE
+    job.progress = 100
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "progress", "finished_at"])
+
+
+def summarize(document, progress=None):
+    summary = summarizer.summarize(document, progress)
+    # Sometimes the summarizer returns an empty string
+    if summary == "":
+        summary = document.file.name
+    return summary
+
+
+def generate_title(document):
+    if document.text_length < 10:
+        return document.file.name
+    text = f"Filename: {document.file.name}\n\nContent (first 5,000 characters): {document.read_text(0, 5000)}"
+    prompt = f"""
+    Write a concise title (1-5 words) for the following document. You must respond with at least one word:
+    {text}
+    1-5 WORD TITLE: """
+    return get_text_llm()(prompt)[:255]
+
+
+@handler("summary")
+def summary_job(job):
+    doc = job.document
+    set_progress(job, 10, "Generating title")
+    title = generate_title(doc)
+    set_progress(job, 30, "Summarizing")
+    summary = summarize(
+        doc,
+        progress=lambda fraction: set_progress(
+            job, 30 + int(fraction * 60), f"Summarized {int(fraction * 100)}%"
+        ),
+    )
+    set_progress(job, 90, "Embedding summary")
+    # Add the document filename to the summary for embedding
+    summary_for_embedding = title + "\n" + doc.file.name + "\n\n" + summary
+    summary_embedding = get_gcp_embeddings().embed_documents([summary_for_embedding])[0]
+    Document.objects.filter(id=doc.id).update(
+        summary=summary,
+        title=title,
+        summary_embedding=summary_embedding,
+    )
+    # Index the document next, even if the user has navigated away
+    if doc.mean_embedding is None:
+        enqueue("embeddings", document=doc, priority=job.priority)
+
+
+def untitled_chats(user):
+    """
+    The user's chats that are listed in the sidebar (more than one message)
+    but haven't been titled yet, nor taken on by a title_chats job within
+    TITLE_RETRY_AFTER
+    """
+    return Chat.sidebar_chats(user).filter(
+        Q(title_attempted_at__isnull=True)
+        | Q(title_attempted_at__lt=timezone.now() - TITLE_RETRY_AFTER),
+        title="",
+    )
+
+
+def enqueue_chat_titles(user):
+    """
+    Make sure the user's untitled chats will be titled, if any are left that
+    no job has taken on (or failed to title) recently. A job that has started
+    only titles the chats it took on, so only one that hasn't is reused.
+    Returns the job, or None if there is nothing to title.
+    """
+    if not untitled_chats(user).exists():
+        return None
+    job = Job.objects.filter(kind="title_chats", user=user, status=Job.PENDING).exclude(
+        args__has_key="chat_ids"
+    )
+    return job.first() or Job.objects.create(kind="title_chats", user=user)
+
+
+def chat_text(chat):
+    messages = Message.objects.filter(chat=chat).order_by("timestamp")[:5]
+    return "\n".join(message.message for message in messages)[:TITLE_CONTEXT_CHARS]
+
+
+def clean_title(title):
+    return title.strip().strip("\"'*").strip()[:255]
+
+
+def parse_titles(response, count):
+    """
+    Titles from a TITLES_PROMPT response (the "1." the prompt ends with
+    included), by chat number from 0; chats the LLM skipped are missing
+    """
+    if not NUMBERED_TITLE.match(response.split("\n", 1)[0]):
+        response = "1." + response
+    titles = {}
+    for line in response.splitlines():
+        match = NUMBERED_TITLE.match(line)
+        if match and 1 <= int(match.group(1)) <= count:
+            title = clean_title(match.group(2))
+            if title:
+                titles.setdefault(int(match.group(1)) - 1, title)
+    return titles
+
+
+def title_chats(chats):
+    """
+    Set the titles of chats, TITLE_BATCH_SIZE chats per LLM prompt. Chats a
+    batch response has no title for get a prompt of their own.
+    """
+    texts = [chat_text(chat) for chat in chats]
+    batches = [
+        list(range(i, min(i + TITLE_BATCH_SIZE, len(chats))))
+        for i in range(0, len(chats), TITLE_BATCH_SIZE)
+    ]
+    responses = summarizer.complete_many(
+        [
+            TITLES_PROMPT.format(
+                count=len(batch),
+                chats="\n\n".join(
+                    f"Chat {n}:\n{texts[i]}" for n, i in enumerate(batch, 1)
+                ),
+            )
+            for batch in batches
+        ]
+    )
+    titles = {}
+    for batch, response in zip(batches, responses):
+        for n, title in parse_titles(response, len(batch)).items():
+            titles[batch[n]] = title
+    missing = [i for i in range(len(chats)) if i not in titles]
+    if missing:
+        log.info(f"Titling {len(missing)} of {len(chats)} chats one by one")
+        for i, response in zip(
+            missing,
+            summarizer.complete_many(
+                [TITLE_PROMPT.format(text=texts[i]) for i in missing]
+            ),
+        ):
+            titles[i] = clean_title(response)
+    for i, chat in enumerate(chats):
+        # Titles are only generated once, so don't leave a chat blank
+        chat.title = titles[i] or texts[i][:40].strip() or "Untitled chat"
+    Chat.objects.bulk_update(chats, ["title"], batch_size=100)
+    for user_id in {chat.user_id for chat in chats}:
+        Chat.sidebar_changed(user_id)
+
+
+@handler("title_chats")
+def title_chats_job(job):
+    if "chat_ids" not in job.args:
+        # Taken on by this job (and its retries), so page loads don't queue
+        # them again meanwhile, nor right after it fails
+        chat_ids = list(untitled_chats(job.user).values_list("id", flat=True))
+        Chat.objects.filter(id__in=chat_ids).update(title_attempted_at=timezone.now())
+        job.args["chat_ids"] = chat_ids
+        Job.objects.filter(id=job.id).update(args=job.args)
+    chats = list(Chat.objects.filter(id__in=job.args["chat_ids"], title=""))
+    set_progress(job, 10, f"Titling {len(chats)} chats")
+    if chats:
+        title_chats(chats)
+
+
+def enqueue_chat_fold(chat):
+    """
+    Make sure the older turns of chat will be folded into its running
+    summary. As for titles, only a pending job is reused.
+    """
+    job = Job.objects.filter(
+        kind="fold_chat_history", args__chat_id=chat.id, status=Job.PENDING
+    )
+    return job.first() or Job.objects.create(
+        kind="fold_chat_history", user_id=chat.user_id, args={"chat_id": chat.id}
+    )
+
+
+@handler("fold_chat_history")
+def fold_chat_history_job(job):
+    chat = Chat.objects.filter(id=job.args["chat_id"]).first()
+    if chat is None:
+        return  # Deleted since
+    user_settings = UserSettings.objects.filter(user_id=chat.user_id).first()
+    set_progress(job, 10, "Summarizing older messages")
+    folded = fold_history(chat, user_settings or UserSettings())
+    log.info(f"Chat {chat.id}: {folded} messages added to the running summary")
+
+
+@handler("embeddings")
+def embeddings_job(job):
+    doc = Document.objects.get(id=job.document_id)
+    set_progress(job, 5, "Indexing")
+    stats = index_document(
+        doc,
+        progress=lambda fraction: set_progress(
+            job, 5 + int(fraction * 95), f"Indexed {int(fraction * 100)}% of text"
+        ),
+    )
+    set_progress(
+        job,
+        100,
+        f"{stats['embedded']} chunks embedded, {stats['reused']} reused, "
+        f"{stats['deleted']} deleted",
+    )
+
+
+@handler("ingest_batch")
+def ingest_batch_job(job):
+    # Files of a batch upload, already in storage (see stage_batch)
+    files = [
+        BatchFile(f["name"], stored_name=f["stored_name"]) for f in job.args["files"]
+    ]
+    set_progress(job, 5, f"Reading {len(files)} files")
+    with TemporaryDirectory() as directory:
+        ingest_stored(
+            job.user,
+            files,
+            directory,
+            progress=lambda done, name: set_progress(
+                job,
+                5 + int(done / len(files) * 90),
+                f"Read {done} of {len(files)} files",
+            ),
+        )
+    documents = [f.document for f in files if not f.error]
+    enqueue_many("summary", documents, priority=Job.BATCH)
+    job.args["results"] = [
+        {
+            "name": f.name,
+            "error": f.error,
+            "document_id": None if f.error else f.document.id,
+        }
+        for f in files
+    ]
+    job.save(update_fields=["args"])
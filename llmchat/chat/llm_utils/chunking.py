@@ -0,0 +1,182 @@
+"""
+Token budget chunking: chunks are packed with whole sentences up to a number
+of tokens (as counted by a real tokenizer), rather than up to a number of
+characters, so every chunk makes full use of an embedding call and none is
+truncated by the model.
+
+Texts are tokenized in batches by a fast (Rust) tokenizer. Only the token
+counts at sentence boundaries are read back from it, and chunks are packed by
+binary search over those cumulative counts, so chunking costs little more
+than the tokenization itself.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+
+import numpy as np
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+# Token budget of new documents (recorded on Document.chunk_size/chunk_overlap)
+CHUNK_TOKENS = settings.CHUNK_TOKENS
+CHUNK_OVERLAP_TOKENS = settings.CHUNK_OVERLAP_TOKENS
+# textembedding-gecko input limit; longer input is truncated
+MAX_CHUNK_TOKENS = 3072
+# Estimate used when no tokenizer is configured
+CHARS_PER_TOKEN = 4
+# A chunk may end after a sentence (closing quotes/brackets included) or a line
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n\s*")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def tokenizer():
+    """
+    The tokenizer saved at settings.CHUNK_TOKENIZER, loaded on first use, or
+    None if CHUNK_TOKENIZER is empty or the file is missing. It is only read
+    from that file, never downloaded; without it, tokens are estimated from
+    the number of characters (and a warning is logged).
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            path = settings.CHUNK_TOKENIZER
+            if not path:
+                log.warning(
+                    "No CHUNK_TOKENIZER: estimating %d characters per token",
+                    CHARS_PER_TOKEN,
+                )
+                _tokenizer = False
+            elif not os.path.isfile(path):
+                log.warning(
+                    "CHUNK_TOKENIZER %s doesn't exist (save a tokenizer there "
+                    "with `python manage.py fetch_tokenizer`): estimating %d "
+                    "characters per token",
+                    path,
+                    CHARS_PER_TOKEN,
+                )
+                _tokenizer = False
+            else:
+                from tokenizers import Tokenizer
+
+                _tokenizer = Tokenizer.from_file(path)
+        return _tokenizer or None
+
+
+def estimate_tokens(length):
+    # Tokens of a text of length characters, when there's no tokenizer
+    return math.ceil(length / CHARS_PER_TOKEN)
+
+
+class Tokens:
+    """
+    Maps between character positions of a text and its tokens
+    """
+
+    def __init__(self, text, encoding=None):
+        self.text_length = len(text)
+        self.encoding = encoding
+
+    def __len__(self):
+        if self.encoding is None:
+            return estimate_tokens(self.text_length)
+        return len(self.encoding)
+
+    def tokens_before(self, position):
+        """
+        Number of tokens that start before character position
+        """
+        if self.encoding is None:
+            return math.ceil(position / CHARS_PER_TOKEN)
+        # Characters not covered by any token (e.g. dropped by the
+        # normalizer) count with the next token
+        while position < self.text_length:
+            token = self.encoding.char_to_token(position)
+            if token is not None:
+                if self.encoding.token_to_chars(token)[0] < position:
+                    token += 1  # position is inside token
+                return token
+            position += 1
+        return len(self)
+
+    def start(self, token):
+        """
+        Character position where token starts
+        """
+        if self.encoding is None:
+            return token * CHARS_PER_TOKEN
+        return self.encoding.token_to_chars(token)[0]
+
+
+def tokenize(texts):
+    """
+    Return Tokens for each of texts, encoded in one batch (in parallel)
+    """
+    backend = tokenizer()
+    if backend is None:
+        return [Tokens(text) for text in texts]
+    encodings = backend.encode_batch(texts, add_special_tokens=False)
+    return [Tokens(text, encoding) for text, encoding in zip(texts, encodings)]
+
+
+def count_tokens(texts):
+    return [len(tokens) for tokens in tokenize(texts)]
+
+
+def chunk_spans(
+    text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, tokens=None
+):
+    """
+    Return (start, end) spans of text, each at most chunk_tokens tokens of
+    whole sentences (a sentence longer than that is cut between tokens).
+    Consecutive chunks share up to overlap_tokens tokens of sentences.
+    Whitespace at either end of a chunk is left out of its span.
+    tokens is the Tokens of text, if already tokenized.
+    """
+    chunk_tokens = max(1, min(chunk_tokens, MAX_CHUNK_TOKENS))
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    if tokens is None:
+        (tokens,) = tokenize([text])
+    if not len(tokens):
+        return []
+
+    # Sentence boundaries, with more cut into sentences over the budget
+    boundaries = [0]
+    tokens_before = [0]
+    for position in [m.end() for m in SENTENCE_END.finditer(text)] + [len(text)]:
+        count = tokens.tokens_before(position)
+        if count <= tokens_before[-1]:
+            continue
+        for token in range(tokens_before[-1] + chunk_tokens, count, chunk_tokens):
+            boundaries.append(tokens.start(token))
+            tokens_before.append(token)
+        boundaries.append(position)
+        tokens_before.append(count)
+    # A chunk from boundary i to j has tokens_before[j] - tokens_before[i] tokens
+    tokens_before = np.array(tokens_before)
+
+    spans = []
+    last = len(boundaries) - 1
+    i = 0
+    while i < last:
+        j = np.searchsorted(tokens_before, tokens_before[i] + chunk_tokens, "right")
+        j = max(min(int(j) - 1, last), i + 1)
+        start, end = boundaries[i], boundaries[j]
+        chunk = text[start:end]
+        stripped = chunk.strip()
+        if stripped:
+            start += len(chunk) - len(chunk.lstrip())
+            spans.append((start, start + len(stripped)))
+        if j == last:
+            break
+        # The next chunk starts with the sentences that fit in the overlap
+        overlap_from = np.searchsorted(
+            tokens_before, tokens_before[j] - overlap_tokens, "left"
+        )
+        i = min(max(int(overlap_from), i + 1), j)
+    return spans
@@ -0,0 +1,171 @@
+"""
+The Vertex AI embeddings client, with the EmbeddingCache in front of it.
+
+Importing this module imports langchain and the Vertex AI SDK, which takes
+seconds; use chat.llm_utils.vertex.get_gcp_embeddings() for the shared
+client rather than importing it at startup.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+from langchain.embeddings import VertexAIEmbeddings
+from pydantic import BaseModel
+
+from chat.models import EmbeddingCache
+from chat.llm_utils.vertex import (
+    CACHE_LOOKUP_BATCH,
+    RETRYABLE_ERRORS,
+    TokenBucket,
+    cache_stats_lock,
+    text_hash,
+)
+
+log = logging.getLogger(__name__)
+
+
+class CustomVertexAIEmbeddings(VertexAIEmbeddings, BaseModel):
+    requests_per_minute: int
+    num_instances_per_batch: int
+    max_concurrency: int = 8
+    max_retries_per_batch: int = 5
+    # Shared by every thread (and every request) using this client
+    rate_limiter: Any = None
+    # Consult the EmbeddingCache table before calling Vertex
+    use_cache: bool = True
+    # Process-wide hit/miss counters for the EmbeddingCache
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    def _embed_batch(self, texts: List[str]):
+        for attempt in range(self.max_retries_per_batch + 1):
+            self.rate_limiter.acquire()
+            try:
+                return [r.values for r in self.client.get_embeddings(texts)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries_per_batch:
+                    raise
+                backoff = min(2**attempt, 30)
+                log.warning(f"Embedding batch failed ({e}), retrying in {backoff}s")
+                time.sleep(backoff)
+
+    def embed_uncached(self, docs: List[str]):
+        """
+        Embed docs with the API, bypassing the EmbeddingCache
+        """
+        if self.rate_limiter is None:
+            self.rate_limiter = TokenBucket(self.requests_per_minute)
+        # Working in batches because the API accepts maximum 5
+        # documents per request to get embeddings
+        batches = [
+            docs[i : i + self.num_instances_per_batch]
+            for i in range(0, len(docs), self.num_instances_per_batch)
+        ]
+        if len(batches) <= 1:
+            return [e for batch in batches for e in self._embed_batch(batch)]
+        # Keep several batches in flight; the token bucket (not round-trip
+        # latency) decides throughput. map() preserves input order.
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(batches))
+        ) as executor:
+            results = executor.map(self._embed_batch, batches)
+            return [e for batch in results for e in batch]
+
+    async def _aembed_batch(self, texts: List[str]):
+        # _embed_batch() for async code
+        for attempt in range(self.max_retries_per_batch + 1):
+            await self.rate_limiter.aacquire()
+            try:
+                return [r.values for r in await self.client.get_embeddings_async(texts)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries_per_batch:
+                    raise
+                backoff = min(2**attempt, 30)
+                log.warning(f"Embedding batch failed ({e}), retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+
+    async def aembed_uncached(self, docs: List[str]):
+        """
+        embed_uncached() for async code: batches are sent with the async
+        client, without holding a thread while they are in flight
+        """
+        if self.rate_limiter is None:
+            self.rate_limiter = TokenBucket(self.requests_per_minute)
+        in_flight = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch):
+            async with in_flight:
+                return await self._aembed_batch(batch)
+
+        results = await asyncio.gather(
+            *(
+                embed_batch(docs[i : i + self.num_instances_per_batch])
+                for i in range(0, len(docs), self.num_instances_per_batch)
+            )
+        )
+        return [e for batch in results for e in batch]
+
+    def cache_lookup(self, hashes: List[str]):
+        """
+        Return {text_hash: embedding} for the hashes found in the EmbeddingCache
+        """
+        cached = {}
+        unique_hashes = list(set(hashes))
+        for i in range(0, len(unique_hashes), CACHE_LOOKUP_BATCH):
+            rows = EmbeddingCache.objects.filter(
+                model_name=self.model_name,
+                text_hash__in=unique_hashes[i : i + CACHE_LOOKUP_BATCH],
+            ).values_list("text_hash", "embedding")
+            cached.update((text_hash, list(map(float, e))) for text_hash, e in rows)
+        return cached
+
+    def cache_store(self, entries):
+        """
+        Save {text_hash: embedding} to the EmbeddingCache
+        """
+        EmbeddingCache.objects.bulk_create(
+            [
+                EmbeddingCache(
+                    model_name=self.model_name,
+                    text_hash=text_hash,
+                    embedding=embedding,
+                )
+                for text_hash, embedding in entries.items()
+            ],
+            batch_size=CACHE_LOOKUP_BATCH,
+            ignore_conflicts=True,
+        )
+
+    # Overriding embed_documents method
+    def embed_documents(self, texts: List[str]):
+        docs = list(texts)
+        if not self.use_cache:
+            return self.embed_uncached(docs)
+
+        # Only texts not already in the EmbeddingCache go to the API
+        hashes = [text_hash(text) for text in docs]
+        cached = self.cache_lookup(hashes)
+        # Texts served from cache rows (a text repeated in docs counts each
+        # time, but is only embedded once if it's a miss)
+        hits = sum(key in cached for key in hashes)
+        misses = {}
+        for key, text in zip(hashes, docs):
+            if key not in cached:
+                misses.setdefault(key, text)
+        if misses:
+            embeddings = self.embed_uncached(list(misses.values()))
+            new_entries = dict(zip(misses.keys(), embeddings))
+            self.cache_store(new_entries)
+            cached.update(new_entries)
+
+        with cache_stats_lock:
+            self.cache_hits += hits
+            self.cache_misses += len(misses)
+        log.info(
+            f"Embedding cache: {hits} hits, {len(misses)} misses "
+            f"(total {self.cache_hits} hits, {self.cache_misses} misses)"
+        )
+        return [cached[key] for key in hashes]
@@ -0,0 +1,240 @@
+"""
+Token-budgeted chat history.
+
+Only the most recent turns of a chat that fit its model's input budget are
+sent with each prompt. Older turns are folded into Chat.running_summary,
+which is sent in the system prompt instead: a background job adds the turns
+that no longer fit to the summary so far, so each turn is summarized once
+and the summary is never rebuilt from the whole chat.
+
+Tokens are counted with the chunking tokenizer, which isn't the model's, so
+budgets keep a margin. Each message is counted once, when it's saved
+(Message.token_count), so budgeting a prompt only adds up numbers.
+"""
+
+import functools
+import logging
+
+from django.conf import settings
+
+from chat.models import Chat, Message
+from chat.llm_utils.chunking import count_tokens, estimate_tokens
+from chat.llm_utils.summarization import summarizer
+
+log = logging.getLogger(__name__)
+
+# Input tokens of the PaLM models; the 32k models share theirs with the output
+CONTEXT_TOKENS = 8192
+CONTEXT_TOKENS_32K = 32768
+# Fraction of the context counted as available, for tokenizer differences
+TOKEN_MARGIN = 0.8
+# Unsummarized history over this fraction of the budget is folded, down to
+# FOLD_TO, so a fold is only needed every few turns
+FOLD_AT = 0.75
+FOLD_TO = 0.5
+# Tokens of conversation added to the summary per LLM call
+FOLD_TOKENS = 4000
+
+FOLD_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary. Keep names, numbers, decisions, and anything the user asked to be remembered.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+SUMMARY_PROMPT = """
+
+Summary of the earlier conversation:
+{summary}"""
+
+
+def history_tokens(texts):
+    """
+    Tokens of each of texts, estimated from their lengths if the tokenizer
+    can't be loaded, so a chat never fails for want of exact counts
+    """
+    try:
+        return count_tokens(texts)
+    except Exception:
+        log.exception("Counting tokens failed: estimating them")
+        return [estimate_tokens(len(text)) for text in texts]
+
+
+def message_tokens(text):
+    # Message.token_count for a new message
+    (tokens,) = history_tokens([text])
+    return tokens
+
+
+@functools.lru_cache(maxsize=1024)
+def text_tokens(text):
+    # Tokens of a system prompt or running summary, which rarely change
+    (tokens,) = history_tokens([text])
+    return tokens
+
+
+def fill_token_counts(messages):
+    """
+    Count the tokens of messages saved without a token_count (e.g. before
+    it existed), in one batch, and save them
+    """
+    uncounted = [message for message in messages if message.token_count is None]
+    if not uncounted:
+        return
+    counts = history_tokens([message.message for message in uncounted])
+    for message, tokens in zip(uncounted, counts):
+        message.token_count = tokens
+    Message.objects.bulk_update(uncounted, ["token_count"], batch_size=500)
+
+
+def max_output_tokens(user_settings):
+    # The user's response length, within what their model allows
+    is_code_model = "code" in user_settings.model_name
+    max_tokens = 2048 if is_code_model else 1024
+    if "32k" in user_settings.model_name:
+        max_tokens = 8192  # Not sure why this is imposed, but it is
+    return min(max_tokens, user_settings.max_output_tokens)
+
+
+def history_budget(user_settings):
+    """
+    Tokens available for the running summary and recent messages of a
+    prompt to the user's model
+    """
+    if "32k" in user_settings.model_name:
+        context = CONTEXT_TOKENS_32K - max_output_tokens(user_settings)
+    else:
+        context = CONTEXT_TOKENS
+    return max(int(context * TOKEN_MARGIN) - system_tokens(user_settings), 0)
+
+
+def system_tokens(user_settings):
+    system_prompt = user_settings.system_prompt
+    if system_prompt is None:
+        system_prompt = settings.CHAT_SYSTEM_PROMPT
+    return text_tokens(system_prompt)
+
+
+def summary_tokens(summary):
+    return text_tokens(SUMMARY_PROMPT.format(summary=summary)) if summary else 0
+
+
+def prompt_tokens(user_settings, messages, summary=""):
+    """
+    Tokens of the prompt chat_prompt() makes of messages and summary
+    """
+    fill_token_counts(messages)
+    if "chat" not in user_settings.model_name:
+        return messages[0].token_count
+    return (
+        system_tokens(user_settings)
+        + summary_tokens(summary)
+        + sum(message.token_count for message in messages)
+    )
+
+
+def unsummarized_messages(chat, until_id=None):
+    """
+    Messages of chat not folded into its running summary (before message
+    until_id, if given), oldest first, with their token counts
+    """
+    messages = Message.objects.filter(chat=chat, id__gt=chat.summary_through)
+    if until_id is not None:
+        messages = messages.filter(id__lt=until_id)
+    messages = list(messages.order_by("timestamp", "id"))
+    fill_token_counts(messages)
+    return messages, [message.token_count for message in messages]
+
+
+def turn_start(messages, index):
+    """
+    The first index at or after index where a turn (a user message) starts,
+    or len(messages)
+    """
+    while index < len(messages) and messages[index].is_bot:
+        index += 1
+    return index
+
+
+def recent_history(chat, user_settings, until_id=None):
+    """
+    The messages of chat to send with a prompt: the most recent whole turns
+    (and at least the last message) that fit in the history budget along
+    with the running summary. Returns (messages, fold), fold being whether
+    older turns should be folded into the summary.
+    """
+    budget = history_budget(user_settings)
+    messages, counts = unsummarized_messages(chat, until_id)
+    available = budget - summary_tokens(chat.running_summary)
+    start = len(messages)
+    used = 0
+    while start > 0 and (
+        start == len(messages) or used + counts[start - 1] <= available
+    ):
+        start -= 1
+        used += counts[start]
+    # Don't start with the response to a question that didn't fit
+    if start < len(messages) - 1:
+        start = min(turn_start(messages, start), len(messages) - 1)
+    if start > 0:
+        # Folding hasn't caught up (e.g. a long message was just sent)
+        log.info(f"Chat {chat.id}: {start} messages over the history budget left out")
+    return messages[start:], sum(counts) > budget * FOLD_AT
+
+
+def conversation_lines(messages):
+    return "\n".join(
+        f"{'AI' if message.is_bot else 'Human'}: {message.message}"
+        for message in messages
+    )
+
+
+def fold_history(chat, user_settings):
+    """
+    Add the oldest unsummarized turns of chat to its running summary until
+    the rest fit in FOLD_TO of the history budget. Returns the number of
+    messages folded.
+    """
+    budget = history_budget(user_settings)
+    messages, counts = unsummarized_messages(chat)
+    unsummarized = sum(counts)
+    end = 0
+    while end < len(messages) and unsummarized > budget * FOLD_TO:
+        unsummarized -= counts[end]
+        end += 1
+    # Fold whole turns, never the last one
+    last_turn = max(
+        (i for i, message in enumerate(messages) if not message.is_bot), default=0
+    )
+    end = min(turn_start(messages, end), last_turn)
+    if end == 0:
+        return 0
+
+    summary = chat.running_summary
+    start = 0
+    while start < end:
+        # As many messages as fit in one call (at least one)
+        stop = start + 1
+        tokens = counts[start]
+        while stop < end and tokens + counts[stop] <= FOLD_TOKENS:
+            tokens += counts[stop]
+            stop += 1
+        summary = summarizer.complete(
+            FOLD_PROMPT.format(
+                summary=summary or "(none)",
+                lines=conversation_lines(messages[start:stop]),
+            )
+        )
+        start = stop
+
+    # Only if no other fold got here first
+    updated = Chat.objects.filter(
+        id=chat.id, summary_through=chat.summary_through
+    ).update(running_summary=summary, summary_through=messages[end - 1].id)
+    if updated:
+        chat.running_summary = summary
+        chat.summary_through = messages[end - 1].id
+        return end
+    return 0
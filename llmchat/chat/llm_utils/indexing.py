@@ -0,0 +1,236 @@
+"""
+Streaming, incremental document indexing: split -> diff -> embed -> bulk insert.
+
+The document text is split lazily in bounded sections, chunks are embedded
+INDEX_BATCH_SIZE at a time and written together with their vectors in one
+bulk_create per batch. Memory stays flat regardless of document length and
+DB round trips are O(chunks / INDEX_BATCH_SIZE).
+
+Re-indexing a revised document diffs chunks by sha256 of their text, so only
+new or changed chunks are sent to the embedding API. Section boundaries are
+content-defined so that an edit does not shift every chunk after it.
+
+Chunks store their (start, end) offsets in the document text, not a copy of
+their text.
+"""
+
+import zlib
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import islice
+
+import numpy as np
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import Value
+from django.utils import timezone
+
+from chat.models import Document, DocumentChunk
+from chat.llm_utils.chunking import (
+    CHARS_PER_TOKEN,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENS,
+    chunk_spans,
+    tokenize,
+)
+from chat.llm_utils.vertex import get_gcp_embeddings, text_hash
+
+# Chunks embedded and inserted per round trip
+INDEX_BATCH_SIZE = 100
+# Max characters of text handed to the chunker at once
+SPLIT_WINDOW = CHUNK_TOKENS * CHARS_PER_TOKEN * 25
+# Sections are at least MIN_SECTION characters and end on roughly one line in
+# SECTION_ANCHOR after that (see iter_sections)
+MIN_SECTION = CHUNK_TOKENS * CHARS_PER_TOKEN * 4
+SECTION_ANCHOR = 16
+# Sections tokenized per batch (in parallel)
+TOKENIZE_BATCH_SIZE = 8
+# Stale chunk ids per DELETE statement
+STALE_DELETE_BATCH = 1000
+
+
+def iter_sections(text, max_size=SPLIT_WINDOW):
+    """
+    Yield (start_offset, section) for bounded sections of text. Sections end
+    after a line whose crc32 is divisible by SECTION_ANCHOR once they are at
+    least MIN_SECTION long, so where they end depends only on nearby content:
+    an edit changes the chunks of its own section, not of everything after it.
+    """
+    start = pos = 0
+    while pos < len(text):
+        newline = text.find("\n", pos)
+        limit = start + max_size
+        if newline == -1 or newline >= limit:
+            if len(text) <= limit:
+                break
+            # No usable line break: cut at a space before the size limit
+            cut = text.rfind(" ", start + MIN_SECTION, limit)
+            pos = cut + 1 if cut != -1 else limit
+            yield start, text[start:pos]
+            start = pos
+            continue
+        line = text[pos:newline].strip()
+        pos = newline + 1
+        if (
+            pos - start >= MIN_SECTION
+            and line
+            and zlib.crc32(line.encode("utf-8")) % SECTION_ANCHOR == 0
+        ):
+            yield start, text[start:pos]
+            start = pos
+    if start < len(text):
+        yield start, text[start:]
+
+
+def iter_chunks(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Yield (start, end, chunk_text) for the token budget chunks of text,
+    chunking a few sections at a time instead of the whole text up front
+    """
+    for sections in batched(iter_sections(text), TOKENIZE_BATCH_SIZE):
+        all_tokens = tokenize([section for _, section in sections])
+        for (section_start, section), tokens in zip(sections, all_tokens):
+            for start, end in chunk_spans(
+                section, chunk_tokens, overlap_tokens, tokens
+            ):
+                yield section_start + start, section_start + end, section[start:end]
+
+
+def batched(iterable, n):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
+def search_vector(text):
+    # Full text search (see PgVectorStore.search_chunks_hybrid) is Postgres only
+    if connection.vendor != "postgresql":
+        return None
+    return SearchVector(Value(text), config="english")
+
+
+def page_number(doc, offset):
+    """
+    1-based page of doc containing the text position offset, if doc has pages
+    """
+    if not doc.page_offsets:
+        return None
+    return bisect_right(doc.page_offsets, offset)
+
+
+def index_document(doc, progress=None):
+    """
+    Bring doc's chunks in line with doc.text. Chunks whose content hash is
+    already indexed keep their row and vector (renumbered if needed); only new
+    or changed chunks are embedded, and stale chunks are deleted in bulk.
+    Reused chunks are searchable again (see Document.save_texts).
+    progress, if given, is called with the fraction of the text indexed so far.
+    Returns counts of chunks reused, embedded and deleted.
+    """
+    # Chunks left without a vector (e.g. by an interrupted run) can't be reused
+    doc.chunks.filter(embedding__isnull=True).delete()
+    # content hash -> ids of existing chunks with that content
+    existing = defaultdict(list)
+    for chunk_id, chunk_hash in doc.chunks.values_list("id", "text_hash"):
+        existing[chunk_hash].append(chunk_id)
+
+    text_length = max(doc.text_length, 1)
+    embedding_sum = None
+    stats = {"reused": 0, "embedded": 0, "deleted": 0}
+    chunk_number = 0
+    chunks = iter_chunks(doc.text, doc.chunk_size, doc.chunk_overlap)
+    for batch in batched(chunks, INDEX_BATCH_SIZE):
+        reused = {}  # chunk id -> (chunk number, page number, start, end)
+        new_chunks = []
+        for start, end, text in batch:
+            chunk_hash = text_hash(text)
+            if existing.get(chunk_hash):
+                reused[existing[chunk_hash].pop()] = (
+                    chunk_number,
+                    page_number(doc, start),
+                    start,
+                    end,
+                )
+            else:
+                new_chunks.append(
+                    DocumentChunk(
+                        document=doc,
+                        user_id=doc.user_id,
+                        chunk_number=chunk_number,
+                        page_number=page_number(doc, start),
+                        start=start,
+                        end=end,
+                        text=text,
+                        text_hash=chunk_hash,
+                        search_vector=search_vector(text),
+                    )
+                )
+            chunk_number += 1
+
+        batch_embeddings = []
+        if reused:
+            reused_chunks = list(
+                DocumentChunk.objects.filter(id__in=reused).only(
+                    "id",
+                    "user",
+                    "chunk_number",
+                    "page_number",
+                    "start",
+                    "end",
+                    "embedding",
+                )
+            )
+            moved = []
+            for chunk in reused_chunks:
+                position = (
+                    chunk.chunk_number,
+                    chunk.page_number,
+                    chunk.start,
+                    chunk.end,
+                )
+                if position != reused[chunk.id] or chunk.user_id != doc.user_id:
+                    chunk.user_id = doc.user_id
+                    (
+                        chunk.chunk_number,
+                        chunk.page_number,
+                        chunk.start,
+                        chunk.end,
+                    ) = reused[chunk.id]
+                    moved.append(chunk)
+                batch_embeddings.append(chunk.embedding)
+            DocumentChunk.objects.bulk_update(
+                moved, ["user", "chunk_number", "page_number", "start", "end"]
+            )
+        if new_chunks:
+            # Only the chunk's own text is embedded (no filename, title or
+            # summary), so the EmbeddingCache serves identical content for
+            # every document and user
+            embeddings = get_gcp_embeddings().embed_documents(
+                [chunk.text for chunk in new_chunks]
+            )
+            for chunk, embedding in zip(new_chunks, embeddings):
+                chunk.embedding = embedding
+                chunk.embedding_half = embedding
+            DocumentChunk.objects.bulk_create(new_chunks)
+            batch_embeddings.extend(embeddings)
+        stats["reused"] += len(reused)
+        stats["embedded"] += len(new_chunks)
+
+        # Running sum for the mean embedding, instead of keeping every vector
+        if batch_embeddings:
+            batch_sum = np.sum(batch_embeddings, axis=0)
+            embedding_sum = (
+                batch_sum if embedding_sum is None else embedding_sum + batch_sum
+            )
+        if progress is not None:
+            progress(min(batch[-1][1] / text_length, 1))
+
+    stale_ids = [chunk_id for ids in existing.values() for chunk_id in ids]
+    for ids in batched(stale_ids, STALE_DELETE_BATCH):
+        stats["deleted"] += DocumentChunk.objects.filter(id__in=ids).delete()[0]
+
+    Document.objects.filter(id=doc.id).update(
+        mean_embedding=None if embedding_sum is None else embedding_sum / chunk_number,
+        indexed_at=timezone.now(),
+    )
+    return stats
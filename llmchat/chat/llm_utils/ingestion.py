@@ -0,0 +1,259 @@
+"""
+Batch upload: many files (or zip archives of files) in one request.
+
+The request only spools the files to disk and writes them to storage, in a
+thread pool (stage_batch). An ingest_batch job then reads them back and
+parses them concurrently in the parsing process pool (ingest_stored),
+reporting progress file by file. Document rows are created (or, for
+re-uploads, updated) in bulk once all are parsed, so a batch takes about as
+long as its slowest file rather than the sum of all of them (up to the
+number of parsing workers), and no batch is limited by the request timeout.
+"""
+
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from chat.models import Document
+from chat.llm_utils.parsing import parse_path, parse_pool, read_parsed_text
+from chat.llm_utils.chunking import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS
+
+MAX_BATCH_FILES = 500
+# Uncompressed size limit per file (guards against zip bombs)
+MAX_FILE_SIZE = 100 * 2**20
+# Parallel writes to storage
+STORAGE_THREADS = 8
+
+
+class BatchFile:
+    """
+    One file of a batch upload and what happened to it
+    """
+
+    def __init__(self, name, path=None, error="", stored_name=None):
+        self.name = name
+        self.path = path
+        self.error = error
+        self.stored_name = stored_name
+        self.text = ""
+        self.page_offsets = []
+        self.document = None
+
+    def __repr__(self):
+        return f"BatchFile({self.name!r}, error={self.error!r})"
+
+
+def fill_document(doc, filename, file, text, page_offsets, uploaded_at):
+    """
+    Set the fields of a new or re-uploaded document, clearing derived data.
+    Saving the new text takes the document's chunks out of search until it is
+    re-indexed.
+    """
+    doc.file = file
+    doc.uploaded_at = uploaded_at
+    doc.chunk_overlap = CHUNK_OVERLAP_TOKENS
+    doc.chunk_size = CHUNK_TOKENS
+    doc.title = filename
+    doc.original_filename = filename
+    doc.text = text
+    doc.page_offsets = page_offsets
+    doc.summary = ""
+    doc.summary_embedding = None
+    doc.mean_embedding = None
+
+
+def copy_upload(uploaded_file, dst):
+    for chunk in uploaded_file.chunks():
+        dst.write(chunk)
+
+
+def copy_member(archive, member, dst):
+    with archive.open(member) as src:
+        shutil.copyfileobj(src, dst)
+
+
+def spool_files(uploaded_files, directory):
+    """
+    Write uploads (and the members of uploaded zip archives) to directory.
+    Returns a BatchFile per file; files that can't be used have an error.
+    """
+    files = []
+    names = set()
+
+    def add(name, size, copy):
+        if len(names) >= MAX_BATCH_FILES:
+            error = f"Batches are limited to {MAX_BATCH_FILES} files"
+        elif size > MAX_FILE_SIZE:
+            error = "File is too large"
+        elif name in names:
+            error = "Another file in the batch has the same name"
+        else:
+            path = os.path.join(directory, str(len(files)))
+            with open(path, "wb") as dst:
+                copy(dst)
+            names.add(name)
+            files.append(BatchFile(name, path))
+            return
+        files.append(BatchFile(name, error=error))
+
+    for uploaded_file in uploaded_files:
+        if not uploaded_file.name.lower().endswith(".zip"):
+            add(
+                uploaded_file.name,
+                uploaded_file.size,
+                partial(copy_upload, uploaded_file),
+            )
+            continue
+        try:
+            with zipfile.ZipFile(uploaded_file) as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or not name or name.startswith("."):
+                        continue
+                    # Reads stop at the declared file_size, which is checked
+                    add(name, member.file_size, partial(copy_member, archive, member))
+        except zipfile.BadZipFile:
+            files.append(BatchFile(uploaded_file.name, error="Invalid zip file"))
+    return files
+
+
+def store_file(user, batch_file):
+    name = Document.file.field.generate_filename(Document(user=user), batch_file.name)
+    with open(batch_file.path, "rb") as f:
+        return default_storage.save(name, File(f))
+
+
+def fetch_file(batch_file, path):
+    with default_storage.open(batch_file.stored_name, "rb") as src:
+        with open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    batch_file.path = path
+
+
+def stage_batch(user, uploaded_files, directory):
+    """
+    Spool a batch of uploads to directory and write the usable files to
+    storage, for ingest_stored(). Returns the BatchFiles; those without an
+    error have their .stored_name set.
+    """
+    files = spool_files(uploaded_files, directory)
+    valid = [batch_file for batch_file in files if not batch_file.error]
+    with ThreadPoolExecutor(STORAGE_THREADS) as storage:
+        saves = [storage.submit(store_file, user, f) for f in valid]
+        for batch_file, save in zip(valid, saves):
+            try:
+                batch_file.stored_name = save.result()
+            except Exception:
+                batch_file.error = "Could not save file"
+    return files
+
+
+def ingest_stored(user, files, directory, progress=None):
+    """
+    Read the files of a batch staged by stage_batch() back from storage into
+    directory, parse them and create their Documents. Each file is parsed as
+    soon as it's read; progress, if given, is called with the number of files
+    done and the name of the last one. Returns the BatchFiles; those without
+    an error have their .document set.
+    """
+    pool = parse_pool()
+    with ThreadPoolExecutor(STORAGE_THREADS) as storage:
+        fetches = {
+            storage.submit(fetch_file, f, os.path.join(directory, str(i))): f
+            for i, f in enumerate(files)
+        }
+        parses = {}
+        done = 0
+        for fetch in as_completed(fetches):
+            batch_file = fetches[fetch]
+            try:
+                fetch.result()
+            except Exception:
+                batch_file.error = "Could not read file from storage"
+                done += 1
+                continue
+            text_path = f"{batch_file.path}.txt"
+            parse = pool.submit(parse_path, batch_file.path, batch_file.name, text_path)
+            parses[parse] = batch_file
+        for parse in as_completed(parses):
+            batch_file = parses[parse]
+            try:
+                batch_file.page_offsets = parse.result()
+                batch_file.text = read_parsed_text(f"{batch_file.path}.txt")
+            except Exception as e:
+                batch_file.error = f"Could not read file ({e.__class__.__name__})"
+            done += 1
+            if progress is not None:
+                progress(done, batch_file.name)
+        # Don't leave files of failed parses in storage
+        for batch_file in files:
+            if batch_file.error and batch_file.stored_name:
+                storage.submit(default_storage.delete, batch_file.stored_name)
+
+    save_documents(user, [f for f in files if not f.error])
+    return files
+
+
+def save_documents(user, files):
+    """
+    Create Documents for files in bulk. As with single uploads, a file with
+    the same name as an existing document replaces that document's content.
+    """
+    existing = {}
+    for doc in Document.objects.filter(
+        user=user, original_filename__in=[f.name for f in files]
+    ).order_by("uploaded_at"):
+        existing[doc.original_filename] = doc  # The latest wins
+
+    uploaded_at = timezone.now()
+    new_documents = []
+    updated_documents = []
+    replaced_files = []
+    for batch_file in files:
+        doc = existing.get(batch_file.name)
+        if doc is None:
+            doc = Document(user=user)
+            new_documents.append(doc)
+        else:
+            # A retried job may have saved this file's document already
+            if doc.file and doc.file.name != batch_file.stored_name:
+                replaced_files.append(doc.file.name)
+            updated_documents.append(doc)
+        fill_document(
+            doc,
+            batch_file.name,
+            batch_file.stored_name,
+            batch_file.text,
+            batch_file.page_offsets,
+            uploaded_at,
+        )
+        batch_file.document = doc
+
+    Document.objects.bulk_create(new_documents, batch_size=100)
+    Document.objects.bulk_update(
+        updated_documents,
+        [
+            "file",
+            "uploaded_at",
+            "chunk_overlap",
+            "chunk_size",
+            "title",
+            "original_filename",
+            "text_length",
+            "page_offsets",
+            "summary",
+            "summary_embedding",
+            "mean_embedding",
+        ],
+        batch_size=100,
+    )
+    Document.save_texts(new_documents + updated_documents)
+    with ThreadPoolExecutor(STORAGE_THREADS) as storage:
+        for name in replaced_files:
+            storage.submit(default_storage.delete, name)
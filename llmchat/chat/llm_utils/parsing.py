@@ -0,0 +1,135 @@
+"""
+Text extraction for uploaded documents, page by page.
+
+PDF parsing (pypdf) is CPU bound pure Python, so it runs in a process pool:
+a long PDF no longer holds the GIL for seconds while other requests on the
+same instance wait. Files are parsed from disk as they were uploaded (Django
+spools large uploads to a temporary file), and workers write the text to a
+file page by page, which the caller reads back: neither the raw file nor the
+text is held in memory as a whole by a worker, or pickled back from it.
+
+This module is imported by the pool workers, so it doesn't import Django.
+"""
+
+import codecs
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# F4_1G instances have 2 CPUs
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+# Between pages in Document.text (as PyPDFLoader pages were joined)
+PAGE_SEPARATOR = "\n\n"
+# Bytes read at a time from text files
+READ_CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_pool():
+    """
+    The shared parsing process pool, started on first use. Workers are
+    spawned rather than forked, as forking a threaded server process can copy
+    locks held by other threads.
+    """
+    global _pool
+    with _pool_lock:
+        # A pool whose worker died (e.g. out of memory) can't be used again
+        if _pool is None or getattr(_pool, "_broken", False):
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def open_text(text_path, mode="r"):
+    # Parsed text files are UTF-8, with line endings kept as they were
+    return open(text_path, mode, encoding="utf-8", newline="")
+
+
+def parse_pdf(path, text_path):
+    """
+    Write the text of the PDF at path to text_path, a page at a time. Returns
+    page_offsets, where page_offsets[i] is the position in the text where
+    page i + 1 starts.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    page_offsets = []
+    position = 0
+    with open_text(text_path, "w") as text:
+        for page in reader.pages:
+            if page_offsets:
+                text.write(PAGE_SEPARATOR)
+                position += len(PAGE_SEPARATOR)
+            page_offsets.append(position)
+            page_text = page.extract_text()
+            text.write(page_text)
+            position += len(page_text)
+    return page_offsets
+
+
+def parse_path(path, filename, text_path):
+    """
+    Write the text of the file at path, by its original name, to text_path.
+    Returns its page_offsets (empty for files without pages).
+    """
+    if filename.endswith(".pdf"):
+        return parse_pdf(path, text_path)
+    decoder = codecs.getincrementaldecoder("utf8")()
+    with open(path, "rb") as f, open_text(text_path, "w") as text:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            text.write(decoder.decode(chunk))
+        text.write(decoder.decode(b"", final=True))
+    return []
+
+
+def read_parsed_text(text_path):
+    """
+    The text a worker wrote to text_path; the file is removed
+    """
+    try:
+        with open_text(text_path) as f:
+            return f.read()
+    finally:
+        os.unlink(text_path)
+
+
+def decode_text(chunks, encoding="utf8"):
+    """
+    Decode an iterable of byte strings, without first joining the bytes
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    text = io.StringIO()
+    for chunk in chunks:
+        text.write(decoder.decode(chunk))
+    text.write(decoder.decode(b"", final=True))
+    return text.getvalue()
+
+
+def extract_text(uploaded_file):
+    """
+    Return (text, page_offsets) for a Django UploadedFile. page_offsets is
+    empty for files without pages (plain text).
+    """
+    if not uploaded_file.name.endswith(".pdf"):
+        return decode_text(uploaded_file.chunks()), []
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, "text")
+        if hasattr(uploaded_file, "temporary_file_path"):
+            # Large uploads are already on disk
+            path = uploaded_file.temporary_file_path()
+        else:
+            # Small uploads are in memory: spool them to disk for the worker
+            path = os.path.join(directory, "upload.pdf")
+            with open(path, "wb") as f:
+                for chunk in uploaded_file.chunks():
+                    f.write(chunk)
+        page_offsets = parse_pool().submit(parse_pdf, path, text_path).result()
+        return read_parsed_text(text_path), page_offsets
@@ -0,0 +1,123 @@
+"""
+Two-tier cache for query embeddings (similarity search and Q&A questions).
+
+Tier 1 is a bounded in-process LRU with a TTL. Tier 2 (optional) is the
+shared EmbeddingCache table, so a query embedded on one instance is a hit on
+every other instance. Only queries missing from both go to the embedding API.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from chat.llm_utils.vertex import get_gcp_embeddings, text_hash
+
+log = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = 2048  # Entries kept in memory per process
+QUERY_CACHE_TTL = 60 * 60  # Seconds an in-memory entry stays valid
+QUERY_CACHE_SHARED = True  # Also use the EmbeddingCache table
+
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU + TTL cache in front of an embeddings client
+    """
+
+    def __init__(self, get_embeddings, max_size, ttl, shared=True):
+        # Called for the embeddings client when a query needs it, so it's
+        # only created then
+        self.get_embeddings = get_embeddings
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.entries = OrderedDict()  # query -> (expires_at, embedding)
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def embeddings(self):
+        return self.get_embeddings()
+
+    def get(self, query):
+        embedding = self.memory_get(query)
+        if embedding is not None:
+            return embedding
+
+        key = text_hash(query)
+        if self.shared:
+            embedding = self.embeddings.cache_lookup([key]).get(key)
+        shared_hit = embedding is not None
+        if not shared_hit:
+            embedding = self.embeddings.embed_uncached([query])[0]
+            if self.shared:
+                self.embeddings.cache_store({key: embedding})
+        self.memory_put(query, embedding, shared_hit)
+        return embedding
+
+    async def aget(self, query):
+        """
+        get() for async views: the EmbeddingCache table is read and written
+        in a worker thread, the embedding API is called asynchronously
+        """
+        embedding = self.memory_get(query)
+        if embedding is not None:
+            return embedding
+
+        key = text_hash(query)
+        # Creating the client (on first use) blocks
+        embeddings = await sync_to_async(self.get_embeddings, thread_sensitive=False)()
+        if self.shared:
+            embedding = (await sync_to_async(embeddings.cache_lookup)([key])).get(key)
+        shared_hit = embedding is not None
+        if not shared_hit:
+            embedding = (await embeddings.aembed_uncached([query]))[0]
+            if self.shared:
+                await sync_to_async(embeddings.cache_store)({key: embedding})
+        self.memory_put(query, embedding, shared_hit)
+        return embedding
+
+    def memory_get(self, query):
+        with self.lock:
+            entry = self.entries.get(query)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(query)
+                self.memory_hits += 1
+                return entry[1]
+        return None
+
+    def memory_put(self, query, embedding, shared_hit):
+        with self.lock:
+            if shared_hit:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+            self.entries[query] = (time.monotonic() + self.ttl, embedding)
+            self.entries.move_to_end(query)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.shared_hits + self.misses
+            hits = self.memory_hits + self.shared_hits
+            return {
+                "size": len(self.entries),
+                "memory_hits": self.memory_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else None,
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache(
+    get_gcp_embeddings,
+    max_size=QUERY_CACHE_SIZE,
+    ttl=QUERY_CACHE_TTL,
+    shared=QUERY_CACHE_SHARED,
+)
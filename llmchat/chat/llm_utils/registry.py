@@ -0,0 +1,85 @@
+"""
+Process-wide registry of LLM clients and chains.
+
+Creating a langchain ChatVertexAI/VertexAI looks the model up in Vertex AI
+and sets up a new authenticated channel, which takes longer than many
+requests. The registry creates one client per model name and hands out
+wrappers sharing it, one per (model_name, max_output_tokens, temperature),
+so after the first request for a model (or the warmup request) nothing is
+set up again. QA chains over those wrappers are kept the same way.
+
+Clients, wrappers and chains hold no per-call state, so they are shared by
+every thread and request.
+"""
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class LLMRegistry:
+    def __init__(self):
+        self.llms = {}
+        self.chains = {}
+        # The first wrapper created for each model name, whose client the
+        # others share
+        self.models = {}
+        self.lock = threading.Lock()
+        # One lock per model name, so creating a client for one model doesn't
+        # hold up requests for others
+        self.model_locks = {}
+
+    def llm(self, model_name, max_output_tokens, temperature):
+        """
+        The shared ChatVertexAI (chat models) or VertexAI for these settings
+        """
+        key = (model_name, max_output_tokens, temperature)
+        llm = self.llms.get(key)
+        if llm is not None:
+            return llm
+        with self.lock:
+            model_lock = self.model_locks.setdefault(model_name, threading.Lock())
+        with model_lock:
+            if key in self.llms:
+                return self.llms[key]
+            params = {
+                "max_output_tokens": max_output_tokens,
+                "temperature": temperature,
+            }
+            if model_name in self.models:
+                # copy() skips validation, which is what creates a client
+                llm = self.models[model_name].copy(update=params)
+            else:
+                # Imported here as langchain takes seconds to import
+                from langchain.chat_models import ChatVertexAI
+                from langchain.llms import VertexAI
+
+                llm_class = ChatVertexAI if "chat" in model_name else VertexAI
+                log.info(f"Creating {llm_class.__name__} client for {model_name}")
+                llm = llm_class(model_name=model_name, **params)
+                self.models[model_name] = llm
+            self.llms[key] = llm
+            return llm
+
+    def qa_chain(self, llm, return_sources=True):
+        """
+        The shared "stuff" QA chain (with or without sources) over llm, one
+        of this registry's LLMs
+        """
+        key = (llm.model_name, llm.max_output_tokens, llm.temperature, return_sources)
+        with self.lock:
+            if key not in self.chains:
+                from langchain.chains.qa_with_sources import (
+                    load_qa_with_sources_chain,
+                )
+                from langchain.chains.question_answering import load_qa_chain
+
+                load_chain = (
+                    load_qa_with_sources_chain if return_sources else load_qa_chain
+                )
+                self.chains[key] = load_chain(llm, chain_type="stuff")
+            return self.chains[key]
+
+
+llm_registry = LLMRegistry()
@@ -0,0 +1,99 @@
+"""
+Token streaming of chat responses.
+
+stream_llm() is an async generator of the text of a response as the model
+generates it, from the Vertex AI async streaming API (langchain 0.0.263 can
+only wait for the whole completion), so a pending response holds no thread.
+With settings.FAKE_LLM set, a canned response is streamed word by word
+instead, so the chat UI works offline and without GCP credentials.
+
+sse_response() sends what such a generator yields as Server-Sent Events.
+Only an ASGI server streams them; under WSGI Django collects the whole
+response first.
+"""
+
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+# Seconds between words of the fake response
+FAKE_TOKEN_DELAY = 0.05
+FAKE_RESPONSE = """This is a fake response, streamed word by word because `FAKE_LLM` is set.
+
+You said:
+
+> {prompt}"""
+
+
+async def stream_vertex(llm, chat_messages):
+    """
+    Yield the response of llm (a ChatVertexAI or VertexAI) to chat_messages
+    (a list of messages, or a prompt) in pieces as they are generated
+    """
+    from langchain.chat_models import ChatVertexAI
+    from langchain.chat_models.vertexai import _parse_chat_history
+    from langchain.schema import HumanMessage
+
+    params = llm._default_params
+    if isinstance(llm, ChatVertexAI):
+        # As ChatVertexAI._generate, but streaming
+        question = chat_messages[-1]
+        if not isinstance(question, HumanMessage):
+            raise ValueError(f"Last message should be from human, got {question.type}")
+        history = _parse_chat_history(chat_messages[:-1])
+        if llm.is_codey_model:
+            chat = llm.client.start_chat(message_history=history.history, **params)
+        else:
+            chat = llm.client.start_chat(
+                context=history.context, message_history=history.history, **params
+            )
+        responses = chat.send_message_streaming_async(question.content)
+    else:
+        responses = llm.client.predict_streaming_async(chat_messages, **params)
+    async for response in responses:
+        if response.text:
+            yield response.text
+
+
+async def stream_fake(chat_messages):
+    prompt = chat_messages if isinstance(chat_messages, str) else chat_messages[-1]
+    prompt = getattr(prompt, "content", prompt)
+    for word in re.findall(r"\s*\S+", FAKE_RESPONSE.format(prompt=prompt)):
+        await asyncio.sleep(FAKE_TOKEN_DELAY)
+        yield word
+
+
+async def stream_llm(get_llm, chat_messages):
+    """
+    Stream the response to chat_messages from the model get_llm() returns
+    (which isn't called with FAKE_LLM, so no Vertex AI client is created)
+    """
+    if settings.FAKE_LLM:
+        stream = stream_fake(chat_messages)
+    else:
+        # Creating a client can block on the network
+        llm = await sync_to_async(get_llm, thread_sensitive=False)()
+        stream = stream_vertex(llm, chat_messages)
+    async for text in stream:
+        yield text
+
+
+def sse_event(event, data):
+    # JSON keeps data (e.g. text with newlines) on one line
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """
+    A text/event-stream response sending each of events (an async iterator
+    of strings from sse_event) as soon as it's yielded
+    """
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop proxies (e.g. nginx) from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,178 @@
+"""
+Map-reduce summarization of whole documents.
+
+Map: the text is cut into sections of up to MAP_TOKENS tokens (with the
+content-defined boundaries used for indexing) and each is summarized, several
+at a time, paced by the shared LLM rate limiter.
+Reduce: consecutive partial summaries are combined in groups of up to
+REDUCE_TOKENS tokens, level by level, until one summary is left.
+
+Every LLM response is cached by the hash of its exact prompt (SummaryCache),
+so re-summarizing an edited document only summarizes the sections that
+changed, and the reductions above them.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat.models import SummaryCache
+from chat.llm_utils.chunking import count_tokens
+from chat.llm_utils.indexing import iter_chunks
+from chat.llm_utils.vertex import (
+    RETRYABLE_ERRORS,
+    llm_rate_limiter,
+    get_text_llm,
+    text_hash,
+)
+
+log = logging.getLogger(__name__)
+
+# Tokens of document text per map prompt
+MAP_TOKENS = 2000
+# Tokens of partial summaries per reduce prompt (text-bison's input is 8192)
+REDUCE_TOKENS = 6000
+# LLM calls in flight; the rate limiter decides throughput
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 5
+# Max prompt hashes per SummaryCache lookup query
+CACHE_LOOKUP_BATCH = 500
+
+MAP_PROMPT = """Write a concise summary of the following part of the document "{filename}". Keep names, numbers, dates and conclusions.
+
+{text}
+
+CONCISE SUMMARY:"""
+REDUCE_PROMPT = """The following are summaries of consecutive parts of the document "{filename}". Combine them into one concise summary.
+
+{text}
+
+CONCISE SUMMARY:"""
+
+
+class Summarizer:
+    def __init__(self, llm=None, rate_limiter=llm_rate_limiter):
+        # The shared text LLM (created on first use) unless llm is given
+        self._llm = llm
+        self.rate_limiter = rate_limiter
+
+    @property
+    def llm(self):
+        return get_text_llm() if self._llm is None else self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    def complete(self, prompt):
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                return self.llm(prompt).strip()
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                backoff = min(2**attempt, 30)
+                log.warning(f"Summary request failed ({e}), retrying in {backoff}s")
+                time.sleep(backoff)
+
+    def complete_many(self, prompts, progress=None):
+        """
+        Responses to prompts, in order: from the SummaryCache where possible,
+        the rest from the LLM, MAX_CONCURRENCY at a time. progress, if given,
+        is called with the fraction of LLM calls done.
+        """
+        model_name = self.llm.model_name
+        hashes = [text_hash(prompt) for prompt in prompts]
+        cached = {}
+        unique_hashes = list(set(hashes))
+        for i in range(0, len(unique_hashes), CACHE_LOOKUP_BATCH):
+            cached.update(
+                SummaryCache.objects.filter(
+                    model_name=model_name,
+                    prompt_hash__in=unique_hashes[i : i + CACHE_LOOKUP_BATCH],
+                ).values_list("prompt_hash", "summary")
+            )
+        misses = {}
+        for key, prompt in zip(hashes, prompts):
+            if key not in cached:
+                misses.setdefault(key, prompt)
+        if misses:
+            with ThreadPoolExecutor(
+                max_workers=min(MAX_CONCURRENCY, len(misses))
+            ) as executor:
+                responses = {}
+                for key, response in zip(
+                    misses, executor.map(self.complete, misses.values())
+                ):
+                    responses[key] = response
+                    if progress is not None:
+                        progress(len(responses) / len(misses))
+            # Empty responses (which happen) aren't worth keeping
+            SummaryCache.objects.bulk_create(
+                [
+                    SummaryCache(
+                        model_name=model_name, prompt_hash=key, summary=summary
+                    )
+                    for key, summary in responses.items()
+                    if summary
+                ],
+                batch_size=CACHE_LOOKUP_BATCH,
+                ignore_conflicts=True,
+            )
+            cached.update(responses)
+        log.info(
+            f"Summary cache: {len(prompts) - len(misses)} hits, {len(misses)} misses"
+        )
+        return [cached[key] for key in hashes]
+
+    def summarize(self, document, progress=None):
+        """
+        Summary of the whole text of document. progress, if given, is called
+        with the fraction of the work done so far.
+        """
+        filename = document.original_filename or document.file.name
+        sections = [text for _, _, text in iter_chunks(document.text, MAP_TOKENS, 0)]
+        if not sections:
+            return ""
+        partials = self.complete_many(
+            [MAP_PROMPT.format(filename=filename, text=text) for text in sections],
+            progress=progress and (lambda fraction: progress(0.8 * fraction)),
+        )
+        # Each level reduces the number of summaries several times over
+        while len(partials) > 1:
+            if progress is not None:
+                progress(1 - 0.2 * len(partials) / len(sections))
+            groups = self.groups(partials)
+            reduced = iter(
+                self.complete_many(
+                    [
+                        REDUCE_PROMPT.format(filename=filename, text="\n\n".join(group))
+                        for group in groups
+                        if len(group) > 1
+                    ]
+                )
+            )
+            partials = [
+                next(reduced) if len(group) > 1 else group[0] for group in groups
+            ]
+        return partials[0]
+
+    def groups(self, partials):
+        """
+        Split partials into runs of consecutive summaries of up to
+        REDUCE_TOKENS tokens (at least two per run, except maybe the last, so
+        every level shrinks)
+        """
+        groups = [[]]
+        group_tokens = 0
+        for partial, tokens in zip(partials, count_tokens(partials)):
+            if len(groups[-1]) >= 2 and group_tokens + tokens > REDUCE_TOKENS:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(partial)
+            group_tokens += tokens
+        return groups
+
+
+summarizer = Summarizer()
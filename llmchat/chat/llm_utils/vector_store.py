@@ -0,0 +1,501 @@
+"""
+Cosine similarity search over a user's documents and chunks, with two engines:
+
+- PgVectorStore runs pgvector CosineDistance queries in Postgres (HNSW indexed),
+  and hybrid keyword + vector search using the chunks' full text index.
+  With compact=True the first stage scans half precision vectors and the
+  candidates are re-ranked at full precision.
+- NumpyVectorStore keeps each user's normalized chunk vectors in a
+  memory-mapped float32 file and answers top-k in-process with one
+  matrix-vector product and argpartition. It needs no vector support in the
+  database, so it also works with the sqlite CI database.
+
+settings.VECTOR_STORE picks the engine used by `vector_store`.
+"""
+
+import json
+import os
+import re
+import threading
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, prefetch_related_objects
+from pgvector.django import CosineDistance
+
+from chat.models import Document, DocumentChunk
+
+EMBEDDING_DIMENSIONS = 768  # PaLM embedding
+# Rows read from the database per batch when building a user's matrix
+BUILD_BATCH_SIZE = 1000
+
+# Hybrid search: candidates taken from each of the lexical and vector rankings
+HYBRID_CANDIDATES = 50
+# Reciprocal rank fusion constant: a result's score is sum(1 / (RRF_K + rank))
+RRF_K = 60
+# Above this many chunks, a user's vector search only considers the top
+# PREFILTER_CANDIDATES lexical matches (when there are any)
+PREFILTER_THRESHOLD = 100000
+PREFILTER_CANDIDATES = 2000
+# Users with at most this many rows are searched exactly, by sorting their
+# rows (found through their user index) rather than scanning the HNSW index.
+# An HNSW scan filtered to a user who owns few of the rows finds few of them
+# unless pgvector (0.8+) scans iteratively, and sorting this many rows is
+# cheap.
+EXACT_SEARCH_THRESHOLD = 10000
+# Compact search: candidates fetched from the half precision first stage per
+# result, before re-ranking at full precision
+RERANK_FACTOR = 4
+# hnsw.ef_search when none is given, raised to the number of rows a query
+# fetches: an HNSW scan returns at most ef_search rows (pgvector's default is
+# 40), before filters such as the user filter drop some of them
+DEFAULT_EF_SEARCH = 100
+MAX_EF_SEARCH = 1000  # pgvector's limit
+
+# Lexical (full text, OR of the query terms) and vector rankings of one user's
+# chunks, merged by reciprocal rank fusion in a single query. The vector
+# ranking's first stage orders by {column} (cast to {vector_type}) and is
+# re-ranked by the full precision embedding. Results leave out the vector
+# and search_vector columns, which the raw queryset then defers.
+HYBRID_CHUNKS_SQL = """
+WITH q AS (
+    SELECT replace(
+        plainto_tsquery('pg_catalog.english', %(query)s)::text, ' & ', ' | '
+    )::tsquery AS query
+),
+lexical AS (
+    SELECT c.id, row_number() OVER (
+        ORDER BY ts_rank_cd(c.search_vector, q.query) DESC, c.id
+    ) AS rank
+    FROM chat_documentchunk c, q
+    WHERE c.user_id = %(user_id)s AND c.search_vector @@ q.query
+    ORDER BY rank
+    LIMIT %(lexical_limit)s
+),
+user_chunks AS (
+    SELECT count(*) AS n
+    FROM (
+        SELECT 1 FROM chat_documentchunk
+        WHERE user_id = %(user_id)s LIMIT %(prefilter_threshold)s + 1
+    ) bounded_count
+),
+prefilter AS (
+    SELECT n > %(prefilter_threshold)s AND EXISTS (SELECT 1 FROM lexical)
+        AS active
+    FROM user_chunks
+),
+first_stage AS (
+    (
+        -- Exact: "+ 0" keeps the HNSW index from serving the ORDER BY
+        SELECT c.id FROM chat_documentchunk c
+        WHERE c.user_id = %(user_id)s
+            AND (SELECT n FROM user_chunks) <= %(exact_threshold)s
+        ORDER BY (c.{column} <=> %(embedding)s::{vector_type}) + 0
+        LIMIT %(first_stage_limit)s
+    )
+    UNION ALL
+    (
+        SELECT c.id FROM chat_documentchunk c
+        WHERE c.user_id = %(user_id)s
+            AND (SELECT n FROM user_chunks) > %(exact_threshold)s
+            AND NOT (SELECT active FROM prefilter)
+        ORDER BY c.{column} <=> %(embedding)s::{vector_type}
+        LIMIT %(first_stage_limit)s
+    )
+    UNION ALL
+    (
+        SELECT c.id FROM chat_documentchunk c JOIN lexical l ON l.id = c.id
+        WHERE (SELECT active FROM prefilter)
+        ORDER BY c.{column} <=> %(embedding)s::{vector_type}
+        LIMIT %(first_stage_limit)s
+    )
+),
+vector AS (
+    SELECT id, row_number() OVER (ORDER BY distance, id) AS rank
+    FROM (
+        SELECT c.id, c.embedding <=> %(embedding)s::vector AS distance
+        FROM chat_documentchunk c JOIN first_stage f ON f.id = c.id
+        ORDER BY distance
+        LIMIT %(candidates)s
+    ) nearest
+    WHERE %(max_distance)s::float8 IS NULL OR distance < %(max_distance)s::float8
+),
+fused AS (
+    SELECT id, sum(1.0 / (%(rrf_k)s + rank)) AS score
+    FROM (
+        SELECT id, rank FROM vector
+        UNION ALL
+        SELECT id, rank FROM lexical WHERE rank <= %(candidates)s
+    ) ranked
+    GROUP BY id
+)
+SELECT c.id, c.document_id, c.user_id, c.chunk_number, c.page_number,
+    c.start, c."end", c.text_hash
+FROM chat_documentchunk c JOIN fused f ON f.id = c.id
+ORDER BY f.score DESC, c.id
+LIMIT %(k)s
+"""
+
+
+def set_ann_search_params(ef_search=None, probes=None, iterative_scan=None):
+    """
+    Tune the HNSW / IVFFlat indexes for the current transaction only.
+    Higher values trade latency for recall (pgvector defaults: 40 and 1).
+    iterative_scan ("relaxed_order" or "strict_order", pgvector >= 0.8) keeps
+    scanning the index until enough rows pass filters such as the user filter.
+    """
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        if ef_search is not None:
+            cursor.execute("SET LOCAL hnsw.ef_search = %s", [int(ef_search)])
+        if probes is not None:
+            cursor.execute("SET LOCAL ivfflat.probes = %s", [int(probes)])
+        if iterative_scan is not None:
+            cursor.execute("SET LOCAL hnsw.iterative_scan = %s", [iterative_scan])
+
+
+_pgvector_version = None
+
+
+def pgvector_version():
+    """
+    The version of the database's pgvector extension, e.g. (0, 8, 0)
+    """
+    global _pgvector_version
+    if _pgvector_version is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+            )
+            row = cursor.fetchone()
+        _pgvector_version = tuple(
+            int(n) for n in re.findall(r"\d+", row[0] if row else "")
+        )
+    return _pgvector_version
+
+
+def ann_search_params(limit, ef_search=None, probes=None, iterative_scan=None):
+    """
+    set_ann_search_params() arguments for a query fetching limit rows, with
+    defaults for those not given: ef_search of at least limit, and (pgvector
+    0.8+) a relaxed order iterative scan, which keeps going until limit rows
+    pass the query's filters
+    """
+    if ef_search is None:
+        ef_search = min(max(limit, DEFAULT_EF_SEARCH), MAX_EF_SEARCH)
+    if iterative_scan is None and pgvector_version() >= (0, 8):
+        iterative_scan = "relaxed_order"
+    return ef_search, probes, iterative_scan
+
+
+class VectorStore:
+    """
+    Nearest neighbours by cosine distance among one user's documents (by
+    summary embedding) or chunks. Results are model instances, closest first.
+    Engine-specific search parameters (e.g. ef_search) are passed as keywords
+    and ignored by engines that don't use them.
+    """
+
+    def search_documents(self, user, query_embedding, k, max_distance=None, **params):
+        raise NotImplementedError
+
+    def search_chunks(self, user, query_embedding, k, max_distance=None, **params):
+        raise NotImplementedError
+
+    def search_chunks_hybrid(
+        self, user, query, query_embedding, k, max_distance=None, **params
+    ):
+        """
+        Chunks matching query by keywords or by embedding, best of both first.
+        Engines without full text search fall back to embedding search only.
+        """
+        return self.search_chunks(user, query_embedding, k, max_distance, **params)
+
+
+class PgVectorStore(VectorStore):
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def search(
+        self,
+        queryset,
+        field,
+        query_embedding,
+        k,
+        max_distance=None,
+        ef_search=None,
+        probes=None,
+        iterative_scan=None,
+    ):
+        queryset = queryset.annotate(distance=CosineDistance(field, query_embedding))
+        if has_few_rows(queryset):
+            # Exact: sort the rows found through the filter's index. Adding 0
+            # keeps the HNSW index from serving the ORDER BY.
+            queryset = queryset.order_by(F("distance") + 0)
+        else:
+            # Ordering by distance (also when filtering by max_distance) lets
+            # Postgres walk the HNSW indexes instead of scanning every vector
+            queryset = queryset.order_by("distance")
+        if max_distance is not None:
+            queryset = queryset.filter(distance__lt=max_distance)
+        # SET LOCAL only lasts for the transaction, so evaluate the query in it
+        with transaction.atomic():
+            set_ann_search_params(
+                *ann_search_params(k, ef_search, probes, iterative_scan)
+            )
+            results = list(queryset[:k])
+        # A relaxed order iterative scan may return rows slightly out of order
+        return sorted(results, key=lambda result: result.distance)
+
+    def search_documents(self, user, query_embedding, k, max_distance=None, **params):
+        return self.search(
+            Document.objects.filter(user=user),
+            "summary_embedding",
+            query_embedding,
+            k,
+            max_distance,
+            **params,
+        )
+
+    def search_chunks(self, user, query_embedding, k, max_distance=None, **params):
+        # Chunks are filtered on their own user column (chunk_user_idx), not
+        # through a join on Document
+        chunks = DocumentChunk.objects.filter(user=user).prefetch_related("document")
+        if not self.compact:
+            return self.search(
+                chunks, "embedding", query_embedding, k, max_distance, **params
+            )
+        # First stage over the half precision vectors and their index, then
+        # re-rank the candidates by their full precision vectors
+        candidates = self.search(
+            chunks, "embedding_half", query_embedding, k * RERANK_FACTOR, **params
+        )
+        if not candidates:
+            return []
+        distances = 1 - normalize(
+            [chunk.embedding for chunk in candidates]
+        ) @ normalize(query_embedding)
+        order = np.argsort(distances, kind="stable")
+        if max_distance is not None:
+            order = order[distances[order] < max_distance]
+        return [candidates[i] for i in order[:k]]
+
+    def search_chunks_hybrid(
+        self,
+        user,
+        query,
+        query_embedding,
+        k,
+        max_distance=None,
+        ef_search=None,
+        probes=None,
+        iterative_scan=None,
+    ):
+        # Exact identifiers (form numbers, acronyms...) are often missed by
+        # embeddings alone, so keyword matches get their own ranking.
+        # max_distance only applies to the vector ranking.
+        column, vector_type, first_stage_factor = (
+            ("embedding_half", "halfvec", RERANK_FACTOR)
+            if self.compact
+            else ("embedding", "vector", 1)
+        )
+        candidates = max(k, HYBRID_CANDIDATES)
+        params = {
+            "query": query,
+            "user_id": user.id,
+            "embedding": DocumentChunk._meta.get_field("embedding").get_prep_value(
+                query_embedding
+            ),
+            "max_distance": max_distance,
+            "candidates": candidates,
+            "first_stage_limit": candidates * first_stage_factor,
+            "lexical_limit": max(candidates, PREFILTER_CANDIDATES),
+            "prefilter_threshold": PREFILTER_THRESHOLD,
+            "exact_threshold": EXACT_SEARCH_THRESHOLD,
+            "rrf_k": RRF_K,
+            "k": k,
+        }
+        with transaction.atomic():
+            # For the vector ranking's first stage
+            set_ann_search_params(
+                *ann_search_params(
+                    params["first_stage_limit"], ef_search, probes, iterative_scan
+                )
+            )
+            chunks = list(
+                DocumentChunk.objects.raw(
+                    HYBRID_CHUNKS_SQL.format(column=column, vector_type=vector_type),
+                    params,
+                )
+            )
+        prefetch_related_objects(chunks, "document")
+        return chunks
+
+
+def has_few_rows(queryset):
+    """
+    Whether queryset has at most EXACT_SEARCH_THRESHOLD rows, counting no
+    further than that
+    """
+    bounded = queryset.order_by().values("pk")[: EXACT_SEARCH_THRESHOLD + 1]
+    return bounded.count() <= EXACT_SEARCH_THRESHOLD
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(matrix, query, k, max_distance=None):
+    """
+    Return (row indices, cosine distances) of the k rows of matrix closest to
+    query, closest first. Rows of matrix and query must be normalized.
+    """
+    distances = 1 - matrix @ query
+    if k < len(distances):
+        # O(n) selection of the k smallest, then sort only those
+        candidates = np.argpartition(distances, k - 1)[:k]
+    else:
+        candidates = np.arange(len(distances))
+    rows = candidates[np.argsort(distances[candidates], kind="stable")]
+    if max_distance is not None:
+        rows = rows[distances[rows] < max_distance]
+    return rows, distances[rows]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Chunk vectors live in <directory>/user_<id>.f32 (rows normalized, so cosine
+    similarity is a dot product) with chunk ids in user_<id>.ids.npy. Files are
+    shared by every process on the machine through the page cache, and are
+    rebuilt when the user's chunk count or highest chunk id in the database no
+    longer matches the signature they were built from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.matrices = {}  # user id -> (signature, chunk ids, matrix)
+        self.lock = threading.Lock()
+
+    def path(self, user, suffix):
+        return os.path.join(self.directory, f"user_{user.id}{suffix}")
+
+    def signature(self, user):
+        stats = DocumentChunk.objects.filter(
+            user=user, embedding__isnull=False
+        ).aggregate(count=Count("id"), max_id=Max("id"))
+        return [stats["count"], stats["max_id"]]
+
+    def load(self, user):
+        signature = self.signature(user)
+        with self.lock:
+            cached = self.matrices.get(user.id)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+        loaded = self.open(user, signature) or self.build(user, signature)
+        with self.lock:
+            self.matrices[user.id] = (signature, *loaded)
+        return loaded
+
+    def open(self, user, signature):
+        """
+        Map the user's files if they match signature, else return None
+        """
+        if signature[0] == 0:
+            return np.empty(0, dtype=np.int64), np.empty(
+                (0, EMBEDDING_DIMENSIONS), dtype=np.float32
+            )
+        try:
+            with open(self.path(user, ".json")) as f:
+                if json.load(f) != signature:
+                    return None
+            ids = np.load(self.path(user, ".ids.npy"))
+            matrix = np.memmap(
+                self.path(user, ".f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(len(ids), EMBEDDING_DIMENSIONS),
+            )
+        except (OSError, ValueError):
+            return None
+        return ids, matrix
+
+    def build(self, user, signature):
+        os.makedirs(self.directory, exist_ok=True)
+        count = signature[0]
+        # Written under temporary names, then renamed into place, so
+        # concurrent readers only ever map complete files
+        temp = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        ids = np.empty(count, dtype=np.int64)
+        matrix = np.memmap(
+            self.path(user, ".f32" + temp),
+            dtype=np.float32,
+            mode="w+",
+            shape=(count, EMBEDDING_DIMENSIONS),
+        )
+        rows = (
+            DocumentChunk.objects.filter(user=user, embedding__isnull=False)
+            .order_by("id")
+            .values_list("id", "embedding")
+            .iterator(BUILD_BATCH_SIZE)
+        )
+        written = 0
+        while written < count and (batch := list(islice(rows, BUILD_BATCH_SIZE))):
+            batch = batch[: count - written]
+            end = written + len(batch)
+            ids[written:end] = [chunk_id for chunk_id, _ in batch]
+            matrix[written:end] = normalize([embedding for _, embedding in batch])
+            written = end
+        matrix.flush()
+        del matrix
+        ids = ids[:written]
+        # Record what was actually written, in case chunks changed meanwhile
+        signature = [written, int(ids[-1]) if written else None]
+
+        with open(self.path(user, ".ids.npy" + temp), "wb") as f:
+            np.save(f, ids)
+        with open(self.path(user, ".json" + temp), "w") as f:
+            json.dump(signature, f)
+        for suffix in (".ids.npy", ".f32", ".json"):
+            os.replace(self.path(user, suffix + temp), self.path(user, suffix))
+        return self.open(user, signature)
+
+    def search_documents(self, user, query_embedding, k, max_distance=None, **params):
+        # Users have few documents, so their summary vectors are read per query
+        rows = list(
+            Document.objects.filter(
+                user=user, summary_embedding__isnull=False
+            ).values_list("id", "summary_embedding")
+        )
+        if not rows:
+            return []
+        ids = [doc_id for doc_id, _ in rows]
+        matrix = normalize([embedding for _, embedding in rows])
+        found, _ = top_k(matrix, normalize(query_embedding), k, max_distance)
+        return self.fetch(Document.objects.all(), [ids[i] for i in found])
+
+    def search_chunks(self, user, query_embedding, k, max_distance=None, **params):
+        ids, matrix = self.load(user)
+        if not len(ids):
+            return []
+        found, _ = top_k(matrix, normalize(query_embedding), k, max_distance)
+        return self.fetch(
+            DocumentChunk.objects.prefetch_related("document"), ids[found].tolist()
+        )
+
+    def fetch(self, queryset, ids):
+        objects = queryset.in_bulk(ids)
+        return [objects[i] for i in ids if i in objects]
+
+
+VECTOR_STORES = {
+    "pgvector": lambda: PgVectorStore(compact=settings.VECTOR_COMPACT_SEARCH),
+    "numpy": lambda: NumpyVectorStore(settings.VECTOR_STORE_DIR),
+}
+
+vector_store = VECTOR_STORES[settings.VECTOR_STORE]()
@@ -1,120 +1,234 @@
 """
 Functions copied from GCP examples:
 https://github.com/GoogleCloudPlatform/generative-ai/blob/main/language/examples/langchain-intro/intro_langchain_palm_api.ipynb
+
+langchain and the Vertex AI SDK take seconds to import, and creating a
+client looks the model up in Vertex AI, so neither happens when this module
+is imported: the shared clients are created by get_gcp_embeddings() and
+get_text_llm() on first use (or by the warmup request).
 """
 
+import asyncio
+import hashlib
+import logging
+import threading
 import time
-from typing import List
-from pydantic import BaseModel
-from pgvector.django import CosineDistance
-
-from langchain.embeddings import VertexAIEmbeddings
-from langchain.chains.question_answering import load_qa_chain
-from langchain.chains.qa_with_sources import load_qa_with_sources_chain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chat_models import ChatVertexAI
-from langchain.llms import VertexAI
-
-
-from chat.models import Message, User, Chat, DocumentChunk, Document
-
-
-# Utility functions for Embeddings API with rate limiting
-def rate_limit(max_per_minute):
-    period = 60 / max_per_minute
-    print("Waiting")
-    while True:
-        before = time.time()
-        yield
-        after = time.time()
-        elapsed = after - before
-        sleep_time = max(0, period - elapsed)
-        if sleep_time > 0:
-            print(".", end="")
-            time.sleep(sleep_time)
-
-
-class CustomVertexAIEmbeddings(VertexAIEmbeddings, BaseModel):
-    requests_per_minute: int
-    num_instances_per_batch: int
-
-    # Overriding embed_documents method
-    def embed_documents(self, texts: List[str]):
-        limiter = rate_limit(self.requests_per_minute)
-        results = []
-        docs = list(texts)
-
-        while docs:
-            # Working in batches because the API accepts maximum 5
-            # documents per request to get embeddings
-            head, docs = (
-                docs[: self.num_instances_per_batch],
-                docs[self.num_instances_per_batch :],
+from asgiref.sync import sync_to_async
+from django.db.models import prefetch_related_objects
+
+from google.api_core import exceptions as google_exceptions
+
+
+from chat.models import DocumentChunk
+from chat.llm_utils.registry import llm_registry
+from chat.llm_utils.vector_store import vector_store
+
+log = logging.getLogger(__name__)
+
+# Errors worth retrying a single batch for; anything else is raised immediately
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.Aborted,
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket for pacing calls against a per-minute quota.
+    Tokens refill continuously at rate_per_minute / 60 per second, up to
+    `capacity` tokens, so short bursts are allowed but the long-run rate
+    never exceeds the quota.
+    """
+
+    def __init__(self, rate_per_minute, capacity=1):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+        Take a token if one is available (returns 0), or return the seconds
+        to wait until one will be
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
             )
-            chunk = self.client.get_embeddings(head)
-            results.extend(chunk)
-            next(limiter)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        # Block until a token is available, then take it
+        while wait := self.take():
+            time.sleep(wait)
+
+    async def aacquire(self):
+        # acquire() for async code: waits without blocking the event loop
+        while wait := self.take():
+            await asyncio.sleep(wait)
+
 
-        return [r.values for r in results]
+# Max hashes per EmbeddingCache lookup query / rows per bulk insert
+CACHE_LOOKUP_BATCH = 500
+cache_stats_lock = threading.Lock()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 # Embedding
 EMBEDDING_QPM = 100
 EMBEDDING_NUM_BATCH = 5
-gcp_embeddings = CustomVertexAIEmbeddings(
-    requests_per_minute=EMBEDDING_QPM,
-    num_instances_per_batch=EMBEDDING_NUM_BATCH,
-)
+EMBEDDING_BURST = 5
+_gcp_embeddings = None
+_gcp_embeddings_lock = threading.Lock()
+
+
+def get_gcp_embeddings():
+    """
+    The shared CustomVertexAIEmbeddings, created on first use
+    """
+    global _gcp_embeddings
+    with _gcp_embeddings_lock:
+        if _gcp_embeddings is None:
+            from chat.llm_utils.embeddings import CustomVertexAIEmbeddings
+
+            _gcp_embeddings = CustomVertexAIEmbeddings(
+                requests_per_minute=EMBEDDING_QPM,
+                num_instances_per_batch=EMBEDDING_NUM_BATCH,
+                rate_limiter=TokenBucket(EMBEDDING_QPM, capacity=EMBEDDING_BURST),
+            )
+        return _gcp_embeddings
+
+
+# Text generation
+LLM_QPM = 60
+LLM_BURST = 5
+# Shared by everything that calls the text LLM in bulk (e.g. summarization)
+llm_rate_limiter = TokenBucket(LLM_QPM, capacity=LLM_BURST)
+
+
+def get_text_llm():
+    # The VertexAI used for titles, summaries and document QA
+    return llm_registry.llm("text-bison", max_output_tokens=1024, temperature=0.0)
+
+
+def get_docs_chunks_by_embedding(request, query, max_distance=None, **search_params):
+    """
+    Top 3 documents (by summary) and top 10 chunks (by keywords and embedding)
+    for query.
+    search_params are passed to the vector store, e.g. ef_search for pgvector.
+    """
+    # Imported here as query_cache imports this module
+    from chat.llm_utils.query_cache import query_embedding_cache
+
+    query_embedding = query_embedding_cache.get(query)
+    return search_by_embedding(
+        request.user, query, query_embedding, max_distance, **search_params
+    )
 
-text_llm = VertexAI(max_output_tokens=1024)
-summarize_chain = load_summarize_chain(text_llm, chain_type="map_reduce")
-CHUNK_SIZE = 2000
-CHUNK_OVERLAP = 200
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-)
 
+async def aget_docs_chunks_by_embedding(
+    user, query, max_distance=None, **search_params
+):
+    """
+    get_docs_chunks_by_embedding() for async views. The query is embedded
+    with the async client; the search runs in a worker thread.
+    """
+    from chat.llm_utils.query_cache import query_embedding_cache
 
-def get_docs_chunks_by_embedding(request, query, max_distance=None):
-    query_embedding = gcp_embeddings.embed_documents([query])[0]
-    user_docs = Document.objects.filter(user=request.user)
+    query_embedding = await query_embedding_cache.aget(query)
+    return await sync_to_async(search_by_embedding)(
+        user, query, query_embedding, max_distance, **search_params
+    )
+
+
+def search_by_embedding(user, query, query_embedding, max_distance=None, **params):
     # documents_by_mean = user_docs.order_by(
     #     CosineDistance("mean_embedding", query_embedding)
     # )[:3]
-    if max_distance is None:
-        documents_by_summary = user_docs.order_by(
-            CosineDistance("summary_embedding", query_embedding)
-        )[:3]
-        chunks_by_embedding = (
-            DocumentChunk.objects.filter(document__in=user_docs)
-            .order_by(CosineDistance("embedding", query_embedding))[:10]
-            .prefetch_related("document")
-        )
-    else:
-        documents_by_summary = user_docs.alias(
-            distance=CosineDistance("summary_embedding", query_embedding)
-        ).filter(distance__lt=max_distance)[:3]
-        chunks_by_embedding = (
-            DocumentChunk.objects.filter(document__in=user_docs)
-            .alias(distance=CosineDistance("embedding", query_embedding))
-            .filter(distance__lt=max_distance)
-            .prefetch_related("document")
-        )[:10]
+    documents_by_summary = vector_store.search_documents(
+        user, query_embedding, 3, max_distance, **params
+    )
+    chunks_by_embedding = vector_store.search_chunks_hybrid(
+        user, query, query_embedding, 10, max_distance, **params
+    )
+    DocumentChunk.load_texts(chunks_by_embedding)
+    # Results are rendered with their document's filename, and may be
+    # rendered by async views that can't load it lazily
+    prefetch_related_objects(chunks_by_embedding, "document")
 
     return documents_by_summary, chunks_by_embedding
 
 
+def qa_documents(documents_by_summary, chunks_by_embedding):
+    from langchain.docstore.document import Document as LcDocument
+
+    return [
+        LcDocument(page_content=doc.summary, metadata={"source": doc.file.name})
+        for doc in documents_by_summary
+    ] + [
+        LcDocument(
+            page_content=chunk.text, metadata={"source": chunk.document.file.name}
+        )
+        for chunk in chunks_by_embedding
+    ]
+
+
+def qa_prompt(chain, query, documents):
+    """
+    The prompt a "stuff" QA chain sends for query and documents, made with
+    the chain's own document and question prompts
+    """
+    from langchain.schema.prompt_template import format_document
+
+    context = chain.document_separator.join(
+        format_document(doc, chain.document_prompt) for doc in documents
+    )
+    return chain.llm_chain.prompt.format(
+        **{chain.document_variable_name: context, "question": query}
+    )
+
+
+async def aget_qa_response(query, documents):
+    """
+    get_qa_response() for async views: the QA chain's prompt, sent with the
+    async Vertex AI client as stream_vertex() does for chat (langchain's
+    VertexAI runs its async calls in a pool of 5 threads)
+    """
+    text_llm = await sync_to_async(get_text_llm, thread_sensitive=False)()
+    chain = llm_registry.qa_chain(text_llm)
+    response = await text_llm.client.predict_async(
+        qa_prompt(chain, query, documents),
+        temperature=text_llm.temperature,
+        max_output_tokens=text_llm.max_output_tokens,
+        top_k=text_llm.top_k,
+        top_p=text_llm.top_p,
+    )
+    return response.text
+
+
 def get_qa_response(query, documents, return_sources=True):
+    text_llm = get_text_llm()
     if return_sources:
-        chain = load_qa_with_sources_chain(text_llm, chain_type="stuff")
+        chain = llm_registry.qa_chain(text_llm)
         response = chain(
             {"input_documents": documents, "question": query}, return_only_outputs=True
         )
-        print(response)
+        log.debug(f"QA response: {response}")
         return response["output_text"]
     else:
-        chain = load_qa_chain(text_llm, chain_type="stuff")
+        chain = llm_registry.qa_chain(text_llm, return_sources=False)
         response = chain.run(input_documents=documents, question=query)
         return response
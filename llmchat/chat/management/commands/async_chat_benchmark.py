@@ -0,0 +1,142 @@
+"""
+How many chat responses one process can have in flight: the async
+chat_stream view (FAKE_LLM backend, streaming a word every --token-delay
+seconds) against the same generations made by blocking calls in a pool of
+--threads threads, as a threaded WSGI worker would.
+
+Requests go through Django's async request handling (AsyncClient), with a
+temporary user and chats that are deleted afterwards.
+
+    python manage.py async_chat_benchmark --concurrency 500 --token-delay 0.1
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from chat.llm_utils import streaming
+from chat.models import Chat, Message, User, UserSettings
+
+BENCHMARK_USER = "async-chat-benchmark@example.com"
+
+
+class ThreadMonitor(threading.Thread):
+    """
+    Records the most threads alive at once
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.01)
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent streamed chat responses (async vs threads)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=500)
+        parser.add_argument(
+            "--token-delay",
+            type=float,
+            default=0.1,
+            help="Seconds the fake backend takes per word",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=50,
+            help="Threads of the blocking baseline (App Engine allowed 50 "
+            "concurrent requests per instance)",
+        )
+
+    def handle(self, *args, **options):
+        User.objects.filter(username=BENCHMARK_USER).delete()
+        user = User.objects.create(username=BENCHMARK_USER, email=BENCHMARK_USER)
+        UserSettings.objects.create(user=user)
+        try:
+            chats = Chat.objects.bulk_create(
+                [Chat(user=user) for _ in range(options["concurrency"])]
+            )
+            Message.objects.bulk_create(
+                [Message(chat=chat, message="Hello!") for chat in chats]
+            )
+            streaming.FAKE_TOKEN_DELAY = options["token_delay"]
+            words = len(streaming.FAKE_RESPONSE.format(prompt="Hello!").split())
+            self.stdout.write(
+                f"{options['concurrency']} chats, responses of {words} words, "
+                f"{words * options['token_delay']:.1f}s each"
+            )
+            with override_settings(FAKE_LLM=True):
+                self.run_async(user, chats)
+            self.run_threads(chats, words, options)
+        finally:
+            user.delete()
+
+    def run_async(self, user, chats):
+        monitor = ThreadMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        self.streaming = self.peak_streaming = 0
+        first_tokens = asyncio.run(self.stream_all(user, chats))
+        elapsed = time.perf_counter() - start
+        monitor.running = False
+        saved = Message.objects.filter(chat__in=chats, is_bot=True).count()
+        self.stdout.write(
+            f"   async: {elapsed:.1f}s, first token p50 "
+            f"{np.percentile(first_tokens, 50):.2f}s / p95 "
+            f"{np.percentile(first_tokens, 95):.2f}s, {self.peak_streaming} "
+            f"responses streaming at once, peak {monitor.peak} threads, "
+            f"{saved} responses saved"
+        )
+
+    async def stream_all(self, user, chats):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(user)
+        return await asyncio.gather(*(self.stream(client, chat) for chat in chats))
+
+    async def stream(self, client, chat):
+        # Time to the first token event. Like Django's ASGIHandler (and unlike
+        # AsyncClient), each request gets its own thread for sync code.
+        start = time.perf_counter()
+        async with ThreadSensitiveContext():
+            response = await client.get(reverse("chat_stream", args=[chat.id]))
+            first_token = None
+            async for event in response.streaming_content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    self.streaming += 1
+                    self.peak_streaming = max(self.peak_streaming, self.streaming)
+            self.streaming -= 1
+        return first_token
+
+    def run_threads(self, chats, words, options):
+        start = time.perf_counter()
+
+        def generate(chat):
+            # A blocking call for the whole response, then the save
+            time.sleep(words * options["token_delay"])
+            Message.objects.create(chat=chat, message="Response", is_bot=True)
+            return time.perf_counter() - start
+
+        # All requests arrive at once and queue for a thread; nothing is shown
+        # until a response is complete
+        with ThreadPoolExecutor(options["threads"]) as executor:
+            responses = list(executor.map(generate, chats))
+        self.stdout.write(
+            f"{options['threads']:>3} threads: {time.perf_counter() - start:.1f}s, "
+            f"response p50 {np.percentile(responses, 50):.2f}s / p95 "
+            f"{np.percentile(responses, 95):.2f}s"
+        )
@@ -0,0 +1,117 @@
+"""
+Storage and read path of chunks stored as offsets into compressed document
+text, on a synthetic document written to the database in a transaction that
+is rolled back afterwards.
+
+Reports bytes stored per layout (the previous one kept the text uncompressed
+in Document.text and again, with overlap, in every DocumentChunk.text) and
+the time to fetch the text of k random chunks, as for one search result
+page:
+
+- rows only: fetching the chunk rows, roughly what reading a text column cost
+- blocks: rows, then DocumentChunk.load_texts (only the blocks they span)
+- whole text: rows, then decompressing the entire document
+
+    python manage.py chunk_storage_benchmark --chars 2000000
+"""
+
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Document, DocumentChunk
+from chat.llm_utils.indexing import iter_chunks
+
+
+class Rollback(Exception):
+    pass
+
+
+def synthetic_text(rng, chars):
+    """
+    Lines of words drawn from a Zipf distributed vocabulary (zlib compresses
+    it a little better than typical prose)
+    """
+    vocabulary = np.array(
+        [
+            "".join(rng.choice(list("etaoinshrdlucmfwyp"), rng.integers(2, 10)))
+            for _ in range(20000)
+        ]
+    )
+    lines = []
+    length = 0
+    while length < chars:
+        ranks = np.minimum(rng.zipf(1.2, rng.integers(8, 40)), len(vocabulary)) - 1
+        line = " ".join(vocabulary[ranks]) + "."
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:chars]
+
+
+class Command(BaseCommand):
+    help = "Benchmark chunk text storage as offsets into compressed blocks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chars", type=int, default=2000000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        text = synthetic_text(rng, options["chars"])
+        try:
+            with transaction.atomic():
+                self.benchmark(rng, text, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def benchmark(self, rng, text, options):
+        doc = Document(title="benchmark", text=text)
+        doc.save()
+        chunks = [
+            DocumentChunk(
+                document=doc, chunk_number=number, start=start, end=end, text=chunk
+            )
+            for number, (start, end, chunk) in enumerate(iter_chunks(text))
+        ]
+        DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+
+        text_bytes = len(text.encode("utf-8"))
+        previous = text_bytes + sum(len(chunk.text.encode("utf-8")) for chunk in chunks)
+        blocks = sum(
+            len(data) for data in doc.text_blocks.values_list("data", flat=True)
+        )
+        # Two integer columns per chunk instead of the text
+        current = blocks + 8 * len(chunks)
+        self.stdout.write(
+            f"{len(text)} characters, {len(chunks)} chunks\n"
+            f"text stored: {previous / 2**20:.2f} MiB before, "
+            f"{current / 2**20:.2f} MiB now ({previous / current:.1f}x smaller)"
+        )
+
+        ids = [chunk.id for chunk in chunks]
+        for name, load in [
+            ("rows only", lambda found: None),
+            ("blocks", DocumentChunk.load_texts),
+            ("whole text", lambda found: Document.objects.get(id=doc.id).text),
+        ]:
+            timings = []
+            for _ in range(options["queries"]):
+                sample = rng.choice(ids, options["k"], replace=False).tolist()
+                start = time.perf_counter()
+                found = list(
+                    DocumentChunk.objects.filter(id__in=sample).only(
+                        "id", "document", "start", "end"
+                    )
+                )
+                load(found)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(
+                f"{name:>10}: median {statistics.median(timings) * 1000:.2f} ms "
+                f"for {options['k']} chunks"
+            )
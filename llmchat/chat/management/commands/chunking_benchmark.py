@@ -0,0 +1,63 @@
+"""
+Speed and chunk sizes (in tokens) of token budget chunking, compared with the
+previous character based splitter (RecursiveCharacterTextSplitter, 2000
+characters with 200 overlap), on synthetic text.
+
+    python manage.py chunking_benchmark --chars 1000000
+"""
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from chat.management.commands.chunk_storage_benchmark import synthetic_text
+from chat.llm_utils.chunking import (
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENS,
+    count_tokens,
+    tokenizer,
+)
+from chat.llm_utils.indexing import iter_chunks
+
+
+class Command(BaseCommand):
+    help = "Benchmark token budget chunking against character chunking"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chars", type=int, default=1000000)
+        parser.add_argument("--tokens", type=int, default=CHUNK_TOKENS)
+        parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP_TOKENS)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        text = synthetic_text(np.random.default_rng(options["seed"]), options["chars"])
+        start = time.perf_counter()
+        loaded = tokenizer() is not None
+        self.stdout.write(
+            f"tokenizer {'loaded' if loaded else 'not configured, estimating'} "
+            f"in {time.perf_counter() - start:.2f}s (once)"
+        )
+        self.stdout.write(f"{len(text)} characters")
+
+        start = time.perf_counter()
+        chunks = [
+            chunk
+            for _, _, chunk in iter_chunks(text, options["tokens"], options["overlap"])
+        ]
+        self.report("tokens", time.perf_counter() - start, chunks)
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+        start = time.perf_counter()
+        chunks = splitter.split_text(text)
+        self.report("characters", time.perf_counter() - start, chunks)
+
+    def report(self, name, elapsed, chunks):
+        # Chunks are tokenized on their own, as the embedding model sees them
+        tokens = np.array(count_tokens(chunks))
+        self.stdout.write(
+            f"{name:>10}: {elapsed:.2f}s, {len(chunks)} chunks, tokens per chunk "
+            f"min {tokens.min()} / median {int(np.median(tokens))} / "
+            f"max {tokens.max()} (std {tokens.std():.0f})"
+        )
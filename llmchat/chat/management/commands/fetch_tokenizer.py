@@ -0,0 +1,32 @@
+"""
+Save a tokenizer from the Hugging Face hub to settings.CHUNK_TOKENIZER, the
+file chunking loads it from. Run it before deploying, so the tokenizer file
+is uploaded with the app and instances never need the hub:
+
+    python manage.py fetch_tokenizer gpt2
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Download a Hugging Face tokenizer to settings.CHUNK_TOKENIZER"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "name", nargs="?", default="gpt2", help="Tokenizer on the hub"
+        )
+
+    def handle(self, *args, **options):
+        from tokenizers import Tokenizer
+
+        path = settings.CHUNK_TOKENIZER
+        if not path:
+            raise CommandError("CHUNK_TOKENIZER isn't set")
+        tokenizer = Tokenizer.from_pretrained(options["name"])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tokenizer.save(path)
+        self.stdout.write(f"Saved the {options['name']} tokenizer to {path}")
@@ -0,0 +1,164 @@
+"""
+Compare PDF ingestion in the request thread (the old upload path: read the
+whole file, copy it to a temporary file, PyPDFLoader, join the pages) with
+streaming, page-by-page parsing in the process pool, on a synthetic PDF.
+
+Reports wall time, peak Python memory in the web process, and the longest
+stall seen by another thread while parsing (how long other requests would
+wait for the GIL).
+
+    python manage.py pdf_ingest_benchmark --pages 500
+"""
+
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from langchain.document_loaders import PyPDFLoader
+
+from chat.llm_utils.parsing import extract_text, parse_pool
+
+LINE = "Section {page}.{line}: the quick brown fox jumps over the lazy dog {n}"
+
+
+def synthetic_pdf(path, pages, lines_per_page=45):
+    """
+    Write a minimal text PDF: one Helvetica content stream per page
+    """
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    page_ids = []
+    for page in range(1, pages + 1):
+        page_id, content_id = 2 + page * 2, 3 + page * 2
+        lines = (
+            LINE.format(page=page, line=line, n=page * lines_per_page + line)
+            for line in range(lines_per_page)
+        )
+        stream = (
+            "BT /F1 10 Tf 14 TL 40 810 Td "
+            + " ".join(f"({line}) '" for line in lines)
+            + " ET"
+        )
+        objects[content_id] = (
+            f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        )
+        objects[page_id] = (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>"
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode())
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for object_id in sorted(objects):
+            f.write(f"{offsets[object_id]:010d} 00000 n \n".encode())
+        f.write(
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+
+
+def parse_in_request(upload):
+    """
+    The previous DocumentsView.post parsing, for comparison
+    """
+    temp_file = tempfile.NamedTemporaryFile(delete=False)
+    temp_file.write(upload.file.read())
+    temp_file.seek(0)
+    docs = PyPDFLoader(temp_file.name).load()
+    temp_file.close()
+    os.unlink(temp_file.name)
+    return "\n\n".join([doc.page_content for doc in docs])
+
+
+def parse_streaming(upload):
+    return extract_text(upload)[0]
+
+
+class StallMonitor(threading.Thread):
+    """
+    Sleeps 1ms at a time and records the longest gap between wake-ups
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.longest = 0
+        self.running = True
+
+    def run(self):
+        last = time.perf_counter()
+        while self.running:
+            time.sleep(0.001)
+            now = time.perf_counter()
+            self.longest = max(self.longest, now - last)
+            last = now
+
+
+class Command(BaseCommand):
+    help = "Benchmark in-request vs process pool PDF parsing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "synthetic.pdf")
+            synthetic_pdf(path, options["pages"])
+            size = os.path.getsize(path)
+            self.stdout.write(f"{options['pages']} pages, {size / 2**20:.1f} MiB")
+
+            start = time.perf_counter()
+            parse_pool().submit(os.getpid).result()
+            self.stdout.write(
+                f"process pool start: {time.perf_counter() - start:.2f}s (once)"
+            )
+
+            for name, parse in [
+                ("in request", parse_in_request),
+                ("process pool", parse_streaming),
+            ]:
+                text_length, elapsed, stall = self.timed(parse, path, size)
+                tracemalloc.start()
+                parse(self.upload(path, size))
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"{name:>12}: {elapsed:.2f}s, peak {peak / 2**20:.1f} MiB, "
+                    f"longest stall {stall * 1000:.0f} ms, {text_length} chars"
+                )
+
+    def upload(self, path, size):
+        """
+        Copy path into a TemporaryUploadedFile, as Django stores large uploads
+        """
+        upload = TemporaryUploadedFile("synthetic.pdf", "application/pdf", size, None)
+        with open(path, "rb") as f:
+            while chunk := f.read(64 * 1024):
+                upload.write(chunk)
+        upload.seek(0)
+        return upload
+
+    def timed(self, parse, path, size):
+        upload = self.upload(path, size)
+        monitor = StallMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        text = parse(upload)
+        elapsed = time.perf_counter() - start
+        monitor.running = False
+        monitor.join()
+        return len(text), elapsed, monitor.longest
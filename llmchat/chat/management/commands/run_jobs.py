@@ -0,0 +1,97 @@
+"""
+Worker for the database-backed job queue (see chat/jobs.py).
+
+    python manage.py run_jobs                   # all priorities, forever
+    python manage.py run_jobs --max-priority 0  # interactive jobs only
+    python manage.py run_jobs --once            # drain the queue and exit
+    python manage.py run_jobs --port $PORT      # as the App Engine worker service
+
+In production the worker runs as its own App Engine service (worker.yaml),
+which only needs an HTTP server to answer the instance's start request.
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat import jobs
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    # Answers App Engine's /_ah/start, /_ah/stop and health checks
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (summaries, indexing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            "--max-priority",
+            type=int,
+            default=None,
+            help="Only run jobs with priority <= this (0 = interactive only)",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=30,
+            help="Minutes without a heartbeat after which a running job is "
+            "assumed dead and requeued",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no runnable jobs left",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=None,
+            help="Answer HTTP requests on this port (for App Engine)",
+        )
+
+    def handle(self, *args, **options):
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        stale_after = timedelta(minutes=options["stale_after"])
+        if options["port"] is not None:
+            server = ThreadingHTTPServer(("", options["port"]), StatusHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write(f"Worker {worker_name} waiting for jobs")
+        while True:
+            close_old_connections()
+            requeued, failed = jobs.requeue_stale(stale_after)
+            if requeued or failed:
+                self.stdout.write(
+                    f"Requeued {requeued} and failed {failed} stale job(s)"
+                )
+            job = jobs.claim_next(worker_name, max_priority=options["max_priority"])
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+            start = time.monotonic()
+            jobs.run_job(job)
+            self.stdout.write(
+                f"{job} finished in {time.monotonic() - start:.1f}s "
+                f"(attempt {job.attempts})"
+            )
@@ -0,0 +1,92 @@
+"""
+Import-time breakdown of a cold start. A new Python process (under
+`python -X importtime`) imports the ASGI application and loads the URLconf,
+as a new instance does before serving its first request; the total time and
+the slowest packages and modules are reported.
+
+With --budget, the command fails if the cold start took longer, so a CI step
+can hold the startup budget. Clients (LLMs, embeddings) aren't created at
+startup, so they don't count; the warmup request creates them.
+
+    python manage.py startup_profile --budget 3
+"""
+
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+STARTUP_CODE = """
+import time
+start = time.perf_counter()
+import {app}
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(time.perf_counter() - start)
+"""
+# "import time: self [us] | cumulative | imported package"
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)")
+
+
+class Command(BaseCommand):
+    help = "Report the import time of a cold start, by package and module"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--app", default="llmchat.asgi", help="Module served by the app server"
+        )
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument(
+            "--budget",
+            type=float,
+            help="Fail if the cold start takes longer than this many seconds",
+        )
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                STARTUP_CODE.format(app=options["app"]),
+            ],
+            env=os.environ,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+        total = float(result.stdout.strip().splitlines()[-1])
+
+        by_package = defaultdict(int)
+        modules = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match is None:
+                continue
+            self_us, cumulative_us, name = match.groups()
+            by_package[name.split(".")[0]] += int(self_us)
+            modules.append((int(self_us), int(cumulative_us), name))
+
+        self.stdout.write(f"Cold start: {total:.2f}s ({len(modules)} modules)")
+        self.stdout.write("\nSlowest packages (own import time of their modules):")
+        for package, us in sorted(by_package.items(), key=lambda p: -p[1])[
+            : options["top"]
+        ]:
+            self.stdout.write(f"  {us / 1e6:7.3f}s  {package}")
+        self.stdout.write("\nSlowest modules (own / including their imports):")
+        for self_us, cumulative_us, name in sorted(modules, reverse=True)[
+            : options["top"]
+        ]:
+            self.stdout.write(
+                f"  {self_us / 1e6:7.3f}s / {cumulative_us / 1e6:7.3f}s  {name}"
+            )
+
+        if options["budget"] is not None and total > options["budget"]:
+            raise CommandError(
+                f"Cold start took {total:.2f}s, over the {options['budget']}s budget"
+            )
@@ -0,0 +1,112 @@
+"""
+Report on the pgvector ANN indexes: size, (optionally) build time, and
+recall@k / latency of index scans against exact search at several
+hnsw.ef_search settings.
+
+    python manage.py vector_index_report
+    python manage.py vector_index_report --ef-search 20 40 100 200 --samples 100
+    python manage.py vector_index_report --rebuild   # also time a REINDEX
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from pgvector.django import CosineDistance
+
+from chat.models import Document, DocumentChunk
+from chat.llm_utils.vector_store import set_ann_search_params
+
+# index name -> (model, vector field)
+INDEXES = {
+    "chat_documentchunk_embedding_hnsw": (DocumentChunk, "embedding"),
+    "chat_document_summary_embedding_hnsw": (Document, "summary_embedding"),
+}
+
+
+class Command(BaseCommand):
+    help = "Report ANN index size, build time and recall against exact search"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=50)
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument(
+            "--ef-search", type=int, nargs="+", default=[20, 40, 100, 200]
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="REINDEX each index to measure build time (blocks writes)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("ANN indexes are only available on Postgres")
+        for index_name, (model, field) in INDEXES.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(index_name))
+            self.report_size(index_name)
+            if options["rebuild"]:
+                self.report_build_time(index_name)
+            self.report_recall(model, field, options)
+
+    def report_size(self, index_name):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_size_pretty(pg_relation_size(%s::regclass))", [index_name]
+            )
+            self.stdout.write(f"  size: {cursor.fetchone()[0]}")
+
+    def report_build_time(self, index_name):
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {index_name}")
+        self.stdout.write(f"  build time: {time.perf_counter() - start:.2f}s")
+
+    def nearest(self, model, field, vector, k, exact=False, ef_search=None):
+        with transaction.atomic():
+            if exact:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+            set_ann_search_params(ef_search=ef_search)
+            start = time.perf_counter()
+            ids = list(
+                model.objects.filter(**{f"{field}__isnull": False})
+                .order_by(CosineDistance(field, vector))
+                .values_list("id", flat=True)[:k]
+            )
+            return ids, time.perf_counter() - start
+
+    def report_recall(self, model, field, options):
+        k = options["k"]
+        # Use stored vectors as queries: they follow the real data distribution
+        queries = list(
+            model.objects.filter(**{f"{field}__isnull": False})
+            .order_by("?")
+            .values_list(field, flat=True)[: options["samples"]]
+        )
+        if not queries:
+            self.stdout.write("  no vectors to sample")
+            return
+        exact_time = 0
+        exact_results = []
+        for vector in queries:
+            ids, elapsed = self.nearest(model, field, vector, k, exact=True)
+            exact_results.append(set(ids))
+            exact_time += elapsed
+        self.stdout.write(
+            f"  exact search: {exact_time / len(queries) * 1000:.1f} ms/query"
+        )
+        for ef_search in options["ef_search"]:
+            found = 0
+            ann_time = 0
+            for vector, expected in zip(queries, exact_results):
+                ids, elapsed = self.nearest(
+                    model, field, vector, k, ef_search=ef_search
+                )
+                found += len(expected.intersection(ids))
+                ann_time += elapsed
+            recall = found / sum(len(expected) for expected in exact_results)
+            self.stdout.write(
+                f"  ef_search={ef_search}: recall@{k} {recall:.3f}, "
+                f"{ann_time / len(queries) * 1000:.1f} ms/query"
+            )
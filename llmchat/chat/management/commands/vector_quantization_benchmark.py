@@ -0,0 +1,120 @@
+"""
+Recall / latency / size trade-off of compact vector representations, measured
+on a synthetic clustered corpus (no database needed):
+
+- float16 (what the halfvec column stores)
+- int8 scalar quantization
+- binary codes (sign bits, Hamming distance)
+
+Each first stage returns k * --rerank candidates, which are re-ranked with the
+float32 vectors. Recall@k is against exact float32 search. Latencies are for
+numpy, which has no fast low precision kernels, so they do not reflect
+pgvector's SIMD halfvec distance; sizes and recall carry over.
+
+    python manage.py vector_quantization_benchmark --rows 100000 --rerank 4
+"""
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from chat.llm_utils.vector_store import EMBEDDING_DIMENSIONS, normalize, top_k
+
+# Popcount of every byte value, for Hamming distance between packed bit codes
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)
+# Rows converted to float32 at a time when scanning compact matrices
+SCAN_BLOCK = 8192
+
+
+def synthetic_corpus(rng, rows, clusters=256, spread=0.5):
+    """
+    Normalized vectors around random centroids, roughly like the topical
+    clustering of real document chunks (uniform random vectors are all
+    nearly equidistant, which makes recall meaningless)
+    """
+    centroids = rng.standard_normal((clusters, EMBEDDING_DIMENSIONS))
+    labels = rng.integers(clusters, size=rows)
+    noise = rng.standard_normal((rows, EMBEDDING_DIMENSIONS)) * spread
+    return normalize(centroids[labels] + noise)
+
+
+def blockwise_scores(matrix, query, scale=1.0):
+    return (
+        np.concatenate(
+            [
+                matrix[i : i + SCAN_BLOCK].astype(np.float32) @ query
+                for i in range(0, len(matrix), SCAN_BLOCK)
+            ]
+        )
+        * scale
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark compact vector representations with full precision re-rank"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument(
+            "--rerank",
+            type=int,
+            default=4,
+            help="First stage candidates per result (1 = no re-rank)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        k = options["k"]
+        candidates = k * options["rerank"]
+        corpus = synthetic_corpus(rng, options["rows"] + options["queries"])
+        matrix, queries = corpus[: options["rows"]], corpus[options["rows"] :]
+
+        int8_scale = 127 / np.abs(matrix).max()
+        matrix_int8 = np.round(matrix * int8_scale).astype(np.int8)
+        bits = np.packbits(matrix > 0, axis=1)
+        engines = {
+            "float32": (matrix.nbytes, lambda q: 1 - matrix @ q),
+            "float16": (
+                matrix.astype(np.float16).nbytes,
+                lambda q, m=matrix.astype(np.float16): 1 - blockwise_scores(m, q),
+            ),
+            "int8": (
+                matrix_int8.nbytes,
+                lambda q: 1 - blockwise_scores(matrix_int8, q, 1 / int8_scale),
+            ),
+            "binary": (
+                bits.nbytes,
+                lambda q: POPCOUNT[np.bitwise_xor(bits, np.packbits(q > 0))].sum(1),
+            ),
+        }
+
+        exact = [set(top_k(matrix, q, k)[0]) for q in queries]
+        self.stdout.write(
+            f"{options['rows']} x {EMBEDDING_DIMENSIONS} vectors, "
+            f"k={k}, {candidates} first stage candidates"
+        )
+        for name, (nbytes, distances) in engines.items():
+            first_stage_found = reranked_found = 0
+            timings = []
+            for query, expected in zip(queries, exact):
+                start = time.perf_counter()
+                scores = distances(query)
+                first = np.argpartition(scores, candidates - 1)[:candidates]
+                # Full precision re-rank of the candidates only
+                reranked = first[np.argsort(1 - matrix[first] @ query)[:k]]
+                timings.append(time.perf_counter() - start)
+                first_stage_found += len(
+                    expected.intersection(first[np.argsort(scores[first])[:k]])
+                )
+                reranked_found += len(expected.intersection(reranked))
+            total = k * len(queries)
+            self.stdout.write(
+                f"{name:>8}: {nbytes / options['rows']:6.0f} bytes/vector, "
+                f"recall@{k} {first_stage_found / total:.3f} first stage, "
+                f"{reranked_found / total:.3f} re-ranked, "
+                f"median {np.median(timings) * 1000:.1f} ms/query"
+            )
@@ -0,0 +1,121 @@
+"""
+Compare the vector store engines on one user's chunks: build / load time,
+query latency, and how many of the exact (numpy) top-k results pgvector finds.
+
+    python manage.py vector_store_benchmark --user someone@example.com
+    python manage.py vector_store_benchmark --synthetic 1000000   # numpy only
+"""
+
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.models import DocumentChunk, User
+from chat.llm_utils.vector_store import (
+    EMBEDDING_DIMENSIONS,
+    NumpyVectorStore,
+    PgVectorStore,
+    normalize,
+    top_k,
+)
+
+
+def summarize_timings(timings):
+    timings = sorted(timings)
+    return (
+        f"median {statistics.median(timings) * 1000:.2f} ms, "
+        f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms"
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark the pgvector and numpy vector store engines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Email of the user whose chunks to search")
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            metavar="ROWS",
+            help="Time numpy top-k on ROWS random vectors instead of real data",
+        )
+
+    def handle(self, *args, **options):
+        if options["synthetic"]:
+            self.benchmark_synthetic(options["synthetic"], options)
+            return
+        if not options["user"]:
+            raise CommandError("--user or --synthetic is required")
+        user = User.objects.get(email=options["user"])
+        k = options["k"]
+        # Stored chunk vectors as queries follow the real data distribution
+        queries = list(
+            DocumentChunk.objects.filter(user=user, embedding__isnull=False)
+            .order_by("?")
+            .values_list("embedding", flat=True)[: options["queries"]]
+        )
+        if not queries:
+            raise CommandError(f"{user} has no indexed chunks")
+
+        with tempfile.TemporaryDirectory() as directory:
+            numpy_store = NumpyVectorStore(directory)
+            start = time.perf_counter()
+            ids, _ = numpy_store.load(user)
+            self.stdout.write(
+                f"numpy: built {len(ids)} x {EMBEDDING_DIMENSIONS} matrix "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+            start = time.perf_counter()
+            NumpyVectorStore(directory).load(user)
+            self.stdout.write(
+                f"numpy: mapped existing file in {time.perf_counter() - start:.3f}s"
+            )
+            exact, timings = self.run(numpy_store, user, queries, k)
+            self.stdout.write(f"numpy: {summarize_timings(timings)}")
+
+        if connection.vendor != "postgresql":
+            self.stdout.write("pgvector: skipped (database is not Postgres)")
+            return
+        found, timings = self.run(PgVectorStore(), user, queries, k)
+        recall = sum(
+            len(set(expected) & set(result)) for expected, result in zip(exact, found)
+        ) / sum(len(expected) for expected in exact)
+        self.stdout.write(
+            f"pgvector: {summarize_timings(timings)}, recall@{k} {recall:.3f}"
+        )
+
+    def run(self, store, user, queries, k):
+        results = []
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            chunks = store.search_chunks(user, query, k)
+            timings.append(time.perf_counter() - start)
+            results.append([chunk.id for chunk in chunks])
+        return results, timings
+
+    def benchmark_synthetic(self, rows, options):
+        rng = np.random.default_rng(0)
+        matrix = normalize(rng.standard_normal((rows, EMBEDDING_DIMENSIONS)))
+        queries = normalize(
+            rng.standard_normal((options["queries"], EMBEDDING_DIMENSIONS))
+        )
+        self.stdout.write(
+            f"{rows} x {EMBEDDING_DIMENSIONS} float32 ({matrix.nbytes / 2**20:.0f} MiB)"
+        )
+        for name, search in [
+            ("argpartition", lambda q: top_k(matrix, q, options["k"])),
+            ("full argsort", lambda q: np.argsort(1 - matrix @ q)[: options["k"]]),
+        ]:
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                search(query)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"{name}: {summarize_timings(timings)}")
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.4 on 2026-10-18 18:56
+
+from django.db import migrations, models
+import pgvector.django
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0018_usersettings_debug_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_name", models.CharField(max_length=255)),
+                ("text_hash", models.CharField(max_length=64)),
+                ("embedding", pgvector.django.VectorField(dimensions=768)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="embeddingcache",
+            constraint=models.UniqueConstraint(
+                fields=("model_name", "text_hash"), name="unique_embedding_cache_key"
+            ),
+        ),
+    ]
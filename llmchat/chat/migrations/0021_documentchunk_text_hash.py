@@ -0,0 +1,35 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:05
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_text_hash(apps, schema_editor):
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    batch = []
+    for chunk in (
+        DocumentChunk.objects.filter(text_hash="").only("id", "text").iterator(2000)
+    ):
+        chunk.text_hash = hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()
+        batch.append(chunk)
+        if len(batch) == 2000:
+            DocumentChunk.objects.bulk_update(batch, ["text_hash"])
+            batch = []
+    DocumentChunk.objects.bulk_update(batch, ["text_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0020_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="text_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(backfill_text_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:20
+
+from django.db import migrations
+
+# HNSW indexes need pgvector >= 0.5.0. They are created with raw SQL (and
+# CONCURRENTLY, so existing tables stay writable while the index builds)
+# because they only exist on Postgres; the sqlite CI database skips them.
+INDEXES = {
+    "chat_documentchunk_embedding_hnsw": ("chat_documentchunk", "embedding"),
+    "chat_document_summary_embedding_hnsw": ("chat_document", "summary_embedding"),
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, (table, column) in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+            f"USING hnsw ({column} vector_cosine_ops) "
+            f"WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("chat", "0021_documentchunk_text_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_chunk_user(apps, schema_editor):
+    Document = apps.get_model("chat", "Document")
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    # One UPDATE per document rather than per chunk
+    for doc_id, user_id in (
+        Document.objects.filter(user__isnull=False, chunks__isnull=False)
+        .distinct()
+        .values_list("id", "user_id")
+        .iterator()
+    ):
+        DocumentChunk.objects.filter(document_id=doc_id).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("chat", "0022_hnsw_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="user",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(backfill_chunk_user, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="documentchunk",
+            index=models.Index(
+                fields=["user", "document", "chunk_number"], name="chunk_user_idx"
+            ),
+        ),
+    ]
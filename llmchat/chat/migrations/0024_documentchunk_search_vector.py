@@ -0,0 +1,54 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:31
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Postgres only: a trigger keeps search_vector in sync with text on every
+# insert (including bulk_create) and text update, and a GIN index serves
+# full text queries. The sqlite CI database just gets the (unused) column.
+FORWARD_SQL = [
+    """
+    CREATE TRIGGER chat_documentchunk_search_vector_update
+    BEFORE INSERT OR UPDATE OF text ON chat_documentchunk
+    FOR EACH ROW EXECUTE FUNCTION
+    tsvector_update_trigger(search_vector, 'pg_catalog.english', text)
+    """,
+    "UPDATE chat_documentchunk SET search_vector = to_tsvector('pg_catalog.english', text)",
+    """
+    CREATE INDEX IF NOT EXISTS chat_documentchunk_search_vector_gin
+    ON chat_documentchunk USING gin (search_vector)
+    """,
+]
+REVERSE_SQL = [
+    "DROP INDEX IF EXISTS chat_documentchunk_search_vector_gin",
+    "DROP TRIGGER IF EXISTS chat_documentchunk_search_vector_update ON chat_documentchunk",
+]
+
+
+def create_trigger_and_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in FORWARD_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_trigger_and_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in REVERSE_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0023_documentchunk_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunPython(create_trigger_and_index, drop_trigger_and_index),
+    ]
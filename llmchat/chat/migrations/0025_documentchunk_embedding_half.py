@@ -0,0 +1,87 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:15
+
+from django.db import migrations
+import pgvector.django
+
+# Not atomic: the backfill commits batch by batch instead of rewriting the
+# whole table in one transaction, and the index is built CONCURRENTLY.
+# halfvec needs pgvector >= 0.7.0 on Postgres, which is required from here on.
+BACKFILL_BATCH_SIZE = 5000
+MIN_PGVECTOR_VERSION = (0, 7)
+
+
+def check_pgvector_version(apps, schema_editor):
+    # Fail with instructions rather than 'type "halfvec" does not exist'
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        (version,) = cursor.fetchone()
+    if tuple(int(n) for n in version.split(".")[:2]) < MIN_PGVECTOR_VERSION:
+        raise RuntimeError(
+            f"pgvector {version} is installed, but halfvec needs pgvector 0.7.0 "
+            "or newer: upgrade it, then run `ALTER EXTENSION vector UPDATE;`"
+        )
+
+
+def backfill_embedding_half(apps, schema_editor):
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    pending = DocumentChunk.objects.filter(
+        embedding__isnull=False, embedding_half__isnull=True
+    )
+    if schema_editor.connection.vendor == "postgresql":
+        # Cast in the database, one id range per statement
+        max_id = pending.order_by("-id").values_list("id", flat=True).first() or 0
+        for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+            schema_editor.execute(
+                "UPDATE chat_documentchunk SET embedding_half = embedding::halfvec "
+                "WHERE id >= %s AND id < %s AND embedding IS NOT NULL "
+                "AND embedding_half IS NULL",
+                [start, start + BACKFILL_BATCH_SIZE],
+            )
+        return
+    batch = []
+    for chunk in pending.only("id", "embedding").iterator(BACKFILL_BATCH_SIZE):
+        chunk.embedding_half = chunk.embedding
+        batch.append(chunk)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            DocumentChunk.objects.bulk_update(batch, ["embedding_half"])
+            batch = []
+    DocumentChunk.objects.bulk_update(batch, ["embedding_half"])
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS chat_documentchunk_embedding_half_hnsw "
+        "ON chat_documentchunk USING hnsw (embedding_half halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "DROP INDEX CONCURRENTLY IF EXISTS chat_documentchunk_embedding_half_hnsw"
+    )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("chat", "0024_documentchunk_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_pgvector_version, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="embedding_half",
+            field=pgvector.django.HalfVectorField(dimensions=768, null=True),
+        ),
+        migrations.RunPython(backfill_embedding_half, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0025_documentchunk_embedding_half"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="page_offsets",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
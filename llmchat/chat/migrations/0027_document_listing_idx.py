@@ -0,0 +1,19 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0026_document_page_offsets"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                fields=["user", "-uploaded_at", "-id"], name="document_listing_idx"
+            ),
+        ),
+    ]
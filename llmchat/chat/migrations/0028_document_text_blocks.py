@@ -0,0 +1,164 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:29
+
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Document text moves to zlib compressed blocks (chat.models.TEXT_BLOCK_SIZE
+# characters each), and chunks keep (start, end) offsets into it instead of a
+# copy of their text. Chunks that are no longer in their document's text
+# (re-uploaded since it was indexed) can't be located; they are deleted, and
+# re-indexing the document replaces them.
+TEXT_BLOCK_SIZE = 64 * 1024
+UPDATE_BATCH_SIZE = 1000
+
+
+def move_text_to_blocks(apps, schema_editor):
+    Document = apps.get_model("chat", "Document")
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    DocumentTextBlock = apps.get_model("chat", "DocumentTextBlock")
+    for doc_id in Document.objects.values_list("id", flat=True).iterator():
+        text = Document.objects.filter(id=doc_id).values_list("text", flat=True)[0]
+        DocumentTextBlock.objects.bulk_create(
+            [
+                DocumentTextBlock(
+                    document_id=doc_id,
+                    number=number,
+                    data=zlib.compress(
+                        text[start : start + TEXT_BLOCK_SIZE].encode("utf-8")
+                    ),
+                )
+                for number, start in enumerate(range(0, len(text), TEXT_BLOCK_SIZE))
+            ]
+        )
+        Document.objects.filter(id=doc_id).update(text_length=len(text))
+
+        located = []
+        stale = []
+        search_from = 0
+        for chunk in (
+            DocumentChunk.objects.filter(document_id=doc_id)
+            .only("id", "text")
+            .order_by("chunk_number")
+        ):
+            start = text.find(chunk.text, search_from)
+            if start == -1:
+                start = text.find(chunk.text)
+            if start == -1:
+                stale.append(chunk.id)
+                continue
+            chunk.start, chunk.end = start, start + len(chunk.text)
+            located.append(chunk)
+            search_from = start + 1
+        DocumentChunk.objects.bulk_update(
+            located, ["start", "end"], batch_size=UPDATE_BATCH_SIZE
+        )
+        DocumentChunk.objects.filter(id__in=stale).delete()
+
+
+def move_text_back(apps, schema_editor):
+    Document = apps.get_model("chat", "Document")
+    DocumentChunk = apps.get_model("chat", "DocumentChunk")
+    DocumentTextBlock = apps.get_model("chat", "DocumentTextBlock")
+    for doc_id in Document.objects.values_list("id", flat=True).iterator():
+        text = "".join(
+            zlib.decompress(data).decode("utf-8")
+            for data in DocumentTextBlock.objects.filter(document_id=doc_id)
+            .order_by("number")
+            .values_list("data", flat=True)
+        )
+        Document.objects.filter(id=doc_id).update(text=text)
+        chunks = list(
+            DocumentChunk.objects.filter(document_id=doc_id).only("id", "start", "end")
+        )
+        for chunk in chunks:
+            chunk.text = text[chunk.start : chunk.end]
+        DocumentChunk.objects.bulk_update(
+            chunks, ["text"], batch_size=UPDATE_BATCH_SIZE
+        )
+
+
+def drop_search_vector_trigger(apps, schema_editor):
+    # search_vector is now set when chunks are created (see indexing)
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "DROP TRIGGER IF EXISTS chat_documentchunk_search_vector_update "
+        "ON chat_documentchunk"
+    )
+
+
+def create_search_vector_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("""
+        CREATE TRIGGER chat_documentchunk_search_vector_update
+        BEFORE INSERT OR UPDATE OF text ON chat_documentchunk
+        FOR EACH ROW EXECUTE FUNCTION
+        tsvector_update_trigger(search_vector, 'pg_catalog.english', text)
+        """)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0027_document_listing_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentTextBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("number", models.IntegerField()),
+                ("data", models.BinaryField()),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="text_blocks",
+                        to="chat.document",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="documenttextblock",
+            constraint=models.UniqueConstraint(
+                fields=("document", "number"), name="unique_document_text_block"
+            ),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="text_length",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="start",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="end",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(move_text_to_blocks, move_text_back),
+        migrations.RunPython(drop_search_vector_trigger, create_search_vector_trigger),
+        migrations.RemoveField(
+            model_name="document",
+            name="text",
+        ),
+        migrations.RemoveField(
+            model_name="documentchunk",
+            name="text",
+        ),
+    ]
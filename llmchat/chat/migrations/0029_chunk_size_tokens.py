@@ -0,0 +1,39 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+# chunk_size and chunk_overlap were characters and are now tokens. Existing
+# documents get the token defaults: their current chunks stay as they are,
+# and are re-chunked by tokens the next time the document is indexed.
+CHUNK_TOKENS = 500
+CHUNK_OVERLAP_TOKENS = 50
+
+
+def set_token_sizes(apps, schema_editor):
+    Document = apps.get_model("chat", "Document")
+    Document.objects.update(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS)
+
+
+def set_character_sizes(apps, schema_editor):
+    Document = apps.get_model("chat", "Document")
+    Document.objects.update(chunk_size=2000, chunk_overlap=200)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0028_document_text_blocks"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="document",
+            name="chunk_overlap",
+            field=models.IntegerField(default=50),
+        ),
+        migrations.AlterField(
+            model_name="document",
+            name="chunk_size",
+            field=models.IntegerField(default=500),
+        ),
+        migrations.RunPython(set_token_sizes, set_character_sizes),
+    ]
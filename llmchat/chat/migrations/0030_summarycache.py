@@ -0,0 +1,37 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0029_chunk_size_tokens"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SummaryCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_name", models.CharField(max_length=255)),
+                ("prompt_hash", models.CharField(max_length=64)),
+                ("summary", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="summarycache",
+            constraint=models.UniqueConstraint(
+                fields=("model_name", "prompt_hash"), name="unique_summary_cache_key"
+            ),
+        ),
+    ]
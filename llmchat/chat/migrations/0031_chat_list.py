@@ -0,0 +1,22 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0030_summarycache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usersettings",
+            name="chat_list_version",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "-timestamp"], name="chat_listing_idx"),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0031_chat_list"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="running_summary",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="chat",
+            name="summary_through",
+            field=models.IntegerField(default=0),
+        ),
+    ]
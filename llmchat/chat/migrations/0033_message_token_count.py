@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0032_chat_running_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="token_count",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+def backfill_heartbeat(apps, schema_editor):
+    Job = apps.get_model("chat", "Job")
+    # Running jobs are judged stale by their heartbeat from now on
+    Job.objects.filter(status="running").update(heartbeat_at=models.F("started_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0033_message_token_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0034_job_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="title_attempted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
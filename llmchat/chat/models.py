@@ -2,10 +2,15 @@
 Models for the LLM chat application
 """
 
-from django.db import models
+import zlib
+from collections import defaultdict
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 
-from pgvector.django import VectorField
+from pgvector.django import HalfVectorField, VectorField
 
 from llmchat.settings import GS_BUCKET_NAME
 
@@ -19,6 +24,9 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_bot = models.BooleanField(default=False)
     chat = models.ForeignKey("Chat", on_delete=models.CASCADE)
+    # Tokens of message, counted when it's saved (null for messages saved
+    # before counting; see chat.llm_utils.history.fill_token_counts)
+    token_count = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return self.message
@@ -32,16 +40,67 @@ class Chat(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     title = models.CharField(max_length=255, blank=True, default="")
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    # Summary of the messages up to summary_through (a Message id), which are
+    # too old to be sent with prompts (see chat.llm_utils.history)
+    running_summary = models.TextField(blank=True, default="")
+    summary_through = models.IntegerField(default=0)
+    # When a title_chats job last took the chat on (see chat.jobs.untitled_chats)
+    title_attempted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "-timestamp"], name="chat_listing_idx")]
 
     def __str__(self):
         return f"Chat {self.id}: {self.title}"
 
+    @staticmethod
+    def sidebar_chats(user):
+        """
+        The user's chats listed in the sidebar (those with more than one
+        message), newest first, counting messages in the same query
+        """
+        return (
+            Chat.objects.filter(user=user)
+            .annotate(message_count=models.Count("message"))
+            .filter(message_count__gt=1)
+            .order_by("-timestamp")
+        )
+
+    @staticmethod
+    def sidebar_changed(user_id):
+        """
+        Invalidate the user's cached sidebar chat list: call when a chat is
+        added to it (its second message), deleted or retitled
+        """
+        UserSettings.objects.filter(user_id=user_id).update(
+            chat_list_version=models.F("chat_list_version") + 1
+        )
+
 
 def user_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/user_<id>/<filename>
     return "user_{0}/{1}".format(instance.user.username.split('@')[0], filename)
 
 
+# Characters of document text per compressed block: reading a chunk's text
+# only decompresses the blocks it spans, not the whole document
+TEXT_BLOCK_SIZE = 64 * 1024
+
+
+def compress_text(text):
+    """
+    Split text into zlib compressed blocks of TEXT_BLOCK_SIZE characters
+    """
+    return [
+        zlib.compress(text[i : i + TEXT_BLOCK_SIZE].encode("utf-8"))
+        for i in range(0, len(text), TEXT_BLOCK_SIZE)
+    ]
+
+
+def decompress_block(data):
+    return zlib.decompress(data).decode("utf-8")
+
+
 class Document(models.Model):
     """
     Metadata for a document uploaded to GCP storage
@@ -58,15 +117,118 @@ class Document(models.Model):
     mean_embedding = VectorField(dimensions=768, null=True)  # PaLM embedding
     tags = models.ManyToManyField("DocumentTag", related_name="documents")
     chunk_overlap = models.IntegerField(
-        default=200
-    )  # Number of characters to overlap between chunks
-    chunk_size = models.IntegerField(default=2000)  # Number of characters per chunk
-    text = models.TextField(blank=True, default="")
+        default=50
+    )  # Number of tokens to overlap between chunks
+    chunk_size = models.IntegerField(default=500)  # Max number of tokens per chunk
+    # The text itself is stored compressed, in DocumentTextBlocks
+    text_length = models.IntegerField(default=0)
+    # Position in text where each page starts (empty for files without pages)
+    page_offsets = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the documents page, newest first
+            models.Index(
+                fields=["user", "-uploaded_at", "-id"], name="document_listing_idx"
+            )
+        ]
+
+    @property
+    def text(self):
+        """
+        The full text, decompressed on first access
+        """
+        if "_text" not in self.__dict__:
+            self._text = self.read_text()
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        # Written to the text blocks by save() or save_texts()
+        self._text = value
+        self._text_changed = True
+        self.text_length = len(value)
+
+    def read_text(self, start=0, end=None):
+        """
+        text[start:end], decompressing only the blocks in that range
+        """
+        if "_text" in self.__dict__:
+            return self._text[start:end]
+        end = self.text_length if end is None else min(end, self.text_length)
+        if start >= end:
+            return ""
+        first = start // TEXT_BLOCK_SIZE
+        blocks = (
+            self.text_blocks.filter(
+                number__gte=first, number__lte=(end - 1) // TEXT_BLOCK_SIZE
+            )
+            .order_by("number")
+            .values_list("data", flat=True)
+        )
+        text = "".join(decompress_block(data) for data in blocks)
+        offset = first * TEXT_BLOCK_SIZE
+        return text[start - offset : end - offset]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Document.save_texts([self])
+
+    @staticmethod
+    def save_texts(documents):
+        """
+        Write the text blocks of the documents whose text was set, e.g. after
+        bulk_create() or bulk_update(), which don't call save()
+        """
+        changed = [doc for doc in documents if doc.__dict__.get("_text_changed")]
+        if not changed:
+            return
+        with transaction.atomic():
+            DocumentTextBlock.objects.filter(document__in=changed).delete()
+            # Existing chunks' offsets point into the old text: they are kept
+            # (re-indexing reuses those whose content is unchanged) but taken
+            # out of search, which filters on the chunk's user
+            DocumentChunk.objects.filter(document__in=changed).update(user=None)
+            DocumentTextBlock.objects.bulk_create(
+                [
+                    DocumentTextBlock(document=doc, number=number, data=data)
+                    for doc in changed
+                    for number, data in enumerate(compress_text(doc.text))
+                ],
+                batch_size=100,
+            )
+        for doc in changed:
+            doc._text_changed = False
 
     def __str__(self):
         return f"Document {self.id}: {self.original_filename}"
 
 
+class DocumentTextBlock(models.Model):
+    """
+    TEXT_BLOCK_SIZE characters of a document's text, zlib compressed. The text
+    is kept out of the Document row, and chunks refer to it by offsets instead
+    of storing a copy.
+    """
+
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="text_blocks"
+    )
+    number = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["document", "number"], name="unique_document_text_block"
+            )
+        ]
+
+    def __str__(self):
+        return f"DocumentTextBlock {self.number} of document {self.document_id}"
+
+
 class DocumentChunk(models.Model):
     """
     A text chunk of a document, for similarity search
@@ -75,14 +237,125 @@ class DocumentChunk(models.Model):
     document = models.ForeignKey(
         Document, on_delete=models.CASCADE, related_name="chunks"
     )
+    # Denormalized document.user, so per-user search doesn't join Document.
+    # None while the document's text has changed and it isn't re-indexed yet.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     chunk_number = models.IntegerField()
     page_number = models.IntegerField(null=True)  # Some document loaders support this
     embedding = VectorField(dimensions=768, null=True)  # PaLM embedding
-    text = models.TextField(blank=True, default="")
+    # Half precision copy of embedding for the compact first search stage
+    embedding_half = HalfVectorField(dimensions=768, null=True)
+    # Position of the chunk in the document's text, which isn't copied here
+    start = models.IntegerField(default=0)
+    end = models.IntegerField(default=0)
+    text_hash = models.CharField(max_length=64, blank=True, default="")  # sha256
+    # Set from the chunk text when indexing, on Postgres
+    search_vector = SearchVectorField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "document", "chunk_number"], name="chunk_user_idx"
+            )
+        ]
+
+    @property
+    def text(self):
+        if "_text" not in self.__dict__:
+            self._text = self.document.read_text(self.start, self.end)
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+
+    @staticmethod
+    def load_texts(chunks):
+        """
+        Read the text of many chunks (e.g. search results) in one query,
+        decompressing each block they span once
+        """
+        block_numbers = defaultdict(set)  # document id -> block numbers
+        for chunk in chunks:
+            if "_text" not in chunk.__dict__:
+                block_numbers[chunk.document_id].update(chunk.block_numbers())
+        if not block_numbers:
+            return
+        query = models.Q()
+        for document_id, numbers in block_numbers.items():
+            query |= models.Q(document_id=document_id, number__in=numbers)
+        blocks = {
+            (document_id, number): decompress_block(data)
+            for document_id, number, data in DocumentTextBlock.objects.filter(
+                query
+            ).values_list("document_id", "number", "data")
+        }
+        for chunk in chunks:
+            if "_text" not in chunk.__dict__:
+                numbers = chunk.block_numbers()
+                text = "".join(
+                    blocks.get((chunk.document_id, number), "") for number in numbers
+                )
+                offset = numbers.start * TEXT_BLOCK_SIZE
+                chunk._text = text[chunk.start - offset : chunk.end - offset]
+
+    def block_numbers(self):
+        return range(
+            self.start // TEXT_BLOCK_SIZE, (self.end - 1) // TEXT_BLOCK_SIZE + 1
+        )
+
+    def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.document.user_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"DocumentChunk {self.id}: {self.document.file.name} Chunk {self.chunk_number}"
 
+class EmbeddingCache(models.Model):
+    """
+    Embeddings keyed by (embedding model, sha256 of the exact text sent),
+    shared across documents and users so identical text is only embedded once
+    """
+
+    model_name = models.CharField(max_length=255)
+    text_hash = models.CharField(max_length=64)  # sha256 hexdigest
+    embedding = VectorField(dimensions=768)  # PaLM embedding
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_name", "text_hash"], name="unique_embedding_cache_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"EmbeddingCache {self.id}: {self.model_name} {self.text_hash[:12]}"
+
+
+class SummaryCache(models.Model):
+    """
+    LLM summaries keyed by (model, sha256 of the exact prompt sent), so
+    re-summarizing an edited document only summarizes the changed sections
+    """
+
+    model_name = models.CharField(max_length=255)
+    prompt_hash = models.CharField(max_length=64)  # sha256 hexdigest
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_name", "prompt_hash"], name="unique_summary_cache_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"SummaryCache {self.id}: {self.model_name} {self.prompt_hash[:12]}"
+
+
 class DocumentTag(models.Model):
     tag = models.CharField(max_length=255)
     user_generated = models.BooleanField(default=True)
@@ -111,3 +384,63 @@ class UserSettings(models.Model):
     max_output_tokens = models.IntegerField(default=2048)
     temperature = models.FloatField(default=0.1)
     debug = models.BooleanField(default=False)
+    # Version of the cached sidebar chat list (see Chat.sidebar_changed)
+    chat_list_version = models.IntegerField(default=0)
+
+
+class Job(models.Model):
+    """
+    A unit of background work (summarizing, indexing...) stored in the database
+    and executed by the `manage.py run_jobs` worker
+    """
+
+    # Lower numbers run first
+    INTERACTIVE = 0
+    BATCH = 10
+    PRIORITY_CHOICES = [(INTERACTIVE, "Interactive"), (BATCH, "Batch")]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)  # Key into chat.jobs.HANDLERS
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, null=True, related_name="jobs"
+    )
+    args = models.JSONField(default=dict, blank=True)
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=INTERACTIVE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    progress = models.IntegerField(default=0)  # Percent complete
+    progress_message = models.CharField(max_length=255, blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=255, blank=True, default="")
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Last sign of life from the worker running the job (see set_progress)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "priority", "run_after"], name="job_queue_idx"
+            )
+        ]
+
+    @property
+    def is_active(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def __str__(self):
+        return f"Job {self.id}: {self.kind} ({self.status})"
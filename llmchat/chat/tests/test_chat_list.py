@@ -0,0 +1,63 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from chat.models import Chat, Message, UserSettings
+from chat.tests.utils import make_user
+
+
+class ChatListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = make_user()
+        UserSettings.objects.create(user=self.user)
+        self.chat = self.add_chat("First chat")
+        self.client.force_login(self.user)
+
+    def add_chat(self, title):
+        # Chats are listed from their second message
+        chat = Chat.objects.create(user=self.user, title=title)
+        for is_bot in (False, True):
+            Message.objects.create(chat=chat, is_bot=is_bot, message="Hello")
+        return chat
+
+    def page(self, chat=None):
+        chat = chat or self.chat
+        response = self.client.get(reverse("chat", args=[chat.id]))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_list_is_cached_until_its_version_changes(self):
+        self.assertIn("First chat", self.page())
+        self.add_chat("Second chat")
+        with mock.patch.object(Chat, "sidebar_chats") as sidebar_chats:
+            self.assertNotIn("Second chat", self.page())
+        sidebar_chats.assert_not_called()
+
+        Chat.sidebar_changed(self.user.id)
+        self.assertIn("Second chat", self.page())
+
+    def test_deleting_a_chat_changes_the_version(self):
+        second = self.add_chat("Second chat")
+        self.assertIn("Second chat", self.page())
+        response = self.client.delete(reverse("delete_chat", args=[second.id, "False"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Second chat", self.page())
+
+    def test_current_chat_is_marked_on_each_page(self):
+        second = self.add_chat("Second chat")
+        for current, other in [(self.chat, second), (second, self.chat)]:
+            page = self.page(current)
+            self.assertRegex(page, rf'id="chat-{current.id}"\s+class="mb-1 current')
+            self.assertNotRegex(page, rf'id="chat-{other.id}"\s+class="mb-1 current')
+
+    def test_lists_are_per_user(self):
+        self.page()
+        other = make_user("other")
+        UserSettings.objects.create(user=other)
+        other_chat = Chat.objects.create(user=other, title="Other chat")
+        self.client.force_login(other)
+        self.assertNotIn("First chat", self.page(other_chat))
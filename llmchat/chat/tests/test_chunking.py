@@ -0,0 +1,88 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+from chat.llm_utils import chunking
+from chat.llm_utils.chunking import chunk_spans, count_tokens, tokenizer
+from chat.llm_utils.indexing import iter_chunks
+from chat.tests.utils import paragraphs
+
+# A sentence far over any chunk's budget
+LONG_SENTENCE = " ".join(f"w{i % 97}v{i % 13}" for i in range(3000))
+TEXT = paragraphs(400) + "\n" + LONG_SENTENCE + ". Last sentence!"
+
+
+class ChunkingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A small byte level BPE tokenizer, like gpt2's
+        bpe = Tokenizer(models.BPE())
+        bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        bpe.decoder = decoders.ByteLevel()
+        bpe.train_from_iterator(
+            [TEXT],
+            trainers.BpeTrainer(
+                vocab_size=300, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+            ),
+        )
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, "tokenizer.json")
+        bpe.save(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        # tokenizer() loads once per process
+        patcher = mock.patch.object(chunking, "_tokenizer", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spans_are_exact_and_within_budget(self):
+        with override_settings(CHUNK_TOKENIZER=self.path):
+            spans = chunk_spans(TEXT, 100, 10)
+            counts = count_tokens([TEXT[start:end] for start, end in spans])
+        self.assertGreater(len(spans), 10)
+        for (start, end), tokens in zip(spans, counts):
+            chunk = TEXT[start:end]
+            self.assertEqual(chunk, chunk.strip())
+            # Counted in context, a chunk's first word may split differently
+            self.assertLessEqual(tokens, 102)
+        # Whole sentences, except for the long one, which is cut
+        self.assertTrue(TEXT[: spans[0][1]].endswith("sentences."))
+        self.assertTrue(TEXT[spans[0][0] :].startswith("Paragraph 0 "))
+        long_start = TEXT.index(LONG_SENTENCE)
+        long_end = long_start + len(LONG_SENTENCE)
+        self.assertTrue(
+            any(long_start <= start and end <= long_end for start, end in spans)
+        )
+        self.assertTrue(TEXT[: spans[-1][1]].endswith("Last sentence!"))
+        # Consecutive chunks overlap or meet, leaving out only whitespace
+        for (_, end), (next_start, _) in zip(spans, spans[1:]):
+            self.assertEqual(TEXT[end:next_start].strip(), "")
+
+    def test_iter_chunks_offsets(self):
+        with override_settings(CHUNK_TOKENIZER=self.path):
+            chunks = list(iter_chunks(TEXT * 10, 200, 20))
+        self.assertTrue(chunks)
+        for start, end, chunk in chunks:
+            self.assertEqual((TEXT * 10)[start:end], chunk)
+
+    def test_missing_tokenizer_falls_back_to_estimate(self):
+        missing = os.path.join(self.directory.name, "missing.json")
+        with override_settings(CHUNK_TOKENIZER=missing):
+            with self.assertLogs("chat.llm_utils.chunking", "WARNING"):
+                self.assertIsNone(tokenizer())
+            self.assertEqual(count_tokens(["a" * 10]), [3])
+
+    def test_estimate_without_tokenizer(self):
+        with override_settings(CHUNK_TOKENIZER=""):
+            with self.assertLogs("chat.llm_utils.chunking", "WARNING"):
+                self.assertIsNone(tokenizer())
+            self.assertEqual(count_tokens(["a" * 10]), [3])
@@ -0,0 +1,127 @@
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import Document
+from chat.tests.utils import fake_embedding, make_user
+from chat.views import DOCUMENTS_PAGE_SIZE, document_page
+
+
+class DocumentPageTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        now = timezone.now()
+        # Pairs of documents uploaded at the same time, then some without a time
+        Document.objects.bulk_create(
+            [
+                Document(user=self.user, uploaded_at=now - timedelta(minutes=i // 2))
+                for i in range(DOCUMENTS_PAGE_SIZE * 2 + 5)
+            ]
+            + [Document(user=self.user) for _ in range(DOCUMENTS_PAGE_SIZE)]
+        )
+        Document.objects.create(user=make_user("other"), uploaded_at=now)
+
+    def test_pages_cover_every_document_once_in_order(self):
+        seen = []
+        cursor = ""
+        pages = 0
+        while cursor is not None:
+            documents, cursor = document_page(self.user, cursor)
+            self.assertLessEqual(len(documents), DOCUMENTS_PAGE_SIZE)
+            seen += documents
+            pages += 1
+        expected = list(
+            Document.objects.filter(user=self.user, uploaded_at__isnull=False).order_by(
+                "-uploaded_at", "-id"
+            )
+        ) + list(
+            Document.objects.filter(user=self.user, uploaded_at__isnull=True).order_by(
+                "-id"
+            )
+        )
+        self.assertEqual([doc.id for doc in seen], [doc.id for doc in expected])
+        self.assertEqual(pages, 4)
+
+    def test_rows_route(self):
+        self.client.force_login(self.user)
+        _, cursor = document_page(self.user)
+        response = self.client.get(reverse("document_rows"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("document_rows"), {"cursor": "x|1"})
+        self.assertEqual(response.status_code, 400)
+
+
+class DocumentBodyTests(TestCase):
+    def test_indexed_without_loading_vectors(self):
+        user = make_user()
+        self.client.force_login(user)
+        doc = Document.objects.create(user=user, uploaded_at=timezone.now())
+        url = reverse("document_body", args=[doc.id])
+        self.assertContains(self.client.get(url), "Index document")
+
+        Document.objects.filter(id=doc.id).update(mean_embedding=fake_embedding("mean"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, "chunks added to index")
+        document_query = next(
+            query["sql"] for query in queries if 'FROM "chat_document"' in query["sql"]
+        )
+        self.assertNotIn('"chat_document"."mean_embedding",', document_query)
+
+        self.client.force_login(make_user("other"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ReuploadTests(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        settings = override_settings(
+            STORAGES={
+                "default": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": storage.name},
+                },
+                "staticfiles": {
+                    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(make_user())
+
+    def upload(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("documents"),
+                {"file": SimpleUploadedFile("notes.txt", text.encode())},
+            )
+        self.assertEqual(response.status_code, 200)
+        return Document.objects.get()
+
+    def test_old_file_is_deleted_after_the_new_one_is_saved(self):
+        old_name = self.upload("First version.").file.name
+        doc = self.upload("Second version.")
+        self.assertNotEqual(doc.file.name, old_name)
+        self.assertFalse(doc.file.storage.exists(old_name))
+        self.assertTrue(doc.file.storage.exists(doc.file.name))
+        self.assertEqual(doc.read_text(), "Second version.")
+
+    def test_failed_save_keeps_the_old_file(self):
+        doc = self.upload("First version.")
+        with mock.patch.object(
+            Document, "save_texts", side_effect=DatabaseError("Connection lost")
+        ), self.assertRaises(DatabaseError):
+            self.upload("Second version.")
+        doc.refresh_from_db()
+        with doc.file.open("rb") as f:
+            self.assertEqual(f.read(), b"First version.")
+        self.assertEqual(doc.read_text(), "First version.")
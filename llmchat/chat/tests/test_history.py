@@ -0,0 +1,178 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from chat.models import Chat, Message, UserSettings
+from chat.llm_utils import chunking, history
+from chat.llm_utils.history import (
+    fold_history,
+    history_budget,
+    prompt_tokens,
+    recent_history,
+)
+from chat.tests.utils import make_user
+
+
+class HistoryTestCase(TestCase):
+    def setUp(self):
+        self.chat = Chat.objects.create(user=make_user())
+        # No system prompt, so the whole budget is for the history
+        self.settings = UserSettings(model_name="chat-bison", system_prompt="")
+        self.budget = history_budget(self.settings)
+
+    def add_turns(self, *turns):
+        """
+        Add a user message and response per (user tokens, response tokens)
+        """
+        messages = []
+        for user_tokens, bot_tokens in turns:
+            for is_bot, tokens in [(False, user_tokens), (True, bot_tokens)]:
+                messages.append(
+                    Message.objects.create(
+                        chat=self.chat,
+                        is_bot=is_bot,
+                        message=f"Message {len(messages)}",
+                        token_count=tokens,
+                    )
+                )
+        return messages
+
+
+class BudgetTests(HistoryTestCase):
+    def test_budget_keeps_a_margin(self):
+        self.assertEqual(self.budget, int(history.CONTEXT_TOKENS * 0.8))
+        # The 32k models share their context with the response
+        self.settings.model_name = "chat-bison-32k"
+        self.settings.max_output_tokens = 2048
+        self.assertEqual(history_budget(self.settings), int((32768 - 2048) * 0.8))
+
+    def test_system_prompt_counts_against_budget(self):
+        self.settings.system_prompt = "word " * 400
+        self.assertEqual(
+            history_budget(self.settings),
+            self.budget - history.text_tokens(self.settings.system_prompt),
+        )
+
+    def test_uncounted_messages_are_counted_once(self):
+        message = self.add_turns((1, 1))[0]
+        Message.objects.filter(id=message.id).update(token_count=None)
+        message.token_count = None
+        tokens = prompt_tokens(self.settings, [message])
+        self.assertEqual(tokens, history.message_tokens(message.message))
+        message.refresh_from_db()
+        self.assertEqual(message.token_count, tokens)
+
+    def test_tokens_are_estimated_if_the_tokenizer_fails(self):
+        with mock.patch.object(
+            chunking, "tokenizer", side_effect=Exception("Corrupt tokenizer")
+        ), self.assertLogs("chat.llm_utils.history", "ERROR"):
+            self.assertEqual(history.message_tokens("a" * 10), 3)
+
+
+class RecentHistoryTests(HistoryTestCase):
+    def test_short_chat_is_sent_whole(self):
+        messages = self.add_turns((100, 200), (100, 200))
+        recent, fold = recent_history(self.chat, self.settings)
+        self.assertEqual(recent, messages)
+        self.assertFalse(fold)
+
+    def test_only_whole_recent_turns_that_fit(self):
+        messages = self.add_turns(*[(1000, 500)] * 6)
+        recent, fold = recent_history(self.chat, self.settings)
+        # 4 turns and the response of a fifth fit; that response is left out
+        self.assertEqual(recent, messages[-8:])
+        self.assertFalse(recent[0].is_bot)
+        self.assertLessEqual(sum(m.token_count for m in recent), self.budget)
+        self.assertTrue(fold)
+
+    def test_last_message_is_sent_even_over_budget(self):
+        self.add_turns((100, 100))
+        long_message = Message.objects.create(
+            chat=self.chat, message="Long", token_count=self.budget * 2
+        )
+        recent, fold = recent_history(self.chat, self.settings)
+        self.assertEqual(recent, [long_message])
+        self.assertTrue(fold)
+
+    def test_until_id_excludes_later_messages(self):
+        messages = self.add_turns((100, 100), (100, 100))
+        recent, _ = recent_history(self.chat, self.settings, until_id=messages[2].id)
+        self.assertEqual(recent, messages[:2])
+
+    def test_running_summary_counts_against_budget(self):
+        messages = self.add_turns(*[(1000, 500)] * 6)
+        self.chat.running_summary = "word " * 4000
+        recent, _ = recent_history(self.chat, self.settings)
+        self.assertLess(len(recent), 8)
+        self.assertEqual(recent, messages[-len(recent) :])
+        self.assertLessEqual(
+            sum(m.token_count for m in recent)
+            + history.summary_tokens(self.chat.running_summary),
+            self.budget,
+        )
+
+    def test_summarized_messages_are_not_sent(self):
+        messages = self.add_turns((100, 100), (100, 100))
+        self.chat.summary_through = messages[1].id
+        recent, _ = recent_history(self.chat, self.settings)
+        self.assertEqual(recent, messages[2:])
+
+
+class FoldHistoryTests(HistoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prompts = []
+        patcher = mock.patch.object(
+            history.summarizer, "complete", side_effect=self.complete
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def complete(self, prompt):
+        self.prompts.append(prompt)
+        return f"Summary {len(self.prompts)}"
+
+    def test_oldest_whole_turns_are_folded_in_calls_of_fold_tokens(self):
+        messages = self.add_turns(*[(1000, 1000)] * 5)
+        folded = fold_history(self.chat, self.settings)
+        # Down to FOLD_TO of the budget (3276 tokens), in whole turns
+        self.assertEqual(folded, 8)
+        # FOLD_TOKENS (4000) of conversation per call
+        self.assertEqual(len(self.prompts), 2)
+        self.assertIn("Current summary:\n(none)", self.prompts[0])
+        self.assertIn("Human: Message 0", self.prompts[0])
+        self.assertIn("AI: Message 3", self.prompts[0])
+        self.assertIn("Current summary:\nSummary 1", self.prompts[1])
+        self.assertIn("Human: Message 4", self.prompts[1])
+
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.running_summary, "Summary 2")
+        self.assertEqual(self.chat.summary_through, messages[7].id)
+        recent, fold = recent_history(self.chat, self.settings)
+        self.assertEqual(recent, messages[8:])
+        self.assertFalse(fold)
+
+    def test_last_turn_is_never_folded(self):
+        self.add_turns((self.budget, 100))
+        self.assertEqual(fold_history(self.chat, self.settings), 0)
+        self.assertEqual(self.prompts, [])
+
+    def test_history_within_fold_to_is_left_alone(self):
+        self.add_turns((1000, 1000))
+        self.assertEqual(fold_history(self.chat, self.settings), 0)
+        self.assertEqual(self.prompts, [])
+
+    def test_concurrent_fold_wins(self):
+        messages = self.add_turns(*[(1000, 1000)] * 5)
+
+        def complete(prompt):
+            # Another job folds the first turn meanwhile
+            Chat.objects.filter(id=self.chat.id).update(
+                running_summary="Other", summary_through=messages[1].id
+            )
+            return "Summary"
+
+        history.summarizer.complete.side_effect = complete
+        self.assertEqual(fold_history(self.chat, self.settings), 0)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.running_summary, "Other")
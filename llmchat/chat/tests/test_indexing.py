@@ -0,0 +1,163 @@
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from chat.models import Document, DocumentChunk
+from chat.llm_utils.indexing import index_document, iter_sections
+from chat.llm_utils.vector_store import NumpyVectorStore
+from chat.tests.utils import (
+    FakeEmbeddings,
+    FakeVertexClient,
+    fake_embedding,
+    make_user,
+    paragraphs,
+    upload,
+    vertex_embeddings,
+)
+
+
+class IndexingTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.embeddings = FakeEmbeddings()
+        patcher = mock.patch(
+            "chat.llm_utils.indexing.get_gcp_embeddings", return_value=self.embeddings
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.vector_store = NumpyVectorStore(directory.name)
+
+    def index(self, doc):
+        return index_document(doc, progress=None)
+
+    def search(self, k=1000):
+        chunks = self.vector_store.search_chunks(self.user, fake_embedding("query"), k)
+        DocumentChunk.load_texts(chunks)
+        return chunks
+
+
+class ReuploadTests(IndexingTestCase):
+    def test_reuploaded_chunks_leave_search_until_reindexed(self):
+        doc = upload(self.user, "notes.txt", paragraphs(200))
+        self.index(doc)
+        self.assertTrue(self.search())
+
+        doc = upload(self.user, "notes.txt", paragraphs(150, seed="b"))
+        # The old chunks' offsets don't match the new text
+        self.assertEqual(self.search(), [])
+
+        self.index(doc)
+        chunks = self.search()
+        self.assertEqual(
+            len(chunks), DocumentChunk.objects.filter(document=doc).count()
+        )
+        for chunk in chunks:
+            self.assertEqual(chunk.text, doc.read_text(chunk.start, chunk.end))
+            self.assertIn("b is about", chunk.text)
+
+    def test_unchanged_chunks_are_reused_after_reupload(self):
+        text = paragraphs(200)
+        doc = upload(self.user, "notes.txt", text)
+        first = self.index(doc)
+        doc = upload(self.user, "notes.txt", text)
+        stats = self.index(doc)
+        self.assertEqual(stats["embedded"], 0)
+        self.assertEqual(stats["reused"], first["embedded"])
+        self.assertEqual(len(self.search()), first["embedded"])
+
+    def test_identical_content_is_embedded_once_for_all_users(self):
+        client = FakeVertexClient()
+        text = paragraphs(200)
+        with mock.patch(
+            "chat.llm_utils.indexing.get_gcp_embeddings",
+            return_value=vertex_embeddings(client),
+        ):
+            first = self.index(upload(self.user, "notes.txt", text))
+            second = self.index(upload(make_user("other"), "copy.txt", text))
+        self.assertEqual(first["embedded"], second["embedded"])
+        embedded = [text for batch in client.batches for text in batch]
+        self.assertEqual(len(embedded), first["embedded"])
+
+
+class IncrementalIndexTests(IndexingTestCase):
+    def edit(self, text, old, new):
+        self.assertIn(old, text)
+        return text.replace(old, new, 1)
+
+    def assert_chunks_match_text(self, doc):
+        chunks = list(DocumentChunk.objects.filter(document=doc).order_by("start"))
+        self.assertEqual(
+            [chunk.chunk_number for chunk in chunks], list(range(len(chunks)))
+        )
+        DocumentChunk.load_texts(chunks)
+        for chunk in chunks:
+            self.assertEqual(chunk.text, doc.read_text(chunk.start, chunk.end))
+        return chunks
+
+    def test_reindexing_unchanged_text_embeds_nothing(self):
+        doc = upload(self.user, "notes.txt", paragraphs(1000))
+        first = self.index(doc)
+        self.embeddings.embedded.clear()
+        stats = self.index(doc)
+        self.assertEqual(
+            stats, {"reused": first["embedded"], "embedded": 0, "deleted": 0}
+        )
+        self.assertEqual(self.embeddings.embedded, [])
+
+    def test_edit_only_embeds_chunks_of_its_section(self):
+        text = paragraphs(1000)
+        doc = upload(self.user, "notes.txt", text)
+        first = self.index(doc)
+        self.embeddings.embedded.clear()
+
+        edited = self.edit(
+            text, "Paragraph 500 is about", "Paragraph 500 is now mostly about"
+        )
+        doc = upload(self.user, "notes.txt", edited)
+        stats = self.index(doc)
+        self.assertGreater(first["embedded"], 10)
+        self.assertGreaterEqual(stats["embedded"], 1)
+        self.assertLess(stats["embedded"], first["embedded"] / 4)
+        self.assertEqual(stats["deleted"], stats["embedded"])
+        self.assertEqual(stats["reused"] + stats["embedded"], first["embedded"])
+        self.assertTrue(
+            any("is now mostly about" in text for text in self.embeddings.embedded)
+        )
+
+        chunks = self.assert_chunks_match_text(doc)
+        self.assertEqual(len(chunks), first["embedded"])
+        # The mean embedding covers reused and new chunks alike
+        doc = Document.objects.get(id=doc.id)
+        np.testing.assert_allclose(
+            doc.mean_embedding,
+            np.mean([chunk.embedding for chunk in chunks], axis=0),
+            rtol=1e-4,
+            atol=1e-6,
+        )
+
+    def test_sections_after_an_edit_are_unchanged(self):
+        text = paragraphs(1000)
+        edited = self.edit(text, "Paragraph 100 is", "Paragraph 100, edited, is")
+        before = [section for _, section in iter_sections(text)]
+        after = [section for _, section in iter_sections(edited)]
+        self.assertGreater(len(before), 3)
+        changed = [i for i, (a, b) in enumerate(zip(before, after)) if a != b]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(before[changed[0] + 1 :], after[changed[0] + 1 :])
+
+    def test_chunks_left_without_vectors_are_embedded_again(self):
+        doc = upload(self.user, "notes.txt", paragraphs(300))
+        first = self.index(doc)
+        # As if a run was interrupted after inserting, before embedding
+        interrupted = DocumentChunk.objects.filter(document=doc, chunk_number__lt=2)
+        DocumentChunk.objects.filter(id__in=interrupted.values("id")).update(
+            embedding=None
+        )
+        stats = self.index(doc)
+        self.assertEqual(stats["embedded"], 2)
+        self.assertEqual(stats["reused"], first["embedded"] - 2)
+        self.assert_chunks_match_text(doc)
@@ -0,0 +1,209 @@
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chat import jobs
+from chat.llm_utils import ingestion, parsing
+from chat.models import Document, Job
+from chat.tests.utils import make_user
+
+
+def zip_upload(name, members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for member, data in members.items():
+            archive.writestr(member, data)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ParsePathTests(SimpleTestCase):
+    def test_text_is_written_to_a_file_and_read_back(self):
+        text = "Grüße\r\nfrom a text file\n" * 100
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "upload")
+            with open(path, "wb") as f:
+                f.write(text.encode("utf-8"))
+            text_path = os.path.join(directory, "text")
+            # Multi-byte characters split across reads
+            with mock.patch.object(parsing, "READ_CHUNK_SIZE", 3):
+                page_offsets = parsing.parse_path(path, "notes.txt", text_path)
+            self.assertEqual(page_offsets, [])
+            self.assertEqual(parsing.read_parsed_text(text_path), text)
+            self.assertFalse(os.path.exists(text_path))
+
+
+class SpoolFilesTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def spool(self, *uploads):
+        files = ingestion.spool_files(uploads, self.directory)
+        return {f.name: f.error for f in files}
+
+    def test_zip_members_are_spooled_without_dirs_or_hidden_files(self):
+        upload = zip_upload(
+            "docs.zip",
+            {
+                "notes/a.txt": "a",
+                "notes/": "",
+                ".hidden": "h",
+                "__MACOSX/._a.txt": "x",
+                "b.txt": "b",
+            },
+        )
+        files = ingestion.spool_files([upload], self.directory)
+        self.assertEqual([f.name for f in files], ["a.txt", "b.txt"])
+        with open(files[0].path) as f:
+            self.assertEqual(f.read(), "a")
+
+    def test_duplicate_names_are_rejected(self):
+        files = ingestion.spool_files(
+            [
+                SimpleUploadedFile("a.txt", b"1"),
+                zip_upload("docs.zip", {"dir/a.txt": "2", "c.txt": "3"}),
+            ],
+            self.directory,
+        )
+        self.assertEqual(
+            [(f.name, f.error) for f in files],
+            [
+                ("a.txt", ""),
+                ("a.txt", "Another file in the batch has the same name"),
+                ("c.txt", ""),
+            ],
+        )
+
+    def test_invalid_zip(self):
+        errors = self.spool(SimpleUploadedFile("broken.zip", b"not a zip"))
+        self.assertEqual(errors, {"broken.zip": "Invalid zip file"})
+
+    def test_size_limit_uses_declared_size(self):
+        with mock.patch.object(ingestion, "MAX_FILE_SIZE", 10):
+            errors = self.spool(
+                SimpleUploadedFile("small.txt", b"x" * 10),
+                SimpleUploadedFile("large.txt", b"x" * 11),
+                zip_upload("docs.zip", {"member.txt": "x" * 1000}),
+            )
+        self.assertEqual(
+            errors,
+            {
+                "small.txt": "",
+                "large.txt": "File is too large",
+                "member.txt": "File is too large",
+            },
+        )
+
+    def test_file_count_limit(self):
+        with mock.patch.object(ingestion, "MAX_BATCH_FILES", 2):
+            files = ingestion.spool_files(
+                [zip_upload("docs.zip", {f"{i}.txt": "x" for i in range(4)})],
+                self.directory,
+            )
+        self.assertEqual(
+            [f.error for f in files],
+            [
+                "",
+                "",
+                "Batches are limited to 2 files",
+                "Batches are limited to 2 files",
+            ],
+        )
+        self.assertEqual([f.path is None for f in files], [False, False, True, True])
+
+
+class BatchUploadTests(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        settings = override_settings(
+            STORAGES={
+                "default": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": storage.name},
+                },
+                "staticfiles": {
+                    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def post_batch(self, *uploads):
+        return self.client.post(reverse("batch_upload"), {"files": list(uploads)})
+
+    def test_request_only_stages_files_for_a_job(self):
+        response = self.post_batch(
+            SimpleUploadedFile("a.txt", b"Alpha text."),
+            zip_upload("docs.zip", {"b.txt": "Beta text."}),
+            SimpleUploadedFile("broken.zip", b"not a zip"),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Document.objects.exists())
+        job = Job.objects.get(kind="ingest_batch")
+        self.assertEqual(job.user, self.user)
+        self.assertEqual([f["name"] for f in job.args["files"]], ["a.txt", "b.txt"])
+        self.assertEqual(
+            job.args["rejected"], [{"name": "broken.zip", "error": "Invalid zip file"}]
+        )
+        self.assertContains(response, f'id="job-{job.id}"')
+        self.assertContains(response, "Invalid zip file")
+
+    def test_nothing_stored_shows_results_without_a_job(self):
+        response = self.post_batch(SimpleUploadedFile("broken.zip", b"not a zip"))
+        self.assertFalse(Job.objects.exists())
+        self.assertContains(response, "Uploaded 0 of 1 files")
+
+    def test_job_reports_progress_per_file_and_creates_documents(self):
+        self.post_batch(
+            SimpleUploadedFile("a.txt", b"Alpha text."),
+            SimpleUploadedFile("b.txt", b"Beta text."),
+            SimpleUploadedFile("c.pdf", b"not a pdf"),
+        )
+        job = jobs.claim_next("test")
+        messages = []
+        with mock.patch.object(
+            jobs,
+            "set_progress",
+            side_effect=lambda job, progress, message="": messages.append(message),
+        ):
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(messages[1:], [f"Read {i} of 3 files" for i in (1, 2, 3)])
+
+        documents = {d.original_filename: d for d in Document.objects.all()}
+        self.assertEqual(set(documents), {"a.txt", "b.txt"})
+        self.assertEqual(documents["a.txt"].read_text(), "Alpha text.")
+        results = {r["name"]: r for r in job.args["results"]}
+        self.assertEqual(results["a.txt"]["document_id"], documents["a.txt"].id)
+        self.assertTrue(results["c.pdf"]["error"].startswith("Could not read file"))
+        self.assertEqual(
+            Job.objects.filter(kind="summary", priority=Job.BATCH).count(), 2
+        )
+
+        response = self.client.get(reverse("job_status", args=[job.id]))
+        self.assertContains(response, "Uploaded 2 of 3 files")
+        self.assertContains(response, 'hx-swap-oob="afterbegin:#my-documents"')
+
+    def test_retried_job_keeps_its_files(self):
+        self.post_batch(SimpleUploadedFile("a.txt", b"Alpha text."))
+        job = jobs.claim_next("test")
+        jobs.run_job(job)
+        first = Document.objects.get()
+        # As if the job died after saving the documents and is run again
+        jobs.run_job(Job.objects.get(id=job.id))
+        doc = Document.objects.get()
+        self.assertEqual(doc.id, first.id)
+        self.assertTrue(doc.file.storage.exists(doc.file.name))
+        self.assertEqual(doc.read_text(), "Alpha text.")
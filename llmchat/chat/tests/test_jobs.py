@@ -0,0 +1,166 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from chat import jobs
+from chat.models import Chat, Job, Message
+from chat.tests.utils import make_user
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.calls = []
+
+        def ok(job):
+            self.calls.append(job.id)
+
+        def broken(job):
+            self.calls.append(job.id)
+            raise ValueError("broken")
+
+        for kind, func in (("test_ok", ok), ("test_broken", broken)):
+            jobs.HANDLERS[kind] = func
+            self.addCleanup(jobs.HANDLERS.pop, kind)
+
+    def test_claim_order(self):
+        batch = Job.objects.create(kind="test_ok", priority=Job.BATCH)
+        later = Job.objects.create(
+            kind="test_ok", run_after=timezone.now() + timedelta(minutes=5)
+        )
+        first = Job.objects.create(kind="test_ok")
+        second = Job.objects.create(kind="test_ok")
+
+        self.assertEqual(jobs.claim_next("w").id, first.id)
+        self.assertEqual(jobs.claim_next("w").id, second.id)
+        self.assertIsNone(jobs.claim_next("w", max_priority=Job.INTERACTIVE))
+        claimed = jobs.claim_next("w")
+        self.assertEqual(claimed.id, batch.id)
+        self.assertIsNone(jobs.claim_next("w"))  # later isn't due yet
+
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertEqual(claimed.worker, "w")
+        self.assertIsNotNone(claimed.heartbeat_at)
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.PENDING)
+
+    def test_enqueue_reuses_active_job(self):
+        doc = self.user.document_set.create()
+        job = jobs.enqueue("summary", document=doc, priority=Job.BATCH)
+        again = jobs.enqueue("summary", document=doc, priority=Job.INTERACTIVE)
+        self.assertEqual(again.id, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.priority, Job.INTERACTIVE)
+
+    def test_retry_then_fail(self):
+        job = Job.objects.create(kind="test_broken", max_attempts=2)
+        with self.assertLogs("chat.jobs", "ERROR"):
+            jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("ValueError", job.error)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        with self.assertLogs("chat.jobs", "ERROR"):
+            jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.calls, [job.id, job.id])
+
+    def test_run_job_done(self):
+        job = Job.objects.create(kind="test_ok")
+        jobs.run_job(jobs.claim_next("w"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (Job.DONE, 100))
+
+    def test_requeue_stale_by_heartbeat(self):
+        long_ago = timezone.now() - timedelta(hours=2)
+        alive = Job.objects.create(kind="test_ok")
+        dead = Job.objects.create(kind="test_ok")
+        exhausted = Job.objects.create(kind="test_ok", max_attempts=1)
+        for job in (alive, dead, exhausted):
+            jobs.claim_next("w")
+        # All started long ago, but alive has reported progress since
+        Job.objects.update(started_at=long_ago, heartbeat_at=long_ago)
+        jobs.set_progress(alive, 50, "Halfway")
+
+        self.assertEqual(jobs.requeue_stale(timedelta(minutes=30)), (1, 1))
+        statuses = dict(Job.objects.values_list("id", "status"))
+        self.assertEqual(statuses[alive.id], Job.RUNNING)
+        self.assertEqual(statuses[dead.id], Job.PENDING)
+        self.assertEqual(statuses[exhausted.id], Job.FAILED)
+        self.assertEqual(jobs.claim_next("w").id, dead.id)
+
+
+def titles(prompts):
+    # A title for each chat in a title prompt, from its text
+    return ["1. Passport renewal" if "passport" in p else "1. Capital" for p in prompts]
+
+
+class ChatTitleJobTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.chat = self.new_chat("How do I renew a passport?")
+
+    def new_chat(self, question):
+        chat = Chat.objects.create(user=self.user)
+        Message.objects.create(chat=chat, message=question)
+        Message.objects.create(chat=chat, message="Like this.", is_bot=True)
+        return chat
+
+    def run_title_job(self, complete_many):
+        with mock.patch.object(
+            jobs.summarizer, "complete_many", side_effect=complete_many
+        ):
+            jobs.run_job(jobs.claim_next("w"))
+
+    def test_failed_chats_are_not_queued_again(self):
+        job = jobs.enqueue_chat_titles(self.user)
+        self.assertEqual(jobs.enqueue_chat_titles(self.user).id, job.id)
+        with self.assertLogs("chat.jobs", "ERROR"):
+            self.run_title_job(RuntimeError("Vertex AI is down"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)  # To be retried
+
+        # Page loads don't queue the chat again while its job is retried
+        self.assertIsNone(jobs.enqueue_chat_titles(self.user))
+        # but new chats get a job of their own
+        other = self.new_chat("What is the capital of Canada?")
+        new_job = jobs.enqueue_chat_titles(self.user)
+        self.assertNotEqual(new_job.id, job.id)
+
+        # Each job titles the chats it took on
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.run_title_job(titles)
+        self.run_title_job(titles)
+        self.assertEqual(
+            dict(Job.objects.values_list("id", "status")),
+            {job.id: Job.DONE, new_job.id: Job.DONE},
+        )
+        self.chat.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(
+            (self.chat.title, other.title), ("Passport renewal", "Capital")
+        )
+        self.assertIsNone(jobs.enqueue_chat_titles(self.user))
+
+    def test_chats_are_queued_again_after_a_while(self):
+        jobs.enqueue_chat_titles(self.user)
+        with mock.patch.object(jobs.summarizer, "complete_many", side_effect=OSError):
+            for _ in range(3):
+                Job.objects.update(run_after=timezone.now())
+                with self.assertLogs("chat.jobs", "ERROR"):
+                    jobs.run_job(jobs.claim_next("w"))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+        self.assertIsNone(jobs.enqueue_chat_titles(self.user))
+        Chat.objects.update(
+            title_attempted_at=timezone.now() - jobs.TITLE_RETRY_AFTER * 2
+        )
+        self.assertIsNotNone(jobs.enqueue_chat_titles(self.user))
@@ -0,0 +1,146 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from chat import views
+from chat.llm_utils import query_cache
+from chat.llm_utils.query_cache import QueryEmbeddingCache
+from chat.llm_utils.vertex import text_hash
+from chat.tests.utils import fake_embedding, make_user
+
+
+class FakeCachedEmbeddings:
+    """
+    Stands in for CustomVertexAIEmbeddings, with a dict as the EmbeddingCache
+    table
+    """
+
+    def __init__(self):
+        self.table = {}
+        self.embedded = []
+
+    def cache_lookup(self, keys):
+        return {key: self.table[key] for key in keys if key in self.table}
+
+    def cache_store(self, embeddings):
+        self.table.update(embeddings)
+
+    def embed_uncached(self, texts):
+        self.embedded.extend(texts)
+        return [fake_embedding(text) for text in texts]
+
+    async def aembed_uncached(self, texts):
+        return self.embed_uncached(texts)
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.embeddings = FakeCachedEmbeddings()
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            query_cache.time, "monotonic", side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, max_size=3, ttl=60, shared=True):
+        return QueryEmbeddingCache(
+            lambda: self.embeddings, max_size=max_size, ttl=ttl, shared=shared
+        )
+
+    def test_repeated_query_is_embedded_once(self):
+        cache = self.cache()
+        self.assertEqual(cache.get("query"), fake_embedding("query"))
+        self.assertEqual(cache.get("query"), fake_embedding("query"))
+        self.assertEqual(self.embeddings.embedded, ["query"])
+        self.assertEqual(
+            cache.stats(),
+            {
+                "size": 1,
+                "memory_hits": 1,
+                "shared_hits": 0,
+                "misses": 1,
+                "hit_rate": 0.5,
+            },
+        )
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self.cache(max_size=3)
+        for query in ["a", "b", "c"]:
+            cache.get(query)
+        cache.get("a")  # Now "b" is the least recently used
+        cache.get("d")
+        self.assertEqual(list(cache.entries), ["c", "a", "d"])
+        self.embeddings.embedded.clear()
+        cache.shared = False
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(self.embeddings.embedded, ["b"])
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.cache(ttl=60, shared=False)
+        cache.get("query")
+        self.now += 59
+        cache.get("query")
+        self.assertEqual(self.embeddings.embedded, ["query"])
+        # A hit doesn't extend the entry's lifetime
+        self.now += 1
+        cache.get("query")
+        self.assertEqual(self.embeddings.embedded, ["query", "query"])
+
+    def test_shared_tier_serves_other_instances(self):
+        self.embeddings.table[text_hash("query")] = fake_embedding("query")
+        cache = self.cache()
+        self.assertEqual(cache.get("query"), fake_embedding("query"))
+        self.assertEqual(self.embeddings.embedded, [])
+        self.assertEqual(cache.stats()["shared_hits"], 1)
+
+        # An expired memory entry is read from the shared table again
+        self.now += 61
+        cache.get("query")
+        self.assertEqual(self.embeddings.embedded, [])
+        self.assertEqual(cache.stats()["shared_hits"], 2)
+
+    def test_misses_are_stored_in_shared_tier(self):
+        self.cache().get("query")
+        self.assertEqual(
+            self.embeddings.table, {text_hash("query"): fake_embedding("query")}
+        )
+        self.cache(shared=False).get("other")
+        self.assertNotIn(text_hash("other"), self.embeddings.table)
+
+    def test_aget_shares_entries_with_get(self):
+        cache = self.cache()
+        self.assertEqual(async_to_sync(cache.aget)("query"), fake_embedding("query"))
+        self.assertEqual(cache.get("query"), fake_embedding("query"))
+        self.assertEqual(self.embeddings.embedded, ["query"])
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+
+class CacheStatsViewTests(TestCase):
+    def setUp(self):
+        embeddings = mock.Mock(cache_hits=3, cache_misses=1)
+        patcher = mock.patch.object(
+            views, "get_gcp_embeddings", return_value=embeddings
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(reverse("cache_stats")).status_code, 403)
+        user = make_user()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse("cache_stats")).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse("cache_stats"))
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(stats["document_embeddings"], {"hits": 3, "misses": 1})
+        self.assertEqual(
+            set(stats["query_embeddings"]),
+            {"size", "memory_hits", "shared_hits", "misses", "hit_rate"},
+        )
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from chat import views
+from chat.models import UserSettings
+from chat.llm_utils.registry import LLMRegistry
+
+
+class FakeClient:
+    """
+    Stands in for ChatVertexAI / VertexAI: creating one sets up a client,
+    which waits for test.holds[model_name] if there is one; copy() doesn't
+    """
+
+    test = None
+
+    def __init__(self, model_name, **params):
+        self.model_name = model_name
+        self.__dict__.update(params)
+        self.test.created.append(model_name)
+        if model_name in self.test.holds:
+            self.test.holds[model_name].wait(5)
+
+    def copy(self, update):
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__, **update)
+        return copy
+
+
+class LLMRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = LLMRegistry()
+        self.created = []
+        self.holds = {}
+
+        for module, name in [
+            ("langchain.chat_models", "ChatVertexAI"),
+            ("langchain.llms", "VertexAI"),
+        ]:
+            client_class = type(name, (FakeClient,), {"test": self})
+            patcher = mock.patch(f"{module}.{name}", client_class)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_wrappers_are_reused_and_share_a_client_per_model(self):
+        llm = self.registry.llm("chat-bison", 1024, 0.2)
+        self.assertIs(self.registry.llm("chat-bison", 1024, 0.2), llm)
+        other = self.registry.llm("chat-bison", 512, 0.8)
+        self.assertIsNot(other, llm)
+        self.assertEqual((other.max_output_tokens, other.temperature), (512, 0.8))
+        self.registry.llm("text-bison", 1024, 0.2)
+        self.assertEqual(self.created, ["chat-bison", "text-bison"])
+
+    def test_concurrent_requests_create_one_client(self):
+        self.holds["chat-bison"] = threading.Event()
+        with ThreadPoolExecutor(4) as executor:
+            futures = [
+                executor.submit(self.registry.llm, "chat-bison", 1024, 0.2)
+                for _ in range(4)
+            ]
+            self.holds["chat-bison"].set()
+            llms = [future.result() for future in futures]
+        self.assertEqual(self.created, ["chat-bison"])
+        self.assertTrue(all(llm is llms[0] for llm in llms))
+
+    def test_creating_a_client_doesnt_hold_up_other_models(self):
+        self.holds["chat-bison"] = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            slow = executor.submit(self.registry.llm, "chat-bison", 1024, 0.2)
+            while "chat-bison" not in self.created:
+                time.sleep(0.001)
+            # Returns while chat-bison's client is still being created
+            self.registry.llm("text-bison", 1024, 0.2)
+            self.assertFalse(slow.done())
+            self.holds["chat-bison"].set()
+            slow.result()
+        self.assertEqual(self.created, ["chat-bison", "text-bison"])
+
+    def test_qa_chains_are_kept_per_llm(self):
+        llm = self.registry.llm("text-bison", 1024, 0.2)
+        with mock.patch(
+            "langchain.chains.qa_with_sources.load_qa_with_sources_chain"
+        ) as load_chain:
+            chain = self.registry.qa_chain(llm)
+            self.assertIs(self.registry.qa_chain(llm), chain)
+        load_chain.assert_called_once_with(llm, chain_type="stuff")
+
+
+class WarmupTests(TestCase):
+    def setUp(self):
+        for name in ["chat_llm", "get_text_llm", "get_gcp_embeddings", "tokenizer"]:
+            patcher = mock.patch.object(views, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(views.llm_registry, "qa_chain")
+        self.qa_chain = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_creates_every_client_without_a_login(self):
+        models = []
+        self.chat_llm.side_effect = lambda settings: models.append(settings.model_name)
+        response = self.client.get(reverse("warmup"))
+        self.assertEqual(response.status_code, 200)
+        choices = UserSettings._meta.get_field("model_name").choices
+        self.assertEqual(models, [model_name for model_name, _ in choices])
+        self.qa_chain.assert_called_once_with(self.get_text_llm.return_value)
+        self.get_gcp_embeddings.assert_called_once()
+        self.tokenizer.assert_called_once()
+
+    def test_a_failing_model_doesnt_stop_the_rest(self):
+        models = []
+
+        def chat_llm(user_settings):
+            models.append(user_settings.model_name)
+            if len(models) == 1:
+                raise RuntimeError("Model not found")
+
+        self.chat_llm.side_effect = chat_llm
+        with self.assertLogs("chat.views", "ERROR"):
+            response = self.client.get(reverse("warmup"))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(models), 1)
+        self.get_gcp_embeddings.assert_called_once()
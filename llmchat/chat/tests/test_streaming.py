@@ -0,0 +1,131 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chat import views
+from chat.models import Chat, Message, UserSettings
+from chat.llm_utils import chunking, streaming
+from chat.llm_utils.streaming import sse_event, sse_response
+from chat.tests.utils import make_user
+
+
+def parse_events(body):
+    """
+    (event, data) for each event of a text/event-stream body
+    """
+    assert body.endswith("\n\n"), body
+    events = []
+    for frame in body[:-2].split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class SseFramingTests(SimpleTestCase):
+    def test_data_stays_on_one_line(self):
+        text = 'Line one\n\nline "two"\r\n: not a comment'
+        event = sse_event("token", text)
+        self.assertEqual(event.count("\n"), 3)
+        self.assertEqual(parse_events(event), [("token", text)])
+
+    def test_unicode_and_ids(self):
+        self.assertEqual(
+            parse_events(sse_event("token", "Grüße 👋") + sse_event("done", 42)),
+            [("token", "Grüße 👋"), ("done", 42)],
+        )
+
+    async def test_response_streams_unbuffered(self):
+        async def events():
+            yield sse_event("token", "a")
+            yield sse_event("done", 1)
+
+        response = sse_response(events())
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(
+            chunks, [b'event: token\ndata: "a"\n\n', b"event: done\ndata: 1\n\n"]
+        )
+
+
+@override_settings(FAKE_LLM=True)
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        UserSettings.objects.create(user=self.user, model_name="chat-bison")
+        self.chat = Chat.objects.create(user=self.user)
+        Message.objects.create(chat=self.chat, message="Hello", token_count=1)
+        self.async_client.force_login(self.user)
+        patcher = mock.patch.object(streaming, "FAKE_TOKEN_DELAY", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def stream(self):
+        response = await self.async_client.get(
+            reverse("chat_stream", args=[self.chat.id])
+        )
+        self.assertEqual(response.status_code, 200)
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        return parse_events(body.decode("utf-8"))
+
+    async def test_tokens_then_done_with_saved_message(self):
+        events = await self.stream()
+        kinds = [event for event, _ in events]
+        self.assertEqual(kinds[-1], "done")
+        self.assertEqual(set(kinds[:-1]), {"token"})
+        text = "".join(data for event, data in events if event == "token")
+        self.assertIn("> Hello", text)
+        bot_message = await Message.objects.aget(id=events[-1][1])
+        self.assertTrue(bot_message.is_bot)
+        self.assertEqual(bot_message.message, text)
+        self.assertIsNotNone(bot_message.token_count)
+
+    async def test_failed_stream_sends_error_and_saves_nothing(self):
+        async def failing_stream(get_llm, chat_messages):
+            yield "Partial"
+            raise OSError("Connection reset")
+
+        with mock.patch.object(views, "stream_llm", failing_stream):
+            with self.assertLogs("chat.views", "ERROR"):
+                events = await self.stream()
+        self.assertEqual(
+            events,
+            [
+                ("token", "Partial"),
+                ("error", "Something went wrong. Please try again."),
+            ],
+        )
+        self.assertFalse(await Message.objects.filter(is_bot=True).aexists())
+
+    async def test_chat_works_without_tokenizer_file(self):
+        with override_settings(
+            CHUNK_TOKENIZER="/nonexistent/tokenizer.json"
+        ), mock.patch.object(chunking, "_tokenizer", None):
+            with self.assertLogs("chat.llm_utils.chunking", "WARNING"):
+                response = await self.async_client.post(
+                    reverse("chat", args=[self.chat.id]), {"message": "Hi there"}
+                )
+            self.assertEqual(response.status_code, 200)
+            message = await Message.objects.aget(message="Hi there")
+            self.assertEqual(message.token_count, 2)
+            events = await self.stream()
+        self.assertEqual(events[-1][0], "done")
+
+    async def test_fold_is_queued_after_response(self):
+        # As if the history had outgrown the fold threshold
+        original = views.recent_history
+
+        def recent_history(chat, user_settings):
+            messages, _ = original(chat, user_settings)
+            return messages, True
+
+        with mock.patch.object(
+            views, "recent_history", recent_history
+        ), mock.patch.object(views, "enqueue_chat_fold") as enqueue_chat_fold:
+            events = await self.stream()
+        self.assertEqual(events[-1][0], "done")
+        enqueue_chat_fold.assert_called_once()
@@ -0,0 +1,87 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from chat.models import SummaryCache
+from chat.llm_utils import summarization
+from chat.llm_utils.summarization import Summarizer
+from chat.llm_utils.vertex import TokenBucket, text_hash
+from chat.tests.utils import make_user, paragraphs, upload
+
+
+class FakeLLM:
+    """
+    Stands in for the text LLM, recording its prompts. Responses are
+    determined by the prompt, as cached responses are.
+    """
+
+    model_name = "text-bison"
+
+    def __init__(self):
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self.lock:
+            self.prompts.append(prompt)
+        return f"Summary {text_hash(prompt)[:8]}"
+
+    def count(self, prompt):
+        # Prompts made from MAP_PROMPT or REDUCE_PROMPT
+        start = prompt.split("{", 1)[0]
+        return sum(p.startswith(start) for p in self.prompts)
+
+
+class SummarizerTests(TestCase):
+    def setUp(self):
+        self.llm = FakeLLM()
+        self.summarizer = Summarizer(self.llm, TokenBucket(60000, capacity=1000))
+        self.user = make_user()
+        # Small sections and reductions, for several of each
+        for name, value in [("MAP_TOKENS", 200), ("REDUCE_TOKENS", 20)]:
+            patcher = mock.patch.object(summarization, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_every_section_is_summarized_and_reduced_to_one(self):
+        text = paragraphs(300)
+        progress = []
+        summary = self.summarizer.summarize(
+            upload(self.user, "notes.txt", text), progress.append
+        )
+        maps = self.llm.count(summarization.MAP_PROMPT)
+        reduces = self.llm.count(summarization.REDUCE_PROMPT)
+        self.assertGreater(maps, 10)
+        self.assertGreater(reduces, 2)
+        # The last reduction is the summary
+        self.assertEqual(summary, f"Summary {text_hash(self.llm.prompts[-1])[:8]}")
+        for i in (0, 150, 299):
+            self.assertTrue(
+                any(f"Paragraph {i} is" in prompt for prompt in self.llm.prompts)
+            )
+        self.assertIn('document "notes.txt"', self.llm.prompts[0])
+        self.assertEqual(progress, sorted(progress))
+        self.assertLessEqual(progress[-1], 1)
+
+    def test_edit_only_summarizes_its_section_and_the_reductions_above(self):
+        text = paragraphs(300)
+        first = self.summarizer.summarize(upload(self.user, "notes.txt", text))
+        self.assertEqual(SummaryCache.objects.count(), len(set(self.llm.prompts)))
+        self.llm.prompts.clear()
+        edited = text.replace("Paragraph 150 is", "Paragraph 150, edited, is")
+        second = self.summarizer.summarize(upload(self.user, "notes.txt", edited))
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.llm.count(summarization.MAP_PROMPT), 1)
+        # One reduction per level
+        self.assertLessEqual(self.llm.count(summarization.REDUCE_PROMPT), 3)
+
+    def test_groups_shrink_every_level(self):
+        partials = ["word " * 15] * 5
+        groups = self.summarizer.groups(partials)
+        self.assertEqual([len(group) for group in groups], [2, 2, 1])
+        self.assertEqual([p for group in groups for p in group], partials)
+
+    def test_empty_document(self):
+        self.assertEqual(self.summarizer.summarize(upload(self.user, "a.txt", "")), "")
+        self.assertEqual(self.llm.prompts, [])
@@ -0,0 +1,207 @@
+import tempfile
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from chat.models import Document, DocumentChunk
+from chat.llm_utils import vector_store
+from chat.llm_utils.indexing import search_vector
+from chat.llm_utils.vector_store import (
+    NumpyVectorStore,
+    PgVectorStore,
+    ann_search_params,
+    has_few_rows,
+)
+from chat.tests.utils import fake_embedding, make_user
+
+
+class AnnSearchParamsTests(SimpleTestCase):
+    def test_defaults(self):
+        with mock.patch.object(
+            vector_store, "pgvector_version", return_value=(0, 8, 0)
+        ):
+            self.assertEqual(ann_search_params(10), (100, None, "relaxed_order"))
+            self.assertEqual(ann_search_params(200), (200, None, "relaxed_order"))
+            self.assertEqual(ann_search_params(5000)[0], 1000)
+            self.assertEqual(
+                ann_search_params(10, ef_search=64, iterative_scan="strict_order"),
+                (64, None, "strict_order"),
+            )
+
+    def test_no_iterative_scan_before_pgvector_0_8(self):
+        with mock.patch.object(
+            vector_store, "pgvector_version", return_value=(0, 7, 4)
+        ):
+            self.assertEqual(ann_search_params(10), (100, None, None))
+
+
+def unit(vector):
+    vector = np.asarray(vector)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class HybridSearchTestCase(TestCase):
+    """
+    Chunks with chosen texts and embeddings, for a query whose embedding is
+    QUERY_EMBEDDING
+    """
+
+    QUERY_EMBEDDING = unit(fake_embedding("query"))
+
+    def setUp(self):
+        self.user = make_user()
+        self.chunks = {}
+
+    def embedding_at(self, name, distance):
+        # An embedding at this cosine distance from the query's: the query's
+        # plus a unit vector orthogonal to it
+        query = np.asarray(self.QUERY_EMBEDDING)
+        other = np.asarray(fake_embedding(name))
+        other = np.asarray(unit(other - other.dot(query) * query))
+        similarity = 1 - distance
+        return unit(similarity * query + np.sqrt(1 - similarity**2) * other)
+
+    def add_chunk(self, name, text, distance, user=None):
+        user = user or self.user
+        embedding = self.embedding_at(name, distance)
+        document = Document.objects.create(user=user)
+        self.chunks[name] = DocumentChunk.objects.create(
+            document=document,
+            user=user,
+            chunk_number=0,
+            embedding=embedding,
+            embedding_half=embedding,
+            search_vector=search_vector(text),
+        )
+
+    def names(self, chunks):
+        ids = {chunk.id: name for name, chunk in self.chunks.items()}
+        return [ids[chunk.id] for chunk in chunks]
+
+
+class NumpyHybridSearchTests(HybridSearchTestCase):
+    def test_falls_back_to_embedding_search(self):
+        self.add_chunk("near", "General notes about taxes", 0.1)
+        self.add_chunk("keyword", "Form W9 instructions", 0.9)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = NumpyVectorStore(directory.name)
+        self.assertEqual(
+            self.names(
+                store.search_chunks_hybrid(self.user, "W9", self.QUERY_EMBEDDING, 10)
+            ),
+            ["near", "keyword"],
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Full text search needs Postgres")
+class PgHybridSearchTests(HybridSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_chunk("vector", "General notes about taxes", 0.05)
+        self.add_chunk("both", "Form W9 notes", 0.1)
+        self.add_chunk("keyword", "Form W9 instructions", 0.9)
+        self.add_chunk("neither", "Travel expenses", 0.95)
+        self.add_chunk("other user", "Form W9 notes", 0.05, user=make_user("other"))
+
+    def search(self, store, **params):
+        return self.names(
+            store.search_chunks_hybrid(
+                self.user, "W9 form", self.QUERY_EMBEDDING, 10, **params
+            )
+        )
+
+    def test_results_in_both_rankings_come_first(self):
+        for store in [PgVectorStore(), PgVectorStore(compact=True)]:
+            results = self.search(store)
+            self.assertEqual(results[0], "both")
+            self.assertEqual(set(results), {"both", "vector", "keyword", "neither"})
+            self.assertEqual(results[-1], "neither")
+
+    def test_reciprocal_rank_fusion_scores(self):
+        # Vector ranks: vector 1, both 2, keyword 3, neither 4. Lexical ranks
+        # (tied scores, by id): both 1, keyword 2. So both scores
+        # 1/62 + 1/61, keyword 1/63 + 1/62, vector 1/61 and neither 1/64.
+        self.assertEqual(
+            self.search(PgVectorStore()), ["both", "keyword", "vector", "neither"]
+        )
+
+    def test_max_distance_only_limits_the_vector_ranking(self):
+        results = self.search(PgVectorStore(), max_distance=0.5)
+        self.assertEqual(set(results), {"both", "vector", "keyword"})
+
+    def test_k_limits_results(self):
+        self.assertEqual(
+            self.names(
+                PgVectorStore().search_chunks_hybrid(
+                    self.user, "W9 form", self.QUERY_EMBEDDING, 1
+                )
+            ),
+            ["both"],
+        )
+
+    def test_vectors_are_not_loaded(self):
+        chunk = PgVectorStore().search_chunks_hybrid(
+            self.user, "W9 form", self.QUERY_EMBEDDING, 1
+        )[0]
+        self.assertEqual(
+            chunk.get_deferred_fields(),
+            {"embedding", "embedding_half", "search_vector"},
+        )
+        self.assertEqual(chunk.document.user, self.user)
+
+
+class ExactSearchTests(TestCase):
+    def test_has_few_rows_counts_up_to_the_threshold(self):
+        user = make_user()
+        document = Document.objects.create(user=user)
+        DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=document, user=user, chunk_number=i)
+            for i in range(3)
+        )
+        chunks = DocumentChunk.objects.filter(user=user)
+        with mock.patch.object(vector_store, "EXACT_SEARCH_THRESHOLD", 3):
+            self.assertTrue(has_few_rows(chunks))
+        with mock.patch.object(vector_store, "EXACT_SEARCH_THRESHOLD", 2):
+            self.assertFalse(has_few_rows(chunks))
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs pgvector")
+class PgSmallUserRecallTests(HybridSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        # Another user owns most chunks, all closer to the query than ours
+        other = make_user("other")
+        document = Document.objects.create(user=other)
+        embeddings = [self.embedding_at(f"other {i}", 0.1) for i in range(2000)]
+        DocumentChunk.objects.bulk_create(
+            [
+                DocumentChunk(
+                    document=document,
+                    user=other,
+                    chunk_number=i,
+                    embedding=embedding,
+                    embedding_half=embedding,
+                )
+                for i, embedding in enumerate(embeddings)
+            ],
+            batch_size=500,
+        )
+        for i in range(10):
+            self.add_chunk(f"own {i}", f"Notes {i}", 0.3 + i / 100)
+
+    def test_top_k_is_complete(self):
+        expected = [f"own {i}" for i in range(10)]
+        # Without an iterative scan, as with pgvector < 0.8
+        with mock.patch.object(
+            vector_store, "pgvector_version", return_value=(0, 7, 4)
+        ):
+            for store in [PgVectorStore(), PgVectorStore(compact=True)]:
+                chunks = store.search_chunks(self.user, self.QUERY_EMBEDDING, 10)
+                self.assertEqual(self.names(chunks), expected)
+                chunks = store.search_chunks_hybrid(
+                    self.user, "nothing", self.QUERY_EMBEDDING, 10
+                )
+                self.assertEqual(self.names(chunks), expected)
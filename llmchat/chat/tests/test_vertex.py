@@ -0,0 +1,168 @@
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+from google.api_core import exceptions as google_exceptions
+from langchain.chains.qa_with_sources import load_qa_with_sources_chain
+from langchain.docstore.document import Document as LcDocument
+from langchain.llms.fake import FakeListLLM
+
+from chat.llm_utils import embeddings, vertex
+from chat.llm_utils.vertex import TokenBucket, qa_prompt
+from chat.tests.utils import FakeVertexClient, fake_embedding, vertex_embeddings
+
+
+class PromptRecordingLLM(FakeListLLM):
+    prompts: list = []
+
+    def _call(self, prompt, *args, **kwargs):
+        self.prompts.append(prompt)
+        return super()._call(prompt, *args, **kwargs)
+
+
+class QAPromptTests(SimpleTestCase):
+    def test_same_prompt_as_the_chain(self):
+        llm = PromptRecordingLLM(responses=["An answer"], prompts=[])
+        chain = load_qa_with_sources_chain(llm, chain_type="stuff")
+        documents = [
+            LcDocument(page_content=f"Text {i}", metadata={"source": f"doc{i}.pdf"})
+            for i in range(3)
+        ]
+        chain({"input_documents": documents, "question": "Why?"})
+        self.assertEqual(llm.prompts, [qa_prompt(chain, "Why?", documents)])
+        self.assertIn("Source: doc2.pdf", llm.prompts[0])
+
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.client = FakeVertexClient()
+        self.embeddings = vertex_embeddings(self.client)
+
+    def test_only_misses_are_embedded_once_each(self):
+        texts = ["a", "b", "b", "a"]
+        self.embeddings.embed_documents(["a"])
+        self.assertEqual(
+            self.embeddings.embed_documents(texts),
+            [fake_embedding(text) for text in texts],
+        )
+        self.assertEqual(self.client.batches, [["a"], ["b"]])
+        # Hits are the texts found in the cache, not every text but the misses
+        self.assertEqual(self.embeddings.cache_hits, 2)
+        self.assertEqual(self.embeddings.cache_misses, 2)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            vertex.time, "monotonic", side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refills_at_the_quota_rate_up_to_capacity(self):
+        bucket = TokenBucket(60, capacity=2)
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertEqual(bucket.take(), 1.0)
+        self.now += 0.5
+        self.assertEqual(bucket.take(), 0.5)
+        self.now += 0.5
+        self.assertEqual(bucket.take(), 0)
+        # A long pause only refills the bucket to capacity
+        self.now += 60
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertEqual(bucket.take(), 1.0)
+
+
+class FailingVertexClient(FakeVertexClient):
+    """
+    Raises the given errors from its first calls
+    """
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def get_embeddings(self, texts):
+        if self.errors:
+            self.batches.append(list(texts))
+            raise self.errors.pop(0)
+        return super().get_embeddings(texts)
+
+
+class EmbedBatchTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(embeddings.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retryable_error_is_retried_with_backoff(self):
+        client = FailingVertexClient(
+            google_exceptions.ServiceUnavailable("Unavailable"),
+            google_exceptions.ResourceExhausted("Quota"),
+        )
+        with self.assertLogs("chat.llm_utils.embeddings", "WARNING"):
+            result = vertex_embeddings(client)._embed_batch(["a", "b"])
+        self.assertEqual(result, [fake_embedding("a"), fake_embedding("b")])
+        self.assertEqual(len(client.batches), 3)
+        self.assertEqual([c.args for c in self.sleep.call_args_list], [(1,), (2,)])
+
+    def test_other_errors_are_raised_at_once(self):
+        client = FailingVertexClient(google_exceptions.InvalidArgument("Too long"))
+        with self.assertRaises(google_exceptions.InvalidArgument):
+            vertex_embeddings(client)._embed_batch(["a"])
+        self.assertEqual(len(client.batches), 1)
+        self.sleep.assert_not_called()
+
+    def test_retries_are_limited(self):
+        client = FailingVertexClient(
+            *[google_exceptions.ServiceUnavailable("Unavailable")] * 3
+        )
+        with self.assertLogs("chat.llm_utils.embeddings", "WARNING"):
+            with self.assertRaises(google_exceptions.ServiceUnavailable):
+                vertex_embeddings(client, max_retries_per_batch=2)._embed_batch(["a"])
+        self.assertEqual(len(client.batches), 3)
+
+
+class OutOfOrderVertexClient(FakeVertexClient):
+    """
+    Holds the first batch until the last one is done, so batches finish out
+    of order
+    """
+
+    def __init__(self, first, last):
+        super().__init__()
+        self.first = first
+        self.last = last
+        self.last_done = threading.Event()
+
+    def get_embeddings(self, texts):
+        if texts[0] == self.first:
+            self.last_done.wait(5)
+        result = super().get_embeddings(texts)
+        if texts[-1] == self.last:
+            self.last_done.set()
+        return result
+
+
+class EmbedUncachedTests(SimpleTestCase):
+    texts = [f"text {i}" for i in range(11)]
+
+    def test_results_keep_input_order_across_threads(self):
+        client = OutOfOrderVertexClient(self.texts[0], self.texts[-1])
+        result = vertex_embeddings(client, num_instances_per_batch=2).embed_uncached(
+            self.texts
+        )
+        self.assertEqual(result, [fake_embedding(text) for text in self.texts])
+        self.assertEqual(len(client.batches), 6)
+        # The first batch was held until the last had finished
+        self.assertEqual(client.batches[-1], self.texts[:2])
+
+    def test_async_results_keep_input_order(self):
+        client = FakeVertexClient()
+        result = async_to_sync(
+            vertex_embeddings(client, num_instances_per_batch=2).aembed_uncached
+        )(self.texts)
+        self.assertEqual(result, [fake_embedding(text) for text in self.texts])
+        self.assertEqual(len(client.batches), 6)
@@ -0,0 +1,87 @@
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+from django.contrib.auth.models import User
+
+from chat.models import Document
+from chat.llm_utils.ingestion import fill_document
+from chat.llm_utils.vertex import TokenBucket
+
+
+def fake_embedding(text):
+    # Deterministic stand-in for a PaLM embedding of text
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    return rng.standard_normal(768).tolist()
+
+
+class FakeEmbeddings:
+    """
+    Stands in for the Vertex AI embeddings client, counting the texts embedded
+    """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [fake_embedding(text) for text in texts]
+
+    def embed_query(self, text):
+        return fake_embedding(text)
+
+
+class FakeVertexClient:
+    """
+    Stands in for the Vertex AI embedding model, recording each batch
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def get_embeddings(self, texts):
+        self.batches.append(list(texts))
+        return [SimpleNamespace(values=fake_embedding(text)) for text in texts]
+
+    async def get_embeddings_async(self, texts):
+        return self.get_embeddings(texts)
+
+
+def vertex_embeddings(client, **fields):
+    """
+    A CustomVertexAIEmbeddings calling client, created without looking the
+    model up
+    """
+    from chat.llm_utils.embeddings import CustomVertexAIEmbeddings
+
+    fields = {
+        "requests_per_minute": 60000,
+        "num_instances_per_batch": 5,
+        "rate_limiter": TokenBucket(60000, capacity=1000),
+        "client": client,
+        **fields,
+    }
+    return CustomVertexAIEmbeddings.construct(**fields)
+
+
+def make_user(username="user"):
+    return User.objects.create_user(username, f"{username}@example.com")
+
+
+def upload(user, filename, text, page_offsets=None):
+    """
+    Save text as the user's document named filename, as DocumentsView.post
+    does: a new document, or the existing one with that name re-uploaded
+    """
+    doc = Document.objects.filter(user=user, original_filename=filename).first()
+    doc = doc or Document(user=user)
+    fill_document(doc, filename, filename, text, page_offsets or [], None)
+    doc.save()
+    return doc
+
+
+def paragraphs(count, seed=""):
+    return "\n".join(
+        f"Paragraph {i}{seed} is about topic {i * 7 % 13}. It has two sentences."
+        for i in range(count)
+    )
@@ -8,6 +8,8 @@ urlpatterns = [
     path("logout/", views.logout_view, name="logout"),
     path("chat/<int:chat_id>", views.ChatView.as_view(), name="chat"),
     path("chat/chat_response/<int:chat_id>", views.chat_response, name="chat_response"),
+    path("chat/stream/<int:chat_id>", views.chat_stream, name="chat_stream"),
+    path("chat/titles", views.chat_titles, name="chat_titles"),
     path(
         "chat/delete/<int:chat_id>/<str:current_chat>",
         views.delete_chat,
@@ -15,11 +17,16 @@ urlpatterns = [
     ),
     path("documents/", views.DocumentsView.as_view(), name="documents"),
     path("documents/<int:doc_id>", views.DocumentsView.as_view(), name="document"),
+    path("documents/batch", views.BatchUploadView.as_view(), name="batch_upload"),
+    path("documents/rows", views.document_rows, name="document_rows"),
+    path("documents/<int:doc_id>/body", views.document_body, name="document_body"),
     path("summary/<int:doc_id>", views.summary, name="summary"),
     path("full_text/<int:doc_id>", views.full_text, name="full_text"),
     path("embeddings/<int:doc_id>", views.generate_embeddings, name="embeddings"),
+    path("jobs/<int:job_id>", views.job_status, name="job_status"),
     path("query_embeddings", views.query_embeddings, name="query_embeddings"),
     path("qa_embeddings", views.qa_embeddings, name="qa_embeddings"),
     path("chat_settings", views.chat_settings, name="chat_settings"),
+    path("cache_stats", views.cache_stats, name="cache_stats"),
     path("_ah/warmup", views.warmup, name="warmup"),
 ]
@@ -1,121 +1,249 @@
 from django.shortcuts import render, redirect
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import logout
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import default_storage
-
-from chat.forms import MessageForm, UploadForm, QueryForm, QAForm, SettingsForm
-from chat.models import Message, User, Chat, DocumentChunk, Document, UserSettings
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from asgiref.sync import sync_to_async
+
+from chat.forms import (
+    MessageForm,
+    UploadForm,
+    BatchUploadForm,
+    QueryForm,
+    QAForm,
+    SettingsForm,
+)
+from chat.models import (
+    Message,
+    Chat,
+    Document,
+    UserSettings,
+    Job,
+)
+from chat.jobs import (
+    enqueue,
+    enqueue_chat_fold,
+    enqueue_chat_titles,
+)
+from chat.llm_utils.chunking import tokenizer
+from chat.llm_utils.history import (
+    SUMMARY_PROMPT,
+    max_output_tokens,
+    message_tokens,
+    prompt_tokens,
+    recent_history,
+)
+from chat.llm_utils.ingestion import fill_document, stage_batch
+from chat.llm_utils.parsing import extract_text
+from chat.llm_utils.query_cache import query_embedding_cache
+from chat.llm_utils.registry import llm_registry
+from chat.llm_utils.streaming import sse_event, sse_response, stream_llm
 from chat.llm_utils.vertex import (
-    gcp_embeddings,
-    get_docs_chunks_by_embedding,
-    get_qa_response,
-    text_llm,
-    summarize_chain,
-    CHUNK_SIZE,
-    CHUNK_OVERLAP,
-    text_splitter,
+    aget_docs_chunks_by_embedding,
+    aget_qa_response,
+    get_gcp_embeddings,
+    get_text_llm,
+    qa_documents,
 )
 
-from langchain.schema import HumanMessage, SystemMessage, AIMessage
-from langchain.docstore.document import Document as LcDocument
-from langchain.chat_models import ChatVertexAI
-from langchain.llms import VertexAI
-from langchain.document_loaders import TextLoader, PyPDFLoader
+import logging
+from datetime import datetime
+from functools import partial
+from tempfile import TemporaryDirectory
+
+log = logging.getLogger(__name__)
 
-from tempfile import NamedTemporaryFile
-import os
-import numpy as np
+# Seconds a rendered sidebar chat list stays cached. Entries are keyed by the
+# user's chat list version, so this only bounds how long stale ones linger.
+CHAT_LIST_CACHE_TTL = 60 * 60
 
 
 class IndexView(LoginRequiredMixin, TemplateView):
     template_name = "index.jinja"
 
 
-def chat_response(request, chat_id):
-    messages = (
-        Message.objects.filter(chat_id=chat_id)
-        .order_by("timestamp")
-        .prefetch_related("chat")
+def chat_prompt(user_settings, messages, summary=""):
+    """
+    The messages of a chat as input for the user's model: a list of
+    langchain messages for chat models (with summary, the chat's running
+    summary, in the system prompt), or the first message as a prompt
+    """
+    if "chat" not in user_settings.model_name:
+        # Only one prompt for non-chat models
+        return messages[0].message
+    # Imported here as langchain takes seconds to import
+    from langchain.schema import HumanMessage, SystemMessage, AIMessage
+
+    system_prompt = user_settings.system_prompt
+    if system_prompt is None:
+        system_prompt = settings.CHAT_SYSTEM_PROMPT
+    if summary:
+        system_prompt += SUMMARY_PROMPT.format(summary=summary)
+    chat_messages = [
+        SystemMessage(
+            content=system_prompt,
+        )
+    ]
+    for i, message in enumerate(messages):
+        if message.is_bot:
+            chat_messages.append(AIMessage(content=message.message))
+        elif i > 0 and not messages[i - 1].is_bot:
+            chat_messages[-1].content += "\n" + message.message
+        else:
+            chat_messages.append(HumanMessage(content=message.message))
+    return chat_messages
+
+
+def chat_llm(user_settings):
+    # Shared by every request with the same model settings
+    return llm_registry.llm(
+        user_settings.model_name,
+        max_output_tokens=max_output_tokens(user_settings),
+        temperature=user_settings.temperature,
     )
-    user_settings = request.user.settings
+
+
+async def request_user(request):
+    # request.user is loaded from the database on first access, which async
+    # code can't do directly (there's no request.auser() before Django 5)
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def chat_stream(request, chat_id):
+    # SSE route: streams the LLM's response as "token" events, then saves it
+    # and sends a "done" event with the id of the new Message.
+    # Async, so a response being generated doesn't hold a worker thread.
+    user = await request_user(request)
+    chat = await Chat.objects.aget(id=chat_id)
+    if not chat.user_id == user.id:
+        return HttpResponse(status=403)
+    user_settings = await UserSettings.objects.aget(user=user)
     is_chat_model = "chat" in user_settings.model_name
     if is_chat_model:
-        system_prompt = user_settings.system_prompt
-        if system_prompt is None:
-            system_prompt = settings.CHAT_SYSTEM_PROMPT
-        chat_messages = [
-            SystemMessage(
-                content=system_prompt,
-            )
-        ]
-        for i, message in enumerate(messages):
-            if message.is_bot:
-                chat_messages.append(AIMessage(content=message.message))
-            elif i > 0 and not messages[i - 1].is_bot:
-                chat_messages[-1].content += "\n" + message.message
-            else:
-                chat_messages.append(HumanMessage(content=message.message))
+        # The recent turns that fit the model, after the running summary
+        messages, fold = await sync_to_async(recent_history)(chat, user_settings)
     else:
-        # Only one prompt for non-chat models
-        chat_messages = messages.first().message
-    if not is_chat_model and len(messages) > 2:
-        bot_message = Message.objects.create(
-            message="Non-chat models only support one prompt. Please start a new chat or switch to a chat model.",
-            chat_id=chat_id,
-            is_bot=True,
-        )
-    else:
-        is_code_model = "code" in user_settings.model_name
-        llm_class = ChatVertexAI if is_chat_model else VertexAI
-        max_tokens = 2048 if is_code_model else 1024
-        if "32k" in user_settings.model_name:
-            max_tokens = 8192  # Not sure why this is imposed, but it is
-        max_tokens = min(max_tokens, user_settings.max_output_tokens)
-        llm = llm_class(
-            model_name=user_settings.model_name,
-            max_output_tokens=max_tokens,
-            temperature=user_settings.temperature,
-        )
-        num_tokens = None
-        if user_settings.debug:
-            if is_chat_model:
-                num_tokens = llm.get_num_tokens_from_messages(chat_messages)
-            else:
-                num_tokens = llm.get_num_tokens(chat_messages)
-        llm_response = llm(chat_messages)
-        bot_message = Message.objects.create(
-            message=llm_response.content if is_chat_model else llm_response,
+        messages = [
+            message
+            async for message in Message.objects.filter(chat_id=chat_id).order_by(
+                "timestamp"
+            )[:3]
+        ]
+        fold = False
+
+    async def events():
+        if not is_chat_model and len(messages) > 2:
+            text = "Non-chat models only support one prompt. Please start a new chat or switch to a chat model."
+            bot_message = await Message.objects.acreate(
+                message=text,
+                chat_id=chat_id,
+                is_bot=True,
+                token_count=await sync_to_async(message_tokens)(text),
+            )
+            yield sse_event("done", bot_message.id)
+            return
+        response = []
+        try:
+            async for text in stream_llm(
+                partial(chat_llm, user_settings),
+                chat_prompt(user_settings, messages, chat.running_summary),
+            ):
+                response.append(text)
+                yield sse_event("token", text)
+        except Exception:
+            log.exception(f"Streaming a response to chat {chat_id} failed")
+            yield sse_event("error", "Something went wrong. Please try again.")
+            return
+        # Only a complete response is saved
+        text = "".join(response)
+        bot_message = await Message.objects.acreate(
+            message=text,
             chat_id=chat_id,
             is_bot=True,
+            token_count=await sync_to_async(message_tokens)(text),
         )
-    chat = Chat.objects.get(id=chat_id)
+        if fold:
+            await sync_to_async(enqueue_chat_fold)(chat)
+        yield sse_event("done", bot_message.id)
+
+    return sse_response(events())
+
+
+async def chat_response(request, chat_id):
+    # HTMX route for when chat_stream is done: renders the saved response
+    # (?message=<id>) and adds the chat to the sidebar if it's ready for a title
+    user = await request_user(request)
+    chat = await Chat.objects.aget(id=chat_id)
+    if not chat.user_id == user.id:
+        return HttpResponse(status=403)
+    bot_message = await Message.objects.aget(
+        id=request.GET.get("message"), chat=chat, is_bot=True
+    )
+    user_settings = await UserSettings.objects.aget(user=user)
+    is_chat_model = "chat" in user_settings.model_name
     add_chat_title = False
-    # Title the chat and add it to the sidebar if there's sufficient context to do so
-    if chat.title == "" and (
-        len(messages) > 2
-        or not is_chat_model
-        or len(" ".join([m.content for m in chat_messages])) > 300
-    ):
-        add_chat_title = True
-        chat.title = summarize_chat(chat_id)
-        chat.save()
+    # Add the chat to the sidebar if there's sufficient context to title it.
+    # The title is generated in the background; the sidebar polls for it.
+    if chat.title == "":
+        # This may be the chat's second message, which adds it to the sidebar
+        await sync_to_async(Chat.sidebar_changed)(user.id)
+        # Enough to tell: more than two messages, or two long enough
+        messages = [
+            message
+            async for message in Message.objects.filter(
+                chat=chat, id__lt=bot_message.id
+            ).order_by("timestamp")[:3]
+        ]
+        chat_messages = chat_prompt(user_settings, messages)
+        if (
+            len(messages) > 2
+            or not is_chat_model
+            or len(" ".join([m.content for m in chat_messages])) > 300
+        ):
+            add_chat_title = True
+            await sync_to_async(enqueue_chat_titles)(user)
 
     context = {
         "message": bot_message,
         "add_chat_title": add_chat_title,
         "chat": chat,
     }
+    if add_chat_title:
+        context["untitled_chat_ids"] = [
+            chat_id
+            async for chat_id in Chat.sidebar_chats(user)
+            .filter(title="")
+            .values_list("id", flat=True)
+        ]
 
     if user_settings.debug:
+        # Tokens of the prompt as it was sent, from the messages' counts
+        if is_chat_model:
+            messages, _ = await sync_to_async(recent_history)(
+                chat, user_settings, bot_message.id
+            )
+        else:
+            messages = [
+                message
+                async for message in Message.objects.filter(chat=chat).order_by(
+                    "timestamp"
+                )[:1]
+            ]
         context.update(
             {
-                "num_tokens": num_tokens,
+                "num_tokens": await sync_to_async(prompt_tokens)(
+                    user_settings, messages, chat.running_summary
+                ),
                 "debug": True,
             }
         )
@@ -142,20 +270,14 @@ class ChatView(LoginRequiredMixin, TemplateView):
             user_settings.system_prompt = settings.CHAT_SYSTEM_PROMPT
         context["settings_form"] = SettingsForm(instance=user_settings)
         context["default_system_prompt"] = settings.CHAT_SYSTEM_PROMPT
-        # Get non-empty chats for user
-        user_chats = (
-            Chat.objects.filter(user=self.request.user)
-            .order_by("-timestamp")
-            .prefetch_related("message_set")
-        )
-        user_chats = [chat for chat in user_chats if chat.message_set.count() > 1]
         context["chat"] = Chat.objects.get(id=kwargs["chat_id"])
-        # Summarize chats into chat.title if not already set
-        for chat in user_chats:
-            if chat.title == "":
-                chat.title = summarize_chat(chat.id)
-                chat.save()
-        context["user_chats"] = user_chats
+        context["chat_list"], context["untitled_chat_ids"] = chat_list(
+            self.request, user_settings, kwargs["chat_id"]
+        )
+        # Untitled chats are titled in the background; the sidebar polls for
+        # them. Chats a job has taken on (or failed on) recently are skipped.
+        if context["untitled_chat_ids"]:
+            enqueue_chat_titles(self.request.user)
         return context
 
     # Validate that request.user is Chat.user
@@ -172,6 +294,7 @@ class ChatView(LoginRequiredMixin, TemplateView):
             user_message = Message.objects.create(
                 message=form.cleaned_data["message"],
                 chat_id=kwargs["chat_id"],
+                token_count=message_tokens(form.cleaned_data["message"]),
             )
             return render(
                 request,
@@ -188,6 +311,32 @@ class ChatView(LoginRequiredMixin, TemplateView):
     template_name = "chat.jinja"
 
 
+def chat_list(request, user_settings, chat_id):
+    """
+    The rendered sidebar items of request.user's chats, with chat_id as the
+    current chat, and the ids of the chats among them still untitled.
+    Cached per user and version of their chat list, so once cached a page
+    load doesn't query the chats at all.
+    """
+    key = f"chat_list:{request.user.id}:{user_settings.chat_list_version}"
+    entry = cache.get(key)
+    if entry is None:
+        chats = Chat.sidebar_chats(request.user).values("id", "title")
+        entry = {"chats": list(chats), "html": {}}
+    # Pages of chats that aren't listed (e.g. new chats) share one rendering
+    if not any(chat["id"] == chat_id for chat in entry["chats"]):
+        chat_id = None
+    if chat_id not in entry["html"]:
+        entry["html"][chat_id] = render_to_string(
+            "fragments/chat_list.jinja",
+            {"user_chats": entry["chats"], "chat_id": chat_id, "titling": True},
+            request,
+        )
+        cache.set(key, entry, CHAT_LIST_CACHE_TTL)
+    untitled_chat_ids = [chat["id"] for chat in entry["chats"] if not chat["title"]]
+    return entry["html"][chat_id], untitled_chat_ids
+
+
 class NewChatView(ChatView):
     """
     Creates a new chat on GET and renders the chat template
@@ -206,9 +355,42 @@ def logout_view(request):
 
 
 def warmup(request):
+    # App Engine sends this to new instances before any user request: import
+    # langchain and create the clients a first chat turn, search or QA
+    # question would otherwise wait for
+    default_settings = UserSettings()
+    for model_name, _ in UserSettings._meta.get_field("model_name").choices:
+        default_settings.model_name = model_name
+        try:
+            chat_llm(default_settings)
+        except Exception:
+            log.exception(f"Warmup: can't create client for {model_name}")
+    try:
+        llm_registry.qa_chain(get_text_llm())
+        get_gcp_embeddings()
+        # For counting the tokens of messages
+        tokenizer()
+    except Exception:
+        log.exception("Warmup: can't create the QA chain or embeddings client")
     return HttpResponse(status=200)
 
 
+def cache_stats(request):
+    # Embedding cache hit rates for this instance (staff only)
+    if not request.user.is_staff:
+        return HttpResponse(status=403)
+    gcp_embeddings = get_gcp_embeddings()
+    return JsonResponse(
+        {
+            "query_embeddings": query_embedding_cache.stats(),
+            "document_embeddings": {
+                "hits": gcp_embeddings.cache_hits,
+                "misses": gcp_embeddings.cache_misses,
+            },
+        }
+    )
+
+
 def chat_settings(request):
     # Update user settings
     if request.method == "POST":
@@ -220,7 +402,16 @@ def chat_settings(request):
             user_settings.max_output_tokens = form.cleaned_data["max_output_tokens"]
             user_settings.temperature = form.cleaned_data["temperature"]
             user_settings.debug = form.cleaned_data["debug"]
-            user_settings.save()
+            # Not chat_list_version, which may have changed since it was read
+            user_settings.save(
+                update_fields=[
+                    "system_prompt",
+                    "model_name",
+                    "max_output_tokens",
+                    "temperature",
+                    "debug",
+                ]
+            )
             response = HttpResponse(status=200)
             # Add message to response to be displayed by HTMX
             response["HX-Trigger"] = "settings-updated"
@@ -235,6 +426,7 @@ def delete_chat(request, chat_id, current_chat=None):
         return HttpResponse(status=403)
 
     chat.delete()
+    Chat.sidebar_changed(request.user.id)
     # Is this the currently open chat? If so, redirect away
     if current_chat == "True":
         response = HttpResponse()
@@ -243,19 +435,79 @@ def delete_chat(request, chat_id, current_chat=None):
     return HttpResponse(status=200)
 
 
-def summarize_chat(chat_id):
-    chat_text = "\n".join(
-        [message.message for message in Message.objects.filter(chat_id=chat_id)[:5]]
+def chat_titles(request):
+    # HTMX polling route for the sidebar: swaps in the titles of the chats
+    # (?chat=<id>&chat=...) that have been titled since, and polls again for
+    # the rest while a title_chats job is queued or running
+    try:
+        chat_ids = [int(chat_id) for chat_id in request.GET.getlist("chat")]
+        current_chat_id = int(request.GET.get("current", 0))
+    except ValueError:
+        return HttpResponseBadRequest()
+    chats = Chat.objects.filter(user=request.user, id__in=chat_ids).only("id", "title")
+    untitled_chat_ids = [chat.id for chat in chats if chat.title == ""]
+    titling = (
+        len(untitled_chat_ids) > 0
+        and Job.objects.filter(
+            kind="title_chats",
+            user=request.user,
+            status__in=[Job.PENDING, Job.RUNNING],
+        ).exists()
     )
-    if chat_text == "":
-        return "Empty chat"
-    if len(chat_text) > 500:
-        chat_text = chat_text[:500]
-    prompt = f"""
-    Write a concise title (1-4 words) to the following chat. You must respond with at least one word:
-    {chat_text}
-    TITLE: """
-    return text_llm(prompt)
+    return render(
+        request,
+        "fragments/chat_titles.jinja",
+        {
+            # Once no job is left to title them, show untitled chats as such
+            "chats": [chat for chat in chats if chat.title != "" or not titling],
+            "untitled_chat_ids": untitled_chat_ids if titling else [],
+            "current_chat_id": current_chat_id,
+            "titling": titling,
+        },
+    )
+
+
+# Rows rendered per request on the documents page (more load on scroll)
+DOCUMENTS_PAGE_SIZE = 25
+
+
+def document_page(user, cursor=""):
+    """
+    One page of the user's documents, newest first, with only the columns
+    shown in the row headers (not the text, summary or embeddings). cursor is
+    the "<uploaded_at>|<id>" of the last row of the previous page.
+    Returns (documents, cursor of the next page or None).
+    """
+    documents = Document.objects.filter(user=user).only(
+        "id", "user", "title", "original_filename", "uploaded_at"
+    )
+    # Documents without an upload time (from before it was recorded) come
+    # last. Paging them separately keeps both queries on the index, whichever
+    # end of a descending index the database sorts NULLs to.
+    uploaded = documents.filter(uploaded_at__isnull=False).order_by(
+        "-uploaded_at", "-id"
+    )
+    not_uploaded = documents.filter(uploaded_at__isnull=True).order_by("-id")
+    if cursor:
+        uploaded_at, doc_id = cursor.split("|")
+        if uploaded_at:
+            uploaded_at = datetime.fromisoformat(uploaded_at)
+            uploaded = uploaded.filter(
+                Q(uploaded_at__lt=uploaded_at)
+                | Q(uploaded_at=uploaded_at, id__lt=doc_id)
+            )
+        else:
+            uploaded = uploaded.none()
+            not_uploaded = not_uploaded.filter(id__lt=doc_id)
+    documents = list(uploaded[: DOCUMENTS_PAGE_SIZE + 1])
+    if len(documents) <= DOCUMENTS_PAGE_SIZE:
+        documents += not_uploaded[: DOCUMENTS_PAGE_SIZE + 1 - len(documents)]
+    if len(documents) <= DOCUMENTS_PAGE_SIZE:
+        return documents, None
+    documents = documents[:DOCUMENTS_PAGE_SIZE]
+    last = documents[-1]
+    uploaded_at = last.uploaded_at.isoformat() if last.uploaded_at else ""
+    return documents, f"{uploaded_at}|{last.id}"
 
 
 class DocumentsView(LoginRequiredMixin, TemplateView):
@@ -263,9 +515,9 @@ class DocumentsView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         context["active_tab"] = "documents"
         context["upload_form"] = UploadForm()
-        context["documents"] = Document.objects.filter(user=self.request.user).order_by(
-            "-uploaded_at"
-        )
+        context["batch_upload_form"] = BatchUploadForm()
+        # Row bodies (summary, indexing, job progress) load when expanded
+        context["documents"], context["next_cursor"] = document_page(self.request.user)
         context["query_form"] = QueryForm()
         context["qa_form"] = QAForm()
         return context
@@ -283,33 +535,36 @@ class DocumentsView(LoginRequiredMixin, TemplateView):
         form = UploadForm(request.POST, request.FILES)
         if form.is_valid():
             uploaded_file = request.FILES["file"]
-            file_bytes = uploaded_file.file
-            temp_file = NamedTemporaryFile(delete=False)
-            temp_file.write(file_bytes.read())
-            temp_file.seek(0)
-            if uploaded_file.name.endswith(".pdf"):
-                loader = PyPDFLoader(temp_file.name)
-            else:
-                loader = TextLoader(temp_file.name, encoding="utf8")
-            docs = loader.load()
-            temp_file.close()
-            os.unlink(temp_file.name)
-            text = "\n\n".join([doc.page_content for doc in docs])
-            # Delete any existing documents with the same original_filename
-            # Document.objects.filter(
-            #     user=request.user, original_filename=uploaded_file.name
-            # ).delete()
-            instance = Document(
-                file=uploaded_file,
-                user=request.user,
-                uploaded_at=timezone.now(),
-                chunk_overlap=CHUNK_OVERLAP,
-                chunk_size=CHUNK_SIZE,
-                title=uploaded_file.name,
-                original_filename=uploaded_file.name,
-                text=text,
+            # PDFs are parsed in a worker process, page by page
+            text, page_offsets = extract_text(uploaded_file)
+            # Re-uploading a file with the same name updates the existing
+            # document; re-indexing then only embeds the chunks that changed
+            instance = (
+                Document.objects.filter(
+                    user=request.user, original_filename=uploaded_file.name
+                )
+                .order_by("-uploaded_at")
+                .first()
+            )
+            old_file = None
+            if instance is None:
+                instance = Document(user=request.user)
+            elif instance.file:
+                old_file = instance.file.name
+            fill_document(
+                instance,
+                uploaded_file.name,
+                uploaded_file,
+                text,
+                page_offsets,
+                timezone.now(),
             )
-            instance.save()
+            with transaction.atomic():
+                instance.save()
+                # The old file is only removed once the new one is committed,
+                # so a failed save leaves the document pointing at a file
+                if old_file and old_file != instance.file.name:
+                    transaction.on_commit(partial(default_storage.delete, old_file))
             return render(
                 request, "fragments/document_row.jinja", {"doc": instance, "new": True}
             )
@@ -319,44 +574,108 @@ class DocumentsView(LoginRequiredMixin, TemplateView):
     template_name = "documents.jinja"
 
 
-def summary(request, doc_id):
-    doc = Document.objects.get(id=doc_id)
-    title = generate_title(doc)
-    summary = summarize(doc)
-    # Add the document filename to the summary for embedding
-    summary_for_embedding = title + "\n" + doc.file.name + "\n\n" + summary
-    summary_embedding = gcp_embeddings.embed_documents([summary_for_embedding])[0]
-    Document.objects.filter(id=doc_id).update(
-        summary=summary,
-        title=title,
-        summary_embedding=summary_embedding,
+class BatchUploadView(LoginRequiredMixin, View):
+    """
+    Upload many files and/or zip archives at once. Files are written to
+    storage here, then parsed by an ingest_batch job, whose progress is shown
+    file by file; their summaries are queued as batch jobs.
+    """
+
+    def post(self, request, *args, **kwargs):
+        form = BatchUploadForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return HttpResponse(status=400)
+        with TemporaryDirectory() as directory:
+            files = stage_batch(request.user, form.cleaned_data["files"], directory)
+        stored = [f for f in files if not f.error]
+        rejected = [f for f in files if f.error]
+        job = None
+        if stored:
+            job = enqueue(
+                "ingest_batch",
+                user=request.user,
+                files=[{"name": f.name, "stored_name": f.stored_name} for f in stored],
+                rejected=[{"name": f.name, "error": f.error} for f in rejected],
+            )
+        return render(
+            request,
+            "fragments/batch_upload_status.jinja",
+            {"job": job, "files": rejected, "documents": []},
+        )
+
+
+def batch_upload_results(request, job):
+    # The documents of a finished ingest_batch job, and the files that failed
+    results = job.args.get("results", [])
+    documents = Document.objects.filter(
+        user=request.user,
+        id__in=[r["document_id"] for r in results if r["document_id"]],
+    ).defer("summary_embedding", "mean_embedding")
+    active_jobs = {}
+    for summary_job in Job.objects.filter(
+        document__in=documents, status__in=[Job.PENDING, Job.RUNNING]
+    ):
+        active_jobs.setdefault(summary_job.document_id, {})[
+            summary_job.kind
+        ] = summary_job
+    return render(
+        request,
+        "fragments/batch_upload_results.jinja",
+        {
+            "files": results + job.args.get("rejected", []),
+            "documents": documents.order_by("-uploaded_at", "-id"),
+            "active_jobs": active_jobs,
+            "new": True,
+        },
     )
-    doc = Document.objects.get(id=doc_id)
-    return render(request, "fragments/summary.jinja", {"doc": doc})
 
 
-def summarize(document):
-    docs = [
-        LcDocument(
-            page_content=document.file.name + document.text[:10000],
+def document_rows(request):
+    # HTMX infinite scroll route: the next page of document rows
+    if not request.user.is_authenticated:
+        return HttpResponse(status=403)
+    try:
+        documents, next_cursor = document_page(
+            request.user, request.GET.get("cursor", "")
         )
-    ]
-    summary = summarize_chain.run(docs)
-    # Sometimes the summarizer returns an empty string
-    if summary == "":
-        summary = document.file.name
-    return summary
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+    return render(
+        request,
+        "fragments/document_rows.jinja",
+        {"documents": documents, "next_cursor": next_cursor},
+    )
 
 
-def generate_title(document):
-    if len(document.text) < 10:
-        return document.file.name
-    text = f"Filename: {document.file.name}\n\nContent (first 5,000 characters): {document.text[:5000]}"
-    prompt = f"""
-    Write a concise title (1-5 words) for the following document. You must respond with at least one word:
-    {text}
-    1-5 WORD TITLE: """
-    return text_llm(prompt)[:255]
+def document_body(request, doc_id):
+    # Whether the document is indexed, without loading its vectors
+    doc = (
+        Document.objects.defer("summary_embedding", "mean_embedding")
+        .annotate(has_mean=Q(mean_embedding__isnull=False))
+        .get(id=doc_id)
+    )
+    if not doc.user_id == request.user.id:
+        return HttpResponse(status=403)
+    # Pending/running jobs, so the row shows progress instead of buttons
+    active_jobs = {
+        doc.id: {
+            job.kind: job
+            for job in doc.jobs.filter(status__in=[Job.PENDING, Job.RUNNING])
+        }
+    }
+    return render(
+        request,
+        "fragments/document_body.jinja",
+        {"doc": doc, "active_jobs": active_jobs},
+    )
+
+
+def summary(request, doc_id):
+    doc = Document.objects.get(id=doc_id)
+    if not doc.user == request.user:
+        return HttpResponse(status=403)
+    job = enqueue("summary", document=doc, priority=Job.INTERACTIVE)
+    return render(request, "fragments/job_progress.jinja", {"job": job, "doc": doc})
 
 
 def full_text(request, doc_id):
@@ -365,41 +684,45 @@ def full_text(request, doc_id):
 
 
 def generate_embeddings(request, doc_id):
-    doc = Document.objects.filter(id=doc_id).first()
-    chunks = text_splitter.split_text(doc.text)
-    for i, chunk in enumerate(chunks):
-        DocumentChunk.objects.create(
-            document=doc,
-            chunk_number=i,
-            text=chunk,
-        )
-    chunks = doc.chunks.all().order_by("chunk_number")
-    texts = chunks.values_list("text", flat=True)
-    # Add some extra context to each chunk, e.g. filename, title, summary, tags
-    texts = [
-        """Filename: {doc.file.name}
-Document title: {doc.title}
-Document summary: {doc.summary}\n
-Chunk content: {text}"""
-        for text in texts
-    ]
-    embeddings = gcp_embeddings.embed_documents(texts)
-    for i, chunk in enumerate(chunks):
-        chunk.embedding = embeddings[i]
-    DocumentChunk.objects.bulk_update(chunks, ["embedding"])
-    Document.objects.filter(id=doc_id).update(
-        mean_embedding=np.mean(embeddings, axis=0)
+    doc = Document.objects.get(id=doc_id)
+    if not doc.user == request.user:
+        return HttpResponse(status=403)
+    job = enqueue("embeddings", document=doc, priority=Job.INTERACTIVE)
+    return render(request, "fragments/job_progress.jinja", {"job": job, "doc": doc})
+
+
+def job_status(request, job_id):
+    # HTMX polling route: re-renders the progress bar until the job finishes,
+    # then swaps in the finished fragment for that kind of job
+    job = (
+        Job.objects.select_related("document")
+        .defer("document__summary_embedding", "document__mean_embedding")
+        .get(id=job_id)
     )
-    doc = Document.objects.filter(id=doc_id).prefetch_related("chunks").first()
-    return render(request, "fragments/embeddings_preview.jinja", {"doc": doc})
+    if not job.user == request.user:
+        return HttpResponse(status=403)
+    doc = job.document
+    if job.status == Job.DONE and job.kind == "summary":
+        doc.refresh_from_db()
+        embeddings_job = doc.jobs.filter(kind="embeddings").order_by("-id").first()
+        return render(
+            request,
+            "fragments/summary.jinja",
+            {"doc": doc, "embeddings_job": embeddings_job},
+        )
+    if job.status == Job.DONE and job.kind == "embeddings":
+        return render(request, "fragments/embeddings_preview.jinja", {"doc": doc})
+    if job.status == Job.DONE and job.kind == "ingest_batch":
+        return batch_upload_results(request, job)
+    return render(request, "fragments/job_progress.jinja", {"job": job, "doc": doc})
 
 
-def query_embeddings(request):
+async def query_embeddings(request):
     query = request.GET.get("query")
     if query is None:
         return HttpResponse(status=400)
-    documents_by_summary, chunks_by_embedding = get_docs_chunks_by_embedding(
-        request, query
+    documents_by_summary, chunks_by_embedding = await aget_docs_chunks_by_embedding(
+        await request_user(request), query
     )
     return render(
         request,
@@ -412,25 +735,15 @@ def query_embeddings(request):
     )
 
 
-def qa_embeddings(request):
+async def qa_embeddings(request):
     query = request.GET.get("query")
     if query is None:
         return HttpResponse(status=400)
-    documents_by_summary, chunks_by_embedding = get_docs_chunks_by_embedding(
-        request, query, max_distance=0.5
+    documents_by_summary, chunks_by_embedding = await aget_docs_chunks_by_embedding(
+        await request_user(request), query, max_distance=0.5
     )
-    response = get_qa_response(
-        query,
-        [
-            LcDocument(page_content=doc.summary, metadata={"source": doc.file.name})
-            for doc in documents_by_summary
-        ]
-        + [
-            LcDocument(
-                page_content=chunk.text, metadata={"source": chunk.document.file.name}
-            )
-            for chunk in chunks_by_embedding
-        ],
+    response = await aget_qa_response(
+        query, qa_documents(documents_by_summary, chunks_by_embedding)
     )
     if "\nSOURCES" in response:
         response = (
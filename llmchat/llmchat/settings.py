@@ -12,11 +12,11 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import io
 import os
+import tempfile
 from pathlib import Path
 from urllib.parse import urlparse
 
 import environ
-from google.cloud import secretmanager
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,6 +50,8 @@ elif os.getenv("TRAMPOLINE_CI", None):
 elif os.environ.get("GOOGLE_CLOUD_PROJECT", None):
     # Pull secrets from Secret Manager
     project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    # Slow to import, and not needed with a local .env
+    from google.cloud import secretmanager
 
     client = secretmanager.SecretManagerServiceClient()
     settings_name = os.environ.get("SETTINGS_NAME", "django_settings")
@@ -207,6 +209,35 @@ if os.getenv("TRAMPOLINE_CI", None):
         }
     }
 
+# Vector search engine (see chat/llm_utils/vector_store.py): "pgvector" searches
+# in Postgres, "numpy" in-process from memory-mapped files (works with sqlite)
+VECTOR_STORE = env(
+    "VECTOR_STORE", default="numpy" if os.getenv("TRAMPOLINE_CI") else "pgvector"
+)
+VECTOR_STORE_DIR = env(
+    "VECTOR_STORE_DIR", default=os.path.join(tempfile.gettempdir(), "llmchat-vectors")
+)
+# Search half precision chunk vectors first, then re-rank at full precision
+# (pgvector engine only; needs pgvector >= 0.7)
+VECTOR_COMPACT_SEARCH = env.bool("VECTOR_COMPACT_SEARCH", default=False)
+
+# Document chunking (see chat/llm_utils/chunking.py): tokens per chunk and
+# shared between consecutive chunks, counted with the Hugging Face tokenizer
+# saved at CHUNK_TOKENIZER by `manage.py fetch_tokenizer`. Empty to estimate
+# tokens from the number of characters instead.
+CHUNK_TOKENS = env.int("CHUNK_TOKENS", default=500)
+CHUNK_OVERLAP_TOKENS = env.int("CHUNK_OVERLAP_TOKENS", default=50)
+CHUNK_TOKENIZER = env(
+    "CHUNK_TOKENIZER",
+    default=(
+        "" if os.getenv("TRAMPOLINE_CI") else os.path.join(BASE_DIR, "tokenizer.json")
+    ),
+)
+
+# Stream canned chat responses instead of calling Vertex AI (offline testing,
+# see chat/llm_utils/streaming.py)
+FAKE_LLM = env.bool("FAKE_LLM", default=False)
+
 STORAGES = {
     "default": {"BACKEND": "storages.backends.gcloud.GoogleCloudStorage"},
     "staticfiles": {
@@ -214,6 +245,8 @@ STORAGES = {
     },
 }
 GS_BUCKET_NAME = env("GS_BUCKET_NAME")
+# Batch uploads (chat.llm_utils.ingestion.MAX_BATCH_FILES)
+DATA_UPLOAD_MAX_NUMBER_FILES = 500
 GS_BLOB_CHUNK_SIZE = 5 * 1024 * 1024
 GS_FILE_OVERWRITE = False
 